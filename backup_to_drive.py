@@ -1,116 +1,1295 @@
 import os
+import sys
+import time
+import signal
+import random
+import hashlib
+import functools
+import asyncio
+import threading
 import requests
+import json
 import base64
+from bisect import bisect_left
+from contextlib import contextmanager
 from datetime import datetime, timezone
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 from postgrest import SyncPostgrestClient
+try:
+    # [추가] asyncio 엔진용 (postgrest 설치 시 함께 설치되는 httpx 사용)
+    import httpx
+    from postgrest import AsyncPostgrestClient
+except ImportError:
+    httpx, AsyncPostgrestClient = None, None
 
 # 1. 환경 변수 로드
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 GAS_URL = os.environ.get("GAS_URL")
 
-def process_single_image(client, memo_id, project_id, url):
-    """개별 이미지를 다운로드하여 구글 드라이브로 백업하는 작업 단위 (Thread용)"""
-    url = url.strip()
-    if not url or "r2.dev" not in url:
+# [추가] 완료 이력 일괄 조회 시 in 쿼리 1회당 URL 수 (GET URL 길이 제한 고려)
+PREFETCH_CHUNK_SIZE = 50
+# [추가] 전체 메모가 공유하는 업로드 워커 수
+BACKUP_WORKERS = int(os.environ.get("BACKUP_WORKERS", "4"))
+# [추가] 전송 방식: stream(Drive 재개 가능 업로드 세션으로 청크 전송) / base64(기존 GAS JSON 전송)
+TRANSFER_MODE = os.environ.get("BACKUP_TRANSFER_MODE", "stream")
+# [추가] 스트리밍 청크 크기 (Drive 재개 가능 업로드 규격상 마지막 청크 외에는 256KiB의 배수)
+UPLOAD_CHUNK_SIZE = max(1, int(os.environ.get("BACKUP_CHUNK_KB", "8192")) // 256) * 256 * 1024
+# [추가] 실행 엔진: thread(기본, 스레드 풀) / async(asyncio + 비동기 HTTP/PostgREST 클라이언트)
+BACKUP_ENGINE = os.environ.get("BACKUP_ENGINE", "thread")
+# [추가] async 엔진의 동시 처리 파일 수 (다운로드/업로드/로그 기록 포함)
+BACKUP_CONCURRENCY = int(os.environ.get("BACKUP_CONCURRENCY", "100"))
+# 백업 대상 URL 판별용 호스트 (로컬 테스트 서버 사용 시 변경)
+R2_HOST_MARKER = os.environ.get("R2_HOST_MARKER", "r2.dev")
+# [추가] 재시도 정책 (429/5xx 및 연결 오류 시 지수 백오프 + 지터)
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", "5"))
+RETRY_BASE_DELAY = float(os.environ.get("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.environ.get("RETRY_MAX_DELAY", "30"))
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# [추가] GAS 호출 속도 제한 (Apps Script 동시 실행/일일 호출 한도 보호용 토큰 버킷)
+# [수정] 파일 1건당 GAS 호출이 1회(세션 발급 또는 base64 업로드)이므로 이 값이 곧 처리량 상한(files/s)이며 워커/동시 처리 수보다 우선합니다.
+# 기본값 5는 Apps Script 웹 앱의 사용자당 동시 실행 한도(30)를 기준으로, GAS 실행 1건이 수 초(base64 업로드 시 디코딩 + Drive 저장)
+# 걸려도 동시 실행이 한도 안에 머무르도록 정한 보수적인 값입니다. 세션 발급만 하는 stream 방식에서 GAS 응답이 빠르거나
+# 429가 나오지 않으면 올리고(≈ 30 / GAS 평균 응답 시간(초)), 0이면 제한하지 않습니다.
+GAS_RATE_PER_SEC = float(os.environ.get("GAS_RATE_PER_SEC", "5"))
+GAS_BURST = int(os.environ.get("GAS_BURST", "10"))
+# [추가] 콘텐츠 해시(MD5) 기준 중복 제거, 같은 프로젝트 안에서만 연결 (기본 꺼짐)
+# 켜기 전에 backup_logs.content_hash 컬럼 필요: sql/backup_logs_content_hash.sql (없으면 로그 기록이 모두 실패)
+CONTENT_DEDUP = os.environ.get("BACKUP_CONTENT_DEDUP", "0") == "1"
+# [추가] 대기 메모 선점 페이지 크기 (id 기준 keyset 페이지 단위로 pending → processing 전환)
+# [수정] 기본값(0)은 동시 처리 수만큼만 선점 (비정상 종료 시 processing에 남는 메모를 작업 창 크기로 제한)
+CLAIM_PAGE_SIZE = int(os.environ.get("CLAIM_PAGE_SIZE", "0"))
+# [추가] 쓰기 지연(write-behind) 버퍼: 건수 또는 시간 간격 도달 시 일괄 기록
+WRITE_BATCH_SIZE = int(os.environ.get("WRITE_BATCH_SIZE", "200"))
+WRITE_FLUSH_INTERVAL = float(os.environ.get("WRITE_FLUSH_INTERVAL", "2.0"))
+# [추가] 실행 요약 저장: JSON 파일 경로 / backup_runs 테이블 기록 여부 (sql/backup_runs.sql)
+BACKUP_REPORT_PATH = os.environ.get("BACKUP_REPORT_PATH")
+BACKUP_RECORD_RUNS = os.environ.get("BACKUP_RECORD_RUNS", "0") == "1"
+
+class TokenBucket:
+    """초당 rate개 토큰을 채우고 최대 burst개까지 모아두는 스레드 안전 속도 제한기"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _try_take(self):
+        """토큰이 있으면 1개 소비하고 0, 없으면 다음 토큰까지 남은 시간(초) 반환"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """토큰 1개를 얻을 때까지 대기하고 대기한 시간(초)을 반환"""
+        waited = 0.0
+        while self.rate > 0:
+            delay = self._try_take()
+            if not delay:
+                break
+            time.sleep(delay)
+            waited += delay
+        return waited
+
+    async def acquire_async(self):
+        """acquire()의 asyncio 버전 (이벤트 루프를 막지 않고 대기)"""
+        waited = 0.0
+        while self.rate > 0:
+            delay = self._try_take()
+            if not delay:
+                break
+            await asyncio.sleep(delay)
+            waited += delay
+        return waited
+
+# [추가] 단계별 지연 시간 히스토그램 구간 상한(초)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class TransferStats:
+    """처리량/재시도 카운터 + 단계별 지연 시간 히스토그램 (워커 스레드에서 공유)
+
+    단계(stage): r2/gas/drive(요청~응답 헤더), r2_read(본문 수신 대기), db_claim/db_lookup/db_write(PostgREST), file(파일 1건 전체)
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.stages = {}
+        self.started = time.monotonic()
+        self.started_at = datetime.now(timezone.utc)
+
+    def add(self, key, value=1):
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def get(self, key):
+        return self.counters.get(key, 0)
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            hist = self.stages.get(stage)
+            if hist is None:
+                hist = self.stages[stage] = {"count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * (len(LATENCY_BUCKETS) + 1)}
+            hist["count"] += 1
+            hist["sum"] += seconds
+            hist["max"] = max(hist["max"], seconds)
+            hist["buckets"][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def _percentile(self, hist, q):
+        """히스토그램 구간 상한 기준 근사 백분위수(초)"""
+        rank = q * hist["count"]
+        seen = 0
+        for i, n in enumerate(hist["buckets"]):
+            seen += n
+            if n and seen >= rank:
+                return min(LATENCY_BUCKETS[i], hist["max"]) if i < len(LATENCY_BUCKETS) else hist["max"]
+        return hist["max"]
+
+    def stage_summary(self):
+        with self.lock:
+            stages = {k: dict(v, buckets=list(v["buckets"])) for k, v in self.stages.items()}
+        return {
+            stage: {
+                "count": h["count"],
+                "total_sec": round(h["sum"], 3),
+                "mean_ms": round(h["sum"] / h["count"] * 1000, 1),
+                "p50_ms": round(self._percentile(h, 0.5) * 1000, 1),
+                "p95_ms": round(self._percentile(h, 0.95) * 1000, 1),
+                "p99_ms": round(self._percentile(h, 0.99) * 1000, 1),
+                "max_ms": round(h["max"] * 1000, 1),
+                "buckets": dict(zip([str(b) for b in LATENCY_BUCKETS] + ["inf"], h["buckets"])),
+            }
+            for stage, h in sorted(stages.items())
+        }
+
+    def summary(self, engine=None):
+        """실행 요약 (JSON 리포트 / backup_runs 행)"""
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        with self.lock:
+            counters = dict(self.counters)
+        return {
+            "started_at": self.started_at.isoformat(),
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "engine": engine or BACKUP_ENGINE,
+            "workers": BACKUP_WORKERS,
+            "concurrency": BACKUP_CONCURRENCY,
+            "transfer_mode": TRANSFER_MODE,
+            "elapsed_sec": round(elapsed, 3),
+            "files_completed": counters.get("files_completed", 0),
+            "files_failed": counters.get("files_failed", 0),
+            "files_skipped": counters.get("files_skipped", 0),
+            "files_deduped": counters.get("files_deduped", 0),
+            "bytes_downloaded": counters.get("bytes_downloaded", 0),
+            "bytes_uploaded": counters.get("bytes_uploaded", 0),
+            "download_bytes_per_sec": round(counters.get("bytes_downloaded", 0) / elapsed, 1),
+            "upload_bytes_per_sec": round(counters.get("bytes_uploaded", 0) / elapsed, 1),
+            "files_per_sec": round(counters.get("files_completed", 0) / elapsed, 3),
+            "counters": counters,
+            "stages": self.stage_summary(),
+        }
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        down_mb = self.get("bytes_downloaded") / (1024 * 1024)
+        up_mb = self.get("bytes_uploaded") / (1024 * 1024)
+        print(f"📈 처리 통계 ({elapsed:.1f}s): 완료 {self.get('files_completed')} / 실패 {self.get('files_failed')} / 스킵 {self.get('files_skipped')} / 중복 연결 {self.get('files_deduped')}")
+        print(f"   다운로드 {down_mb:.1f}MB ({down_mb / elapsed:.2f}MB/s), 업로드 {up_mb:.1f}MB ({up_mb / elapsed:.2f}MB/s), "
+              f"{self.get('files_completed') / elapsed:.2f} files/s")
+        retries = {k[len('retries_'):]: v for k, v in sorted(self.counters.items()) if k.startswith('retries_')}
+        print(f"   재시도 {retries or 0}, GAS 속도 제한 대기 {self.get('throttle_wait'):.1f}s")
+        for stage, h in self.stage_summary().items():
+            print(f"   ⏱️ {stage:<10} {h['count']:>6}회  합계 {h['total_sec']:>8.1f}s  평균 {h['mean_ms']:>7.1f}ms  "
+                  f"p50 {h['p50_ms']:>7.1f}ms  p95 {h['p95_ms']:>7.1f}ms  최대 {h['max_ms']:>7.1f}ms")
+
+def timed(stage):
+    """함수(동기/비동기) 실행 시간을 STATS 단계 히스토그램에 기록하는 데코레이터"""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    STATS.observe(stage, time.perf_counter() - start)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with STATS.timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _chunked(items, size):
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+class WriteBehindBuffer:
+    """backup_logs UPSERT와 memos.backup_status 변경을 모아 일괄 요청으로 기록
+
+    - 같은 r2_url / memo_id는 마지막 값만 유지합니다.
+    - 한 번의 flush에서 로그를 먼저 기록하고, 로그 기록이 모두 성공한 경우에만 메모 상태를 기록합니다.
+      (메모가 completed/failed로 기록되었다면 해당 메모의 로그도 반드시 기록된 상태)
+    - 기록 실패 시 항목을 버퍼에 되돌려 다음 flush에서 재시도하고, 종료 시 close()로 남은 항목을 기록합니다.
+    """
+
+    def __init__(self, batch_size=WRITE_BATCH_SIZE, interval=WRITE_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.async_flush_lock = None
+        self.logs = {}
+        self.memo_status = {}
+        self.last_flush = time.monotonic()
+
+    def add_log(self, row):
+        with self.lock:
+            self.logs[row["r2_url"]] = row
+
+    def set_memo_status(self, memo_id, status):
+        with self.lock:
+            self.memo_status[memo_id] = status
+
+    def pending(self):
+        return len(self.logs) + len(self.memo_status)
+
+    def should_flush(self):
+        count = self.pending()
+        return count >= self.batch_size or (count and time.monotonic() - self.last_flush >= self.interval)
+
+    def _take(self):
+        with self.lock:
+            logs, statuses = list(self.logs.values()), dict(self.memo_status)
+            self.logs.clear()
+            self.memo_status.clear()
+            self.last_flush = time.monotonic()
+        return logs, statuses
+
+    def _requeue(self, logs, statuses):
+        # 되돌릴 때 그사이 들어온 최신 값은 덮어쓰지 않음
+        with self.lock:
+            for row in logs:
+                self.logs.setdefault(row["r2_url"], row)
+            for memo_id, status in statuses.items():
+                self.memo_status.setdefault(memo_id, status)
+
+    def _requests(self, logs, statuses):
+        """(테이블, 작업) 목록 생성: 키 구성이 같은 로그 행끼리 묶어 UPSERT, 상태별로 묶어 메모 UPDATE"""
+        log_groups = {}
+        for row in logs:
+            log_groups.setdefault(tuple(sorted(row)), []).append(row)
+        log_batches = [chunk for rows in log_groups.values() for chunk in _chunked(rows, self.batch_size)]
+        status_groups = {}
+        for memo_id, status in statuses.items():
+            status_groups.setdefault(status, []).append(memo_id)
+        memo_batches = [(status, chunk) for status, ids in status_groups.items() for chunk in _chunked(ids, PREFETCH_CHUNK_SIZE * 4)]
+        return log_batches, memo_batches
+
+    def flush(self, client):
+        """버퍼 내용을 일괄 기록 (성공 여부 반환)"""
+        with self.flush_lock:
+            logs, statuses = self._take()
+            if not logs and not statuses:
+                return True
+            log_batches, memo_batches = self._requests(logs, statuses)
+            try:
+                for rows in log_batches:
+                    with STATS.timer("db_write"):
+                        client.table("backup_logs").upsert(rows, on_conflict="r2_url").execute()
+            except BaseException as e:
+                # [수정] 인터럽트/취소로 중단되어도 꺼낸 항목을 버퍼로 되돌린 뒤 다시 발생시킴
+                self._requeue(logs, statuses)
+                if not isinstance(e, Exception): raise
+                print(f"⚠️ backup_logs 일괄 기록 실패, 다음에 재시도합니다. ({e})")
+                return False
+            try:
+                for status, ids in memo_batches:
+                    with STATS.timer("db_write"):
+                        client.table("memos").update({"backup_status": status}).in_("id", ids).execute()
+            except BaseException as e:
+                self._requeue([], statuses)
+                if not isinstance(e, Exception): raise
+                print(f"⚠️ memos 상태 일괄 기록 실패, 다음에 재시도합니다. ({e})")
+                return False
+            STATS.add("db_batches", len(log_batches) + len(memo_batches))
+            return True
+
+    async def aflush(self, client):
+        """flush()의 asyncio 버전 (AsyncPostgrestClient 사용)"""
+        if self.async_flush_lock is None:
+            self.async_flush_lock = asyncio.Lock()
+        async with self.async_flush_lock:
+            logs, statuses = self._take()
+            if not logs and not statuses:
+                return True
+            log_batches, memo_batches = self._requests(logs, statuses)
+            try:
+                await asyncio.gather(*[_atimed_execute("db_write", client.table("backup_logs").upsert(rows, on_conflict="r2_url")) for rows in log_batches])
+            except BaseException as e:
+                # [수정] 작업 취소(CancelledError)로 중단되어도 꺼낸 항목을 버퍼로 되돌린 뒤 다시 발생시킴
+                self._requeue(logs, statuses)
+                if not isinstance(e, Exception): raise
+                print(f"⚠️ backup_logs 일괄 기록 실패, 다음에 재시도합니다. ({e})")
+                return False
+            try:
+                await asyncio.gather(*[_atimed_execute("db_write", client.table("memos").update({"backup_status": status}).in_("id", ids)) for status, ids in memo_batches])
+            except BaseException as e:
+                self._requeue([], statuses)
+                if not isinstance(e, Exception): raise
+                print(f"⚠️ memos 상태 일괄 기록 실패, 다음에 재시도합니다. ({e})")
+                return False
+            STATS.add("db_batches", len(log_batches) + len(memo_batches))
+            return True
+
+    def close(self, client, attempts=3):
+        """종료 시 남은 항목을 모두 기록 (실패 시 백오프 후 재시도)"""
+        for attempt in range(attempts):
+            if self.flush(client) and not self.pending():
+                return True
+            time.sleep(_retry_delay(attempt))
+        print(f"❌ 기록하지 못한 항목 {self.pending()}건이 남았습니다.")
+        return False
+
+    async def aclose(self, client, attempts=3):
+        for attempt in range(attempts):
+            if await self.aflush(client) and not self.pending():
+                return True
+            await asyncio.sleep(_retry_delay(attempt))
+        print(f"❌ 기록하지 못한 항목 {self.pending()}건이 남았습니다.")
+        return False
+
+class ContentHashIndex:
+    """(project_id, content_hash) → drive_file_id 캐시 + 같은 키의 동시 업로드 방지
+
+    lookup_or_reserve()가 (file_id, None)이면 이미 알려진 파일, (None, event)면 다른 작업이 업로드 중이므로
+    event 대기 후 다시 조회, (None, None)이면 호출자가 업로드 담당이며 끝나면 반드시 resolve()를 호출합니다.
+    """
+
+    def __init__(self, event_factory=threading.Event):
+        self.event_factory = event_factory
+        self.lock = threading.Lock()
+        self.known = {}
+        self.inflight = {}
+
+    def lookup_or_reserve(self, key):
+        with self.lock:
+            if key in self.known:
+                return self.known[key], None
+            event = self.inflight.get(key)
+            if event is not None:
+                return None, event
+            self.inflight[key] = self.event_factory()
+            return None, None
+
+    def resolve(self, key, drive_file_id):
+        with self.lock:
+            if drive_file_id:
+                self.known[key] = drive_file_id
+            event = self.inflight.pop(key, None)
+        if event is not None:
+            event.set()
+
+def _etag_md5(headers):
+    """R2 ETag가 단일 업로드 MD5(32자리 hex)면 반환 (멀티파트 ETag 'xxx-N'은 내용 해시가 아니므로 None)"""
+    etag = (headers.get("ETag") or "").strip()
+    if etag.startswith("W/"):
+        return None
+    etag = etag.strip('"').lower()
+    if len(etag) == 32 and all(c in "0123456789abcdef" for c in etag):
+        return etag
+    return None
+
+def _hash_lookup_query(client, project_id, content_hash):
+    # [수정] 다른 프로젝트 폴더의 Drive 파일에 연결되지 않도록 같은 프로젝트로 한정
+    return client.table("backup_logs").select("drive_file_id").eq("project_id", project_id).eq("content_hash", content_hash) \
+        .eq("status", "completed").not_.is_("drive_file_id", "null").limit(1)
+
+def find_existing_backup(client, hash_index, project_id, content_hash):
+    """같은 프로젝트에 같은 내용의 완료된 백업이 있으면 drive_file_id 반환 (없으면 None, 이 경우 호출자가 업로드 후 resolve)"""
+    key = (project_id, content_hash)
+    while True:
+        drive_file_id, event = hash_index.lookup_or_reserve(key)
+        if drive_file_id:
+            return drive_file_id
+        if event is None:
+            break
+        event.wait()
+    try:
+        with STATS.timer("db_lookup"):
+            rows = _hash_lookup_query(client, project_id, content_hash).execute().data
+    except Exception as e:
+        print(f"⚠️ 해시 중복 조회 실패: {content_hash} ({e})")
+        rows = []
+    if rows:
+        hash_index.resolve(key, rows[0]["drive_file_id"])
+        return rows[0]["drive_file_id"]
+    return None
+
+STATS = TransferStats()
+GAS_LIMITER = TokenBucket(GAS_RATE_PER_SEC, GAS_BURST)
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_session(endpoint):
+    """엔드포인트(r2/gas/drive)별 연결 풀 공유 세션 (TLS 연결 재사용)"""
+    with _sessions_lock:
+        session = _sessions.get(endpoint)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(BACKUP_WORKERS, 10))
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[endpoint] = session
+        return session
+
+def _retry_delay(attempt, res=None):
+    """Retry-After 헤더 우선, 없으면 Full Jitter 지수 백오프"""
+    if res is not None and res.headers.get("Retry-After"):
+        try:
+            return min(RETRY_MAX_DELAY, float(res.headers["Retry-After"]))
+        except ValueError:
+            pass
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+def _request_not_sent(exc):
+    """연결 자체가 이루어지지 않아 요청이 서버에 도달하지 않았는지 (연결 거부/연결 시간 초과)"""
+    if isinstance(exc, requests.ConnectTimeout):
         return True
+    reason = getattr(exc.args[0], "reason", None) if exc.args else None
+    return isinstance(reason, NewConnectionError)
+
+def request_with_retry(endpoint, method, url, limiter=None, idempotent=True, **kwargs):
+    """공유 세션으로 요청하고 429/5xx/연결 오류 시 백오프 후 재시도 (마지막 응답 또는 예외 반환)
+
+    [추가] idempotent=False(GAS uploadToDrive 등 재전송 시 중복 생성되는 요청)면 요청이 도달하지 않은 연결 오류와
+    429만 재시도하고, 응답 시간 초과나 5xx는 서버가 이미 처리했을 수 있으므로 그대로 반환/예외 처리합니다.
+    """
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        if limiter:
+            STATS.add("throttle_wait", limiter.acquire())
+        try:
+            with STATS.timer(endpoint):
+                res = get_session(endpoint).request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt >= HTTP_MAX_RETRIES or not (idempotent or _request_not_sent(e)):
+                raise
+            delay = _retry_delay(attempt)
+        else:
+            if res.status_code not in RETRY_STATUS or attempt >= HTTP_MAX_RETRIES or not (idempotent or res.status_code == 429):
+                return res
+            delay = _retry_delay(attempt, res)
+            res.close()
+        STATS.add(f"retries_{endpoint}")
+        time.sleep(delay)
+
+def _pending_page_query(client, last_id, page_size):
+    query = client.table("memos").select("id").eq("backup_status", "pending").order("id").limit(page_size)
+    if last_id is not None:
+        query = query.gt("id", last_id)
+    return query
+
+def _claim_query(client, ids):
+    # 조건부 UPDATE: 그사이 다른 실행이 가져간(더 이상 pending이 아닌) 행은 갱신/반환되지 않음
+    return client.table("memos").update({"backup_status": "processing"}).in_("id", ids).eq("backup_status", "pending")
+
+def iter_claimed_memos(client, page_size):
+    """pending 메모를 id 순 keyset 페이지로 조회하고 processing으로 선점하여 페이지 단위로 반환
+
+    선점은 'backup_status = pending' 조건부 UPDATE이므로 동시에 실행되는 다른 인스턴스와
+    같은 메모를 중복 처리하지 않습니다. 반환 행에는 UPDATE 결과(id, project_id, image_url 등)가 담깁니다.
+    """
+    last_id = None
+    while True:
+        with STATS.timer("db_claim"):
+            rows = _pending_page_query(client, last_id, page_size).execute().data
+        if not rows:
+            return
+        last_id = rows[-1]["id"]
+        with STATS.timer("db_claim"):
+            claimed = _claim_query(client, [row["id"] for row in rows]).execute().data
+        if claimed:
+            yield sorted(claimed, key=lambda m: m["id"])
+        if len(rows) < page_size:
+            return
+
+def fetch_completed_urls(client, urls):
+    """이미 백업 완료된 r2_url 집합을 청크 단위 in 쿼리로 일괄 조회 (실패 시 None)"""
+    urls = list(dict.fromkeys(urls))
+    completed = set()
+    try:
+        for i in range(0, len(urls), PREFETCH_CHUNK_SIZE):
+            chunk = urls[i:i + PREFETCH_CHUNK_SIZE]
+            with STATS.timer("db_lookup"):
+                rows = client.table("backup_logs").select("r2_url").in_("r2_url", chunk).eq("status", "completed").execute().data
+            completed.update(row["r2_url"] for row in rows)
+    except Exception as e:
+        print(f"⚠️ 완료 이력 일괄 조회 실패, 파일별 조회로 대체합니다. ({e})")
+        return None
+    return completed
+
+# [추가] GAS 업로드 세션 지원 여부 (None: 아직 모름, 미지원 응답을 받으면 False로 고정하여 재요청하지 않음)
+_upload_session_supported = None
+
+def _unknown_action_error(error):
+    """GAS 오류 메시지가 배포되지 않은 액션을 뜻하는지 (예: 'unknown action createUploadSession')"""
+    text = str(error or "").lower()
+    return "action" in text and any(word in text for word in ("unknown", "invalid", "unsupported", "not supported"))
+
+def _session_url(res):
+    """세션 발급 응답에서 업로드 URL 추출 (실패면 None)
+
+    [수정] 미지원으로 고정하는 것은 확실한 신호(JSON이 아닌 응답(HTML 오류 페이지 등) 또는 알 수 없는 액션 오류)뿐이며,
+    재시도 후에도 남은 5xx나 일시적인 {"success": false}는 이 파일만 base64로 보내고 스트리밍은 계속 사용합니다.
+    """
+    global _upload_session_supported
+    if res.status_code in RETRY_STATUS:
+        return None
+    try:
+        body = res.json()
+    except ValueError:
+        body = None
+    if isinstance(body, dict) and body.get("success") and body.get("uploadUrl"):
+        _upload_session_supported = True
+        return body["uploadUrl"]
+    unsupported = not isinstance(body, dict) or _unknown_action_error(body.get("error"))
+    if unsupported and _upload_session_supported is None:
+        print("ℹ️ GAS가 업로드 세션을 지원하지 않아 이후 파일은 base64 방식으로 전송합니다.")
+        _upload_session_supported = False
+    return None
+
+def create_upload_session(file_name, project_id, mime_type, size=None):
+    """GAS에 Drive 재개 가능 업로드 세션 발급 요청 (세션 URL 반환, 미지원이면 None)
+
+    GAS 요청: {"action": "createUploadSession", "fileName", "mimeType", "projectId", "fileSize"}
+    GAS 응답: {"success": true, "uploadUrl": "<Drive resumable session URL>"}
+    """
+    if _upload_session_supported is False:
+        return None
+    payload = _upload_session_payload(file_name, project_id, mime_type, size)
+    return _session_url(request_with_retry("gas", "POST", f"{GAS_URL}?action=createUploadSession", limiter=GAS_LIMITER, json=payload, timeout=60))
+
+def _upload_session_payload(file_name, project_id, mime_type, size):
+    return {
+        "action": "createUploadSession",
+        "fileName": file_name,
+        "mimeType": mime_type,
+        "projectId": str(project_id),
+        "fileSize": size
+    }
+
+def _base64_payload(content, file_name, project_id, mime_type):
+    return {
+        "action": "uploadToDrive",
+        "fileName": file_name,
+        "fileData": base64.b64encode(content).decode('utf-8'),
+        "mimeType": mime_type,
+        "projectId": str(project_id)
+    }
+
+def _content_range(offset, sent, chunk_len, total_size, is_last):
+    """재개 가능 업로드의 Content-Range 헤더 값 (마지막 청크에서 전체 크기 확정)"""
+    start = offset + sent
+    total = str(offset + chunk_len) if is_last else (str(total_size) if total_size else "*")
+    if sent < chunk_len:
+        return f"bytes {start}-{offset + chunk_len - 1}/{total}"
+    return f"bytes */{total}"
+
+def _persisted_size(headers, offset):
+    """308 응답의 Range: bytes=0-N → 저장 완료된 바이트 수 N+1 (헤더가 없으면 이 청크는 저장되지 않음)"""
+    if headers.get("Range"):
+        return int(headers["Range"].split("-")[-1]) + 1
+    return offset
+
+def _fixed_size_chunks(iterable, size, hasher=None):
+    """임의 크기의 바이트 조각을 고정 크기 청크로 재구성 (마지막 청크만 작을 수 있음, hasher가 있으면 해시 갱신)"""
+    buf = bytearray()
+    pieces = iter(iterable)
+    while True:
+        # 원본 본문 수신 대기 시간 (업로드 시간과 분리하여 측정)
+        with STATS.timer("r2_read"):
+            piece = next(pieces, None)
+        if piece is None:
+            break
+        STATS.add("bytes_downloaded", len(piece))
+        if hasher: hasher.update(piece)
+        buf.extend(piece)
+        while len(buf) >= size:
+            yield bytes(buf[:size])
+            del buf[:size]
+    yield bytes(buf)
+
+def stream_to_drive(file_res, upload_url, total_size=None, hasher=None):
+    """R2 응답 본문을 청크 단위로 Drive 업로드 세션에 PUT (파일 크기와 무관하게 청크 1~2개 분량만 메모리 사용)"""
+    offset = 0
+    chunks = _fixed_size_chunks(file_res.iter_content(UPLOAD_CHUNK_SIZE), UPLOAD_CHUNK_SIZE, hasher)
+    chunk = next(chunks)
+    for next_chunk in chunks:
+        # 한 청크 앞서 읽어 현재 청크가 마지막인지 판별 (빈 조각이면 현재가 마지막)
+        is_last = not next_chunk
+        result = _put_chunk(upload_url, chunk, offset, total_size, is_last)
+        offset += len(chunk)
+        if is_last:
+            return result
+        chunk = next_chunk
+    return _put_chunk(upload_url, chunk, offset, total_size, True)
+
+def _upload_status_range(total_size):
+    """중단된 PUT 이후 저장 위치 조회용 Content-Range (빈 본문 + bytes */전체)"""
+    return f"bytes */{total_size or '*'}"
 
-    # R2 경로 변환
+def _put_chunk(upload_url, chunk, offset, total_size, is_last, max_attempts=5):
+    """청크 1개 업로드 (308 응답 시 서버가 실제 저장한 위치부터 나머지를 재전송)
+
+    [수정] 같은 Content-Range를 그대로 재전송하지 않도록 일반 재시도(request_with_retry)를 쓰지 않고,
+    5xx/연결 오류로 중단되면 빈 PUT으로 저장된 위치를 조회한 뒤 그 위치부터 이어서 보냅니다.
+    """
+    session = get_session("drive")
+    sent = 0
+    for attempt in range(max_attempts):
+        data = chunk[sent:]
+        content_range = _content_range(offset, sent, len(chunk), total_size, is_last)
+        try:
+            with STATS.timer("drive"):
+                res = session.put(upload_url, data=data, headers={"Content-Range": content_range}, timeout=120)
+        except (requests.ConnectionError, requests.Timeout):
+            res = None
+        STATS.add("bytes_uploaded", len(data))
+        if res is None or res.status_code in RETRY_STATUS:
+            STATS.add("retries_drive")
+            time.sleep(_retry_delay(attempt, res))
+            try:
+                with STATS.timer("drive"):
+                    res = session.put(upload_url, data=b"", headers={"Content-Range": _upload_status_range(total_size)}, timeout=60)
+            except (requests.ConnectionError, requests.Timeout):
+                continue
+            if res.status_code in RETRY_STATUS:
+                continue
+        if res.status_code in (200, 201):
+            return res.json().get("id")
+        if res.status_code != 308:
+            raise Exception(f"Drive 업로드 실패 ({res.status_code})")
+        sent = max(0, _persisted_size(res.headers, offset) - offset)
+        if sent >= len(chunk) and not is_last:
+            return None
+    raise Exception(f"Drive 업로드 실패 (청크 {offset}~ 재전송 {max_attempts}회 초과)")
+
+def _upload_result(res):
+    """uploadToDrive 응답 본문 (재시도하지 않은 5xx 등 오류 응답은 예외)"""
+    if res.status_code >= 400:
+        raise Exception(f"GAS 업로드 실패 ({res.status_code}), 중복 생성을 막기 위해 재시도하지 않음")
+    return res.json()
+
+def upload_base64(content, file_name, project_id, mime_type):
+    """기존 방식: 파일 전체를 base64로 인코딩하여 GAS JSON 본문으로 전송 (Drive 파일 ID 반환)"""
+    gas_payload = _base64_payload(content, file_name, project_id, mime_type)
+    # [수정] uploadToDrive는 재전송하면 Drive 파일이 중복 생성되므로 요청이 도달하지 않은 경우만 재시도
+    res = request_with_retry("gas", "POST", f"{GAS_URL}?action=uploadToDrive", limiter=GAS_LIMITER, idempotent=False, json=gas_payload, timeout=60)
+    STATS.add("bytes_uploaded", len(content))
+    gas_res = _upload_result(res)
+    if not gas_res.get("success"):
+        raise Exception(gas_res.get("error"))
+    return gas_res.get("fileId")
+
+def transfer_to_drive(file_res, file_name, project_id, mime_type="image/jpeg", hasher=None):
+    """R2 응답(stream=True)을 Drive로 전송 (세션 발급이 안 되면 base64 방식으로 대체)"""
+    if TRANSFER_MODE == "stream" and _upload_session_supported is not False:
+        size = int(file_res.headers.get("Content-Length") or 0) or None
+        upload_url = create_upload_session(file_name, project_id, mime_type, size)
+        if upload_url:
+            return stream_to_drive(file_res, upload_url, size, hasher)
+        print(f"ℹ️ 업로드 세션 발급 실패, base64 방식으로 전송: {file_name}")
+    with STATS.timer("r2_read"):
+        content = file_res.content
+    STATS.add("bytes_downloaded", len(content))
+    if hasher: hasher.update(content)
+    return upload_base64(content, file_name, project_id, mime_type)
+
+def _backup_target(url):
+    """백업 대상이면 (원본 URL, 파일명) 반환 (미리보기 경로 → 원본 경로 변환)"""
+    if not url or R2_HOST_MARKER not in url:
+        return None
     orig_url = url.replace("/preview/", "/orig/").replace(".webp", ".jpg")
-    file_name = orig_url.split('/')[-1]
+    return orig_url, orig_url.split('/')[-1]
+
+def _split_urls(memo):
+    return [u.strip() for u in (memo.get('image_url') or '').split(',') if u.strip()]
+
+def _log_row(memo_id, project_id, file_name, url, status, now_iso, drive_file_id=None, error_message=None, content_hash=None):
+    """backup_logs UPSERT 행 (완료 행은 drive_file_id(+content_hash), 실패 행은 error_message 포함)"""
+    row = {
+        "memo_id": memo_id,
+        "project_id": str(project_id),
+        "file_name": file_name,
+        "r2_url": url,
+        "status": status,
+        "updated_at": now_iso
+    }
+    if status == "completed":
+        row["drive_file_id"] = drive_file_id
+        if CONTENT_DEDUP:
+            row["content_hash"] = content_hash
+    else:
+        row["error_message"] = error_message
+    return row
+
+def _register_hash(hash_index, key, drive_file_id):
+    """전송 중 계산한 (프로젝트, 해시) 키를 캐시에 등록 (이미 다른 작업이 같은 내용을 올렸어도 이번 업로드 결과를 유지)"""
+    known, event = hash_index.lookup_or_reserve(key)
+    if not known and event is None:
+        hash_index.resolve(key, drive_file_id)
+    return drive_file_id
+
+@timed("file")
+def process_single_image(client, memo_id, project_id, url, completed_urls=None, writer=None, hash_index=None):
+    """개별 이미지를 다운로드하여 구글 드라이브로 백업하는 작업 단위 (Thread용)
+
+    completed_urls가 주어지면 메모리에서 중복을 판별하고, None이면 파일별로 조회합니다.
+    writer(WriteBehindBuffer)가 주어지면 backup_logs 기록을 버퍼에 맡기고, 없으면 즉시 기록합니다.
+    hash_index(ContentHashIndex)가 주어지면 같은 내용의 파일은 업로드하지 않고 기존 Drive 파일에 연결합니다.
+    """
+    url = url.strip()
+    target = _backup_target(url)
+    if not target:
+        return True
+    orig_url, file_name = target
     # Supabase Python 클라이언트는 "now()" 대신 실제 ISO 문자열을 권장합니다.
     now_iso = datetime.now(timezone.utc).isoformat()
 
-    # [중복 체크] 이미 성공한 백업 이력이 있는지 확인
-    try:
-        existing = client.table("backup_logs").select("id").eq("r2_url", url).eq("status", "completed").execute().data
-        if existing:
-            print(f"⏩ 스킵 (이미 백업됨): {file_name}")
-            return True
-    except Exception as e:
-        print(f"⚠️ 중복 체크 실패: {file_name} ({e})")
+    # [중복 체크] 이미 성공한 백업 이력이 있는지 확인 (일괄 조회 결과가 있으면 메모리에서 판별)
+    if completed_urls is not None:
+        already_done = url in completed_urls
+    else:
+        try:
+            already_done = bool(client.table("backup_logs").select("id").eq("r2_url", url).eq("status", "completed").execute().data)
+        except Exception as e:
+            print(f"⚠️ 중복 체크 실패: {file_name} ({e})")
+            already_done = False
+    if already_done:
+        print(f"⏩ 스킵 (이미 백업됨): {file_name}")
+        STATS.add("files_skipped")
+        return True
 
     try:
-        # 1. R2에서 원본 다운로드
-        file_res = requests.get(orig_url, timeout=30)
-        if file_res.status_code != 200:
-            raise Exception(f"R2 다운로드 실패 ({file_res.status_code})")
-        
-        # 2. GAS(구글 드라이브)로 전송
-        file_data_base64 = base64.b64encode(file_res.content).decode('utf-8')
-        
-        gas_payload = {
-            "action": "uploadToDrive",
-            "fileName": file_name,
-            "fileData": file_data_base64,
-            "mimeType": "image/jpeg",
-            "projectId": str(project_id)
-        }
-        
-        gas_res = requests.post(f"{GAS_URL}?action=uploadToDrive", json=gas_payload, timeout=60).json()
-
-        if gas_res.get("success"):
-            # 3. backup_logs 테이블 기록 (UPSERT)
-            log_data = {
-                "memo_id": memo_id,
-                "project_id": str(project_id),
-                "file_name": file_name,
-                "r2_url": url,
-                "drive_file_id": gas_res.get("fileId"),
-                "status": "completed",
-                "updated_at": now_iso
-            }
-            client.table("backup_logs").upsert(log_data, on_conflict="r2_url").execute()
-            print(f"✅ 백업 완료: {file_name}")
-            return True
-        else:
-            raise Exception(gas_res.get("error"))
+        # 1. R2에서 원본 다운로드 (스트리밍) → 2. 구글 드라이브로 전송
+        content_hash = None
+        drive_file_id = None
+        with request_with_retry("r2", "GET", orig_url, timeout=30, stream=True) as file_res:
+            if file_res.status_code != 200:
+                raise Exception(f"R2 다운로드 실패 ({file_res.status_code})")
+            # [추가] 본문을 읽기 전에 ETag(MD5)로 같은 내용의 기존 백업을 찾으면 전송 생략
+            content_hash = _etag_md5(file_res.headers) if hash_index else None
+            reserved = False
+            if content_hash:
+                drive_file_id = find_existing_backup(client, hash_index, project_id, content_hash)
+                reserved = not drive_file_id
+            try:
+                if drive_file_id:
+                    print(f"🔗 동일 파일 연결 (업로드 생략): {file_name}")
+                    STATS.add("files_deduped")
+                else:
+                    # ETag가 MD5가 아니면(멀티파트 등) 전송하면서 직접 계산하여 다음 중복 판별에 사용
+                    hasher = hashlib.md5() if hash_index and not content_hash else None
+                    drive_file_id = transfer_to_drive(file_res, file_name, project_id, hasher=hasher)
+                    if hasher:
+                        content_hash = hasher.hexdigest()
+                        drive_file_id = _register_hash(hash_index, (project_id, content_hash), drive_file_id)
+            finally:
+                if reserved:
+                    hash_index.resolve((project_id, content_hash), drive_file_id)
+
+        # 3. backup_logs 테이블 기록 (UPSERT)
+        log_data = _log_row(memo_id, project_id, file_name, url, "completed", now_iso, drive_file_id=drive_file_id, content_hash=content_hash)
+        if writer: writer.add_log(log_data)
+        else: client.table("backup_logs").upsert(log_data, on_conflict="r2_url").execute()
+        print(f"✅ 백업 완료: {file_name}")
+        STATS.add("files_completed")
+        return True
 
     except Exception as e:
         error_msg = str(e)
         print(f"❌ 실패: {file_name} ({error_msg})")
+        STATS.add("files_failed")
+        log_data = _log_row(memo_id, project_id, file_name, url, "failed", now_iso, error_message=error_msg)
+        if writer:
+            writer.add_log(log_data)
+            return False
         try:
-            client.table("backup_logs").upsert({
-                "memo_id": memo_id, "project_id": str(project_id), "file_name": file_name,
-                "r2_url": url, "status": "failed", "error_message": error_msg, "updated_at": now_iso
-            }, on_conflict="r2_url").execute()
+            client.table("backup_logs").upsert(log_data, on_conflict="r2_url").execute()
         except: pass
         return False
 
+def finalize_memo(writer, memo_id, all_success):
+    """메모의 모든 파일 처리 후 최종 상태 기록 (하나라도 실패하면 failed, 모두 성공하면 completed)"""
+    final_status = "completed" if all_success else "failed"
+    writer.set_memo_status(memo_id, final_status)
+    print(f"🎊 메모 {memo_id} 모든 파일 처리 완료! (최종 상태: {final_status})")
+
+def save_run_report(summary):
+    """실행 요약을 JSON 파일로 저장 (BACKUP_REPORT_PATH 설정 시)"""
+    if not BACKUP_REPORT_PATH:
+        return
+    with open(BACKUP_REPORT_PATH, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    print(f"📝 실행 리포트 저장: {BACKUP_REPORT_PATH}")
+
+def record_run(client, summary):
+    """실행 요약을 JSON 리포트 / backup_runs 테이블에 기록 (기록 실패는 백업 결과에 영향 없음)"""
+    save_run_report(summary)
+    if BACKUP_RECORD_RUNS:
+        try:
+            client.table("backup_runs").insert(summary).execute()
+        except Exception as e:
+            print(f"⚠️ backup_runs 기록 실패: {e}")
+
+def _print_gas_rate():
+    """GAS 속도 제한이 처리량 상한임을 실행 시작 시 표시"""
+    if GAS_RATE_PER_SEC > 0:
+        print(f"ℹ️ GAS 호출 속도 제한 {GAS_RATE_PER_SEC:g}회/초 → 처리량 상한 약 {GAS_RATE_PER_SEC:g} files/s (GAS_RATE_PER_SEC로 조정)")
+
 def main():
     client = SyncPostgrestClient(f"{SUPABASE_URL}/rest/v1", headers={
         "apikey": SUPABASE_KEY,
         "Authorization": f"Bearer {SUPABASE_KEY}"
     })
 
-    print("🔍 백업 대기 중인 메모 조회...")
-    memos = client.table("memos").select("id, project_id, image_url").eq("backup_status", "pending").execute().data
+    page_size = CLAIM_PAGE_SIZE or BACKUP_WORKERS
+    print(f"🔍 백업 대기 중인 메모를 {page_size}건 단위로 선점하여 처리합니다. ({BACKUP_WORKERS}개 병렬 업로드 활성)")
+    _print_gas_rate()
+
+    # [수정] 메모별 풀 대신 하나의 공유 풀에 모든 메모의 파일을 투입
+    # 메모별 남은 파일 수와 성공 여부를 추적하여 마지막 파일이 끝나는 시점에 상태를 확정합니다.
+    # [추가] 로그/상태 기록은 쓰기 지연 버퍼에 모았다가 메인 스레드에서 건수·간격 기준으로 일괄 기록합니다.
+    # [추가] 메모는 전체를 한 번에 읽지 않고 페이지 단위로 선점하며, 진행 중 파일이 줄어들면 다음 페이지를 가져옵니다.
+    writer = WriteBehindBuffer()
+    hash_index = ContentHashIndex() if CONTENT_DEDUP else None
+    memo_states = {}
+    futures = {}
+    not_done = set()
+    pages = iter_claimed_memos(client, page_size)
+    exhausted = False
+    total_memos = 0
+    executor = ThreadPoolExecutor(max_workers=BACKUP_WORKERS)
+    try:
+        while True:
+            # 대기 중인 파일이 작업자 수보다 적을 때만 다음 페이지 선점
+            while not exhausted and len(not_done) < BACKUP_WORKERS * 2:
+                memos = next(pages, None)
+                if memos is None:
+                    exhausted = True
+                    break
+                total_memos += len(memos)
+                print(f"📦 메모 {len(memos)}건 선점 (누적 {total_memos}건)")
+
+                # [추가] 페이지 내 URL의 완료 이력을 한 번에 조회 (파일별 조회 제거)
+                completed_urls = fetch_completed_urls(client, [u for memo in memos for u in _split_urls(memo)])
+                for memo in memos:
+                    memo_id = memo['id']
+                    urls = _split_urls(memo)
+                    if not urls:
+                        finalize_memo(writer, memo_id, True)
+                        continue
+                    memo_states[memo_id] = {"remaining": len(urls), "success": True}
+                    for url in urls:
+                        future = executor.submit(process_single_image, client, memo_id, memo['project_id'], url, completed_urls, writer, hash_index)
+                        futures[future] = memo_id
+                        not_done.add(future)
+            if not not_done:
+                if exhausted: break
+                continue
+
+            done, not_done = wait(not_done, timeout=WRITE_FLUSH_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in done:
+                memo_id = futures.pop(future)
+                state = memo_states[memo_id]
+                try:
+                    if not future.result(): state["success"] = False
+                except Exception as e:
+                    print(f"❌ 작업 오류 (메모 {memo_id}): {e}")
+                    state["success"] = False
+                state["remaining"] -= 1
+                if state["remaining"] == 0:
+                    del memo_states[memo_id]
+                    finalize_memo(writer, memo_id, state["success"])
+            if writer.should_flush():
+                writer.flush(client)
+    finally:
+        # 중단 시 대기 중인 작업은 취소하고, 진행 중인 작업과 버퍼에 남은 기록은 마무리
+        executor.shutdown(wait=True, cancel_futures=True)
+        writer.close(client)
 
-    if not memos:
+    if not total_memos:
         print("✅ 백업할 항목이 없습니다.")
         return
+    STATS.report()
+    record_run(client, STATS.summary("thread"))
+
+# ---------------------------------------------------------------------------
+# [추가] asyncio 엔진 (BACKUP_ENGINE=async 또는 --async)
+# 스레드 대신 이벤트 루프 하나에서 수백 건의 다운로드/업로드/로그 기록을 동시에 처리합니다.
+# backup_logs / memos.backup_status 기록 규칙은 스레드 엔진과 동일합니다.
+# ---------------------------------------------------------------------------
+_async_clients = {}
+
+def get_async_client(endpoint):
+    """엔드포인트(r2/gas/drive)별 연결 풀 공유 비동기 HTTP 클라이언트"""
+    client = _async_clients.get(endpoint)
+    if client is None:
+        limits = httpx.Limits(max_connections=BACKUP_CONCURRENCY, max_keepalive_connections=min(BACKUP_CONCURRENCY, 50))
+        client = httpx.AsyncClient(limits=limits, follow_redirects=True)
+        _async_clients[endpoint] = client
+    return client
+
+async def _atimed_execute(stage, query):
+    """비동기 PostgREST 쿼리 실행 시간을 단계 히스토그램에 기록"""
+    with STATS.timer(stage):
+        return await query.execute()
+
+async def close_async_clients():
+    for client in _async_clients.values():
+        await client.aclose()
+    _async_clients.clear()
+
+async def arequest_with_retry(endpoint, method, url, limiter=None, stream=False, idempotent=True, **kwargs):
+    """request_with_retry()의 asyncio 버전 (stream=True면 본문을 읽지 않은 응답 반환, 호출 측에서 aclose)"""
+    client = get_async_client(endpoint)
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        if limiter:
+            STATS.add("throttle_wait", await limiter.acquire_async())
+        try:
+            with STATS.timer(endpoint):
+                res = await client.send(client.build_request(method, url, **kwargs), stream=stream)
+        except httpx.TransportError as e:
+            if attempt >= HTTP_MAX_RETRIES or not (idempotent or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))):
+                raise
+            delay = _retry_delay(attempt)
+        else:
+            if res.status_code not in RETRY_STATUS or attempt >= HTTP_MAX_RETRIES or not (idempotent or res.status_code == 429):
+                return res
+            delay = _retry_delay(attempt, res)
+            await res.aclose()
+        STATS.add(f"retries_{endpoint}")
+        await asyncio.sleep(delay)
+
+async def _afixed_size_chunks(aiterable, size, hasher=None):
+    """_fixed_size_chunks()의 비동기 버전"""
+    buf = bytearray()
+    pieces = aiterable.__aiter__()
+    while True:
+        try:
+            with STATS.timer("r2_read"):
+                piece = await pieces.__anext__()
+        except StopAsyncIteration:
+            break
+        STATS.add("bytes_downloaded", len(piece))
+        if hasher: hasher.update(piece)
+        buf.extend(piece)
+        while len(buf) >= size:
+            yield bytes(buf[:size])
+            del buf[:size]
+    yield bytes(buf)
 
-    print(f"📦 총 {len(memos)}건의 메모를 처리합니다. (4개 병렬 업로드 활성)")
+async def _aput_chunk(upload_url, chunk, offset, total_size, is_last, max_attempts=5):
+    """_put_chunk()의 비동기 버전 (중단 시 저장 위치 조회 후 이어서 전송)"""
+    client = get_async_client("drive")
+    sent = 0
+    for attempt in range(max_attempts):
+        data = chunk[sent:]
+        content_range = _content_range(offset, sent, len(chunk), total_size, is_last)
+        try:
+            with STATS.timer("drive"):
+                res = await client.put(upload_url, content=data, headers={"Content-Range": content_range}, timeout=120)
+        except httpx.TransportError:
+            res = None
+        STATS.add("bytes_uploaded", len(data))
+        if res is None or res.status_code in RETRY_STATUS:
+            STATS.add("retries_drive")
+            await asyncio.sleep(_retry_delay(attempt, res))
+            try:
+                with STATS.timer("drive"):
+                    res = await client.put(upload_url, content=b"", headers={"Content-Range": _upload_status_range(total_size)}, timeout=60)
+            except httpx.TransportError:
+                continue
+            if res.status_code in RETRY_STATUS:
+                continue
+        if res.status_code in (200, 201):
+            return res.json().get("id")
+        if res.status_code != 308:
+            raise Exception(f"Drive 업로드 실패 ({res.status_code})")
+        sent = max(0, _persisted_size(res.headers, offset) - offset)
+        if sent >= len(chunk) and not is_last:
+            return None
+    raise Exception(f"Drive 업로드 실패 (청크 {offset}~ 재전송 {max_attempts}회 초과)")
 
-    for memo in memos:
-        memo_id = memo['id']
-        project_id = memo['project_id']
-        urls = [u.strip() for u in memo.get('image_url', '').split(',') if u.strip()]
-        
-        client.table("memos").update({"backup_status": "processing"}).eq("id", memo_id).execute()
+async def atransfer_to_drive(file_res, file_name, project_id, mime_type="image/jpeg", hasher=None):
+    """transfer_to_drive()의 비동기 버전"""
+    if TRANSFER_MODE == "stream" and _upload_session_supported is not False:
+        size = int(file_res.headers.get("Content-Length") or 0) or None
+        payload = _upload_session_payload(file_name, project_id, mime_type, size)
+        res = await arequest_with_retry("gas", "POST", f"{GAS_URL}?action=createUploadSession", limiter=GAS_LIMITER, json=payload, timeout=60)
+        upload_url = _session_url(res)
+        if upload_url:
+            offset = 0
+            chunk = None
+            async for next_chunk in _afixed_size_chunks(file_res.aiter_bytes(UPLOAD_CHUNK_SIZE), UPLOAD_CHUNK_SIZE, hasher):
+                if chunk is not None:
+                    is_last = not next_chunk
+                    result = await _aput_chunk(upload_url, chunk, offset, size, is_last)
+                    offset += len(chunk)
+                    if is_last:
+                        return result
+                chunk = next_chunk
+            return await _aput_chunk(upload_url, chunk, offset, size, True)
+        print(f"ℹ️ 업로드 세션 발급 실패, base64 방식으로 전송: {file_name}")
+    with STATS.timer("r2_read"):
+        content = await file_res.aread()
+    STATS.add("bytes_downloaded", len(content))
+    if hasher: hasher.update(content)
+    payload = _base64_payload(content, file_name, project_id, mime_type)
+    res = await arequest_with_retry("gas", "POST", f"{GAS_URL}?action=uploadToDrive", limiter=GAS_LIMITER, idempotent=False, json=payload, timeout=60)
+    STATS.add("bytes_uploaded", len(content))
+    gas_res = _upload_result(res)
+    if not gas_res.get("success"):
+        raise Exception(gas_res.get("error"))
+    return gas_res.get("fileId")
 
-        # 모든 파일의 성공 여부를 추적
-        all_success = True
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            futures = [executor.submit(process_single_image, client, memo_id, project_id, url) for url in urls]
-            for future in as_completed(futures):
-                if not future.result(): all_success = False
+async def afind_existing_backup(client, hash_index, project_id, content_hash):
+    """find_existing_backup()의 비동기 버전 (hash_index는 asyncio.Event로 생성)"""
+    key = (project_id, content_hash)
+    while True:
+        drive_file_id, event = hash_index.lookup_or_reserve(key)
+        if drive_file_id:
+            return drive_file_id
+        if event is None:
+            break
+        await event.wait()
+    try:
+        rows = (await _atimed_execute("db_lookup", _hash_lookup_query(client, project_id, content_hash))).data
+    except Exception as e:
+        print(f"⚠️ 해시 중복 조회 실패: {content_hash} ({e})")
+        rows = []
+    if rows:
+        hash_index.resolve(key, rows[0]["drive_file_id"])
+        return rows[0]["drive_file_id"]
+    return None
+
+@timed("file")
+async def aprocess_single_image(client, memo_id, project_id, url, completed_urls=None, writer=None, hash_index=None):
+    """process_single_image()의 비동기 버전"""
+    url = url.strip()
+    target = _backup_target(url)
+    if not target:
+        return True
+    orig_url, file_name = target
+    now_iso = datetime.now(timezone.utc).isoformat()
+
+    if completed_urls is not None:
+        already_done = url in completed_urls
+    else:
+        try:
+            already_done = bool((await client.table("backup_logs").select("id").eq("r2_url", url).eq("status", "completed").execute()).data)
+        except Exception as e:
+            print(f"⚠️ 중복 체크 실패: {file_name} ({e})")
+            already_done = False
+    if already_done:
+        print(f"⏩ 스킵 (이미 백업됨): {file_name}")
+        STATS.add("files_skipped")
+        return True
+
+    try:
+        content_hash = None
+        drive_file_id = None
+        reserved = False
+        file_res = await arequest_with_retry("r2", "GET", orig_url, stream=True, timeout=30)
+        try:
+            if file_res.status_code != 200:
+                raise Exception(f"R2 다운로드 실패 ({file_res.status_code})")
+            content_hash = _etag_md5(file_res.headers) if hash_index else None
+            if content_hash:
+                drive_file_id = await afind_existing_backup(client, hash_index, project_id, content_hash)
+                reserved = not drive_file_id
+            if drive_file_id:
+                print(f"🔗 동일 파일 연결 (업로드 생략): {file_name}")
+                STATS.add("files_deduped")
+            else:
+                hasher = hashlib.md5() if hash_index and not content_hash else None
+                drive_file_id = await atransfer_to_drive(file_res, file_name, project_id, hasher=hasher)
+                if hasher:
+                    content_hash = hasher.hexdigest()
+                    drive_file_id = _register_hash(hash_index, (project_id, content_hash), drive_file_id)
+        finally:
+            if reserved:
+                hash_index.resolve((project_id, content_hash), drive_file_id)
+            await file_res.aclose()
+
+        log_data = _log_row(memo_id, project_id, file_name, url, "completed", now_iso, drive_file_id=drive_file_id, content_hash=content_hash)
+        if writer: writer.add_log(log_data)
+        else: await client.table("backup_logs").upsert(log_data, on_conflict="r2_url").execute()
+        print(f"✅ 백업 완료: {file_name}")
+        STATS.add("files_completed")
+        return True
+    except Exception as e:
+        error_msg = str(e)
+        print(f"❌ 실패: {file_name} ({error_msg})")
+        STATS.add("files_failed")
+        log_data = _log_row(memo_id, project_id, file_name, url, "failed", now_iso, error_message=error_msg)
+        if writer:
+            writer.add_log(log_data)
+            return False
+        try:
+            await client.table("backup_logs").upsert(log_data, on_conflict="r2_url").execute()
+        except: pass
+        return False
+
+async def aiter_claimed_memos(client, page_size):
+    """iter_claimed_memos()의 비동기 버전"""
+    last_id = None
+    while True:
+        rows = (await _atimed_execute("db_claim", _pending_page_query(client, last_id, page_size))).data
+        if not rows:
+            return
+        last_id = rows[-1]["id"]
+        claimed = (await _atimed_execute("db_claim", _claim_query(client, [row["id"] for row in rows]))).data
+        if claimed:
+            yield sorted(claimed, key=lambda m: m["id"])
+        if len(rows) < page_size:
+            return
+
+async def afetch_completed_urls(client, urls):
+    """fetch_completed_urls()의 비동기 버전 (청크별 조회를 동시에 실행)"""
+    urls = list(dict.fromkeys(urls))
+    chunks = [urls[i:i + PREFETCH_CHUNK_SIZE] for i in range(0, len(urls), PREFETCH_CHUNK_SIZE)]
+    try:
+        results = await asyncio.gather(*[
+            _atimed_execute("db_lookup", client.table("backup_logs").select("r2_url").in_("r2_url", chunk).eq("status", "completed"))
+            for chunk in chunks
+        ])
+    except Exception as e:
+        print(f"⚠️ 완료 이력 일괄 조회 실패, 파일별 조회로 대체합니다. ({e})")
+        return None
+    return {row["r2_url"] for res in results for row in res.data}
+
+async def amain():
+    if httpx is None or AsyncPostgrestClient is None:
+        print("❌ async 엔진에 필요한 httpx / AsyncPostgrestClient를 불러올 수 없습니다.")
+        sys.exit(1)
+    client = AsyncPostgrestClient(f"{SUPABASE_URL}/rest/v1", headers={
+        "apikey": SUPABASE_KEY,
+        "Authorization": f"Bearer {SUPABASE_KEY}"
+    })
+    writer = WriteBehindBuffer()
+    hash_index = ContentHashIndex(asyncio.Event) if CONTENT_DEDUP else None
+    # 작업 취소(SIGTERM) 시에도 finally에서 버퍼를 기록하도록 메인 태스크를 취소
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except (NotImplementedError, RuntimeError):
+        pass
+    closed = False
+    try:
+        page_size = CLAIM_PAGE_SIZE or BACKUP_CONCURRENCY
+        print(f"🔍 백업 대기 중인 메모를 {page_size}건 단위로 선점하여 처리합니다. (async 엔진, 동시 {BACKUP_CONCURRENCY}건)")
+        _print_gas_rate()
+        semaphore = asyncio.Semaphore(BACKUP_CONCURRENCY)
+        memo_states = {}
+
+        async def run_file(memo_id, project_id, url, completed_urls):
+            async with semaphore:
+                try:
+                    ok = await aprocess_single_image(client, memo_id, project_id, url, completed_urls, writer, hash_index)
+                except Exception as e:
+                    print(f"❌ 작업 오류 (메모 {memo_id}): {e}")
+                    ok = False
+            # 이벤트 루프 단일 스레드이므로 잠금 없이 메모별 카운터 갱신
+            state = memo_states[memo_id]
+            state["success"] = state["success"] and ok
+            state["remaining"] -= 1
+            if state["remaining"] == 0:
+                del memo_states[memo_id]
+                finalize_memo(writer, memo_id, state["success"])
+            if writer.pending() >= writer.batch_size:
+                await writer.aflush(client)
+
+        async def periodic_flush():
+            while True:
+                await asyncio.sleep(writer.interval)
+                if writer.should_flush():
+                    await writer.aflush(client)
+
+        inflight = set()
+        total_memos = 0
+        flusher = asyncio.create_task(periodic_flush())
+        try:
+            async for memos in aiter_claimed_memos(client, page_size):
+                total_memos += len(memos)
+                print(f"📦 메모 {len(memos)}건 선점 (누적 {total_memos}건)")
+                completed_urls = await afetch_completed_urls(client, [u for memo in memos for u in _split_urls(memo)])
+                for memo in memos:
+                    memo_id = memo['id']
+                    urls = _split_urls(memo)
+                    if not urls:
+                        finalize_memo(writer, memo_id, True)
+                        continue
+                    memo_states[memo_id] = {"remaining": len(urls), "success": True}
+                    inflight.update(asyncio.create_task(run_file(memo_id, memo['project_id'], url, completed_urls)) for url in urls)
+                # 진행 중 작업이 동시 처리 수를 채우면 다음 페이지 선점을 미룸 (메모리 사용량 및 선점 범위 제한)
+                while len(inflight) >= BACKUP_CONCURRENCY:
+                    _, inflight = await asyncio.wait(inflight, return_when=asyncio.FIRST_COMPLETED)
+            if inflight:
+                await asyncio.gather(*inflight)
+        finally:
+            # [수정] 취소한 작업이 실제로 끝날 때까지 기다린 뒤 버퍼를 마무리 (중단된 기록은 버퍼로 되돌아옴)
+            flusher.cancel()
+            for task in inflight:
+                task.cancel()
+            await asyncio.gather(flusher, *inflight, return_exceptions=True)
+        closed = True
+        await writer.aclose(client)
+        if not total_memos:
+            print("✅ 백업할 항목이 없습니다.")
+            return
+        STATS.report()
+        await arecord_run(client, STATS.summary("async"))
+    finally:
+        if not closed:
+            await writer.aclose(client)
+        await close_async_clients()
+        await client.aclose()
+
+async def arecord_run(client, summary):
+    """record_run()의 비동기 버전"""
+    save_run_report(summary)
+    if BACKUP_RECORD_RUNS:
+        try:
+            await client.table("backup_runs").insert(summary).execute()
+        except Exception as e:
+            print(f"⚠️ backup_runs 기록 실패: {e}")
 
-        # 하나라도 실패하면 failed, 모두 성공하면 completed
-        final_status = "completed" if all_success else "failed"
-        client.table("memos").update({"backup_status": final_status}).eq("id", memo_id).execute()
-        print(f"🎊 메모 {memo_id} 모든 파일 처리 완료! (최종 상태: {final_status})")
+def _raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # 작업 취소(SIGTERM) 시에도 finally에서 쓰기 버퍼를 기록하도록 인터럽트로 변환
+    signal.signal(signal.SIGTERM, _raise_interrupt)
+    if BACKUP_ENGINE == "async" or "--async" in sys.argv:
+        asyncio.run(amain())
+    else:
+        main()
\ No newline at end of file
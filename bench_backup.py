@@ -0,0 +1,455 @@
+import os
+import sys
+import json
+import time
+import base64
+import random
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+from urllib.parse import urlsplit, parse_qsl
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# backup_to_drive.py 로컬 부하 테스트 하네스
+# R2(원본 다운로드) / GAS(업로드 세션 발급, base64 업로드) / Drive(재개 가능 업로드) / PostgREST(memos, backup_logs)를
+# 로컬 대역 서버 하나로 흉내 내고, 서비스별 지연 시간과 오류율을 주입하여 동시성 설정별 처리량을 측정합니다.
+# 운영 Supabase/R2/Drive에는 접속하지 않습니다.
+#
+# 예) python bench_backup.py --workers 4,8,16 --engine both --memos 100 --files-per-memo 3 \
+#         --latency r2=30,gas=400,drive=80,db=20 --errors gas=0.02 --out bench.json
+
+SERVICES = ("r2", "gas", "drive", "db")
+DEFAULT_LATENCY_MS = {"r2": 20, "gas": 200, "drive": 50, "db": 15}
+BLOCK_SIZE = 64 * 1024
+
+def parse_service_map(text, defaults=None, cast=float):
+    """'r2=30,gas=400' 형식을 서비스별 dict로 변환 (지정하지 않은 서비스는 기본값)"""
+    result = dict(defaults or {s: 0 for s in SERVICES})
+    for item in filter(None, (text or "").split(",")):
+        name, value = item.split("=", 1)
+        if name.strip() not in SERVICES:
+            raise ValueError(f"알 수 없는 서비스: {name} (사용 가능: {', '.join(SERVICES)})")
+        result[name.strip()] = cast(value)
+    return result
+
+class StandInState:
+    """대역 서버 공유 상태 (PostgREST 테이블, Drive 업로드 세션, 요청/오류 카운터)"""
+
+    def __init__(self, latency_ms, error_rates, file_size, dup_ratio=0.0, r2_mbps=0.0, jitter=0.2, seed=0, gas_session="ok"):
+        self.latency_ms = latency_ms
+        self.gas_session = gas_session
+        self.error_rates = error_rates
+        self.file_size = file_size
+        self.dup_ratio = dup_ratio
+        self.r2_mbps = r2_mbps
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self.block = random.Random(seed).randbytes(BLOCK_SIZE)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.tables = {"memos": [], "backup_logs": [], "backup_runs": []}
+            self.next_ids = {}
+            self.sessions = {}
+            self.etags = {}
+            self.requests = {s: 0 for s in SERVICES}
+            self.injected = {s: 0 for s in SERVICES}
+            self.drive_files = 0
+            self.session_calls = 0
+
+    # --- 장애 주입 ---
+    def delay(self, service):
+        base = self.latency_ms.get(service, 0) / 1000
+        if base > 0:
+            time.sleep(base * (1 + self.rng.uniform(-self.jitter, self.jitter)))
+
+    def flaky_session(self):
+        """flaky 모드: 세션 발급 5회 중 1회(첫 요청 포함) 일시 실패"""
+        with self.lock:
+            self.session_calls += 1
+            return self.session_calls % 5 == 1
+
+    def should_fail(self, service):
+        with self.lock:
+            self.requests[service] += 1
+            if self.rng.random() < self.error_rates.get(service, 0):
+                self.injected[service] += 1
+                return True
+        return False
+
+    # --- R2 ---
+    def content_key(self, name):
+        """dup_ratio 비율만큼 같은 내용(공유 키)을 돌려주어 콘텐츠 해시 중복 제거 경로를 재현"""
+        digest = int(hashlib.md5(name.encode()).hexdigest(), 16)
+        return "shared" if (digest % 10000) / 10000 < self.dup_ratio else name
+
+    def content(self, key):
+        head = key.encode().ljust(64, b"\0")[:64]
+        body = (head + self.block * (self.file_size // BLOCK_SIZE + 1))[:self.file_size]
+        with self.lock:
+            if key not in self.etags:
+                self.etags[key] = hashlib.md5(body).hexdigest()
+        return body
+
+    # --- Drive ---
+    def drive_put(self, sid, content_range, size):
+        """Content-Range 'bytes a-b/total' 또는 'bytes */total' 처리 → (완료 여부, 수신 바이트 수)"""
+        spec = content_range.split(" ", 1)[1]
+        span, total = spec.split("/")
+        with self.lock:
+            received = self.sessions.setdefault(sid, 0)
+            if span != "*":
+                start = int(span.split("-")[0])
+                if start == received:
+                    received += size
+                self.sessions[sid] = received
+            done = total != "*" and received >= int(total)
+            if done:
+                self.drive_files += 1
+                self.sessions.pop(sid, None)
+        return done, received
+
+    # --- PostgREST ---
+    def seed_memos(self, count, files_per_memo, base_url):
+        with self.lock:
+            for memo_id in range(1, count + 1):
+                urls = [f"{base_url}/r2.dev/preview/{memo_id}_{i}.webp" for i in range(files_per_memo)]
+                self.tables["memos"].append({
+                    "id": memo_id, "project_id": 1 + memo_id % 5,
+                    "image_url": ",".join(urls), "backup_status": "pending",
+                })
+
+    def _insert(self, table, row):
+        self.next_ids[table] = self.next_ids.get(table, 0) + 1
+        row = dict(row)
+        row.setdefault("id", self.next_ids[table])
+        self.tables[table].append(row)
+        return row
+
+    def select(self, table, filters, columns, order, limit):
+        with self.lock:
+            rows = [r for r in self.tables.setdefault(table, []) if _match(r, filters)]
+        if order:
+            col, _, direction = order.partition(".")
+            rows.sort(key=lambda r: (r.get(col) is None, r.get(col)), reverse=direction.startswith("desc"))
+        if limit is not None:
+            rows = rows[:limit]
+        if columns and columns != "*":
+            keys = columns.split(",")
+            rows = [{k: r.get(k) for k in keys} for r in rows]
+        return rows
+
+    def upsert(self, table, rows, on_conflict=None):
+        out = []
+        with self.lock:
+            existing = self.tables.setdefault(table, [])
+            index = {r.get(on_conflict): r for r in existing} if on_conflict else {}
+            for row in rows:
+                target = index.get(row.get(on_conflict)) if on_conflict else None
+                if target is not None:
+                    target.update(row)
+                    out.append(dict(target))
+                else:
+                    new = self._insert(table, row)
+                    if on_conflict: index[new.get(on_conflict)] = new
+                    out.append(dict(new))
+        return out
+
+    def update(self, table, filters, values):
+        # 잠금 안에서 조건 확인과 갱신을 함께 수행 (조건부 UPDATE 선점과 동일한 원자성)
+        with self.lock:
+            matched = [r for r in self.tables.setdefault(table, []) if _match(r, filters)]
+            for row in matched:
+                row.update(values)
+            return [dict(r) for r in matched]
+
+    def memo_status_counts(self):
+        with self.lock:
+            counts = {}
+            for memo in self.tables["memos"]:
+                counts[memo["backup_status"]] = counts.get(memo["backup_status"], 0) + 1
+            return counts
+
+def _parse_in_list(text):
+    """PostgREST in.(a,"b,c") 목록 파싱 (큰따옴표 안의 쉼표/이스케이프 허용)"""
+    items, buf, quoted, escaped = [], [], False, False
+    for ch in text.strip()[1:-1]:
+        if escaped:
+            buf.append(ch)
+            escaped = False
+        elif ch == "\\":
+            escaped = True
+        elif ch == '"':
+            quoted = not quoted
+        elif ch == "," and not quoted:
+            items.append("".join(buf))
+            buf = []
+        else:
+            buf.append(ch)
+    items.append("".join(buf))
+    return items
+
+def _coerce(sample, value):
+    if isinstance(sample, bool): return value == "true"
+    if isinstance(sample, int): return int(value)
+    if isinstance(sample, float): return float(value)
+    return value
+
+def _match(row, filters):
+    for col, expr in filters:
+        negate = expr.startswith("not.")
+        if negate: expr = expr[4:]
+        op, _, value = expr.partition(".")
+        current = row.get(col)
+        if op == "is":
+            ok = current is None if value == "null" else current == (value == "true")
+        elif current is None:
+            ok = False
+        elif op == "eq":
+            ok = current == _coerce(current, value)
+        elif op == "neq":
+            ok = current != _coerce(current, value)
+        elif op == "gt":
+            ok = current > _coerce(current, value)
+        elif op == "lt":
+            ok = current < _coerce(current, value)
+        elif op == "in":
+            ok = current in [_coerce(current, v) for v in _parse_in_list(value)]
+        else:
+            raise ValueError(f"지원하지 않는 필터: {col}={expr}")
+        if ok == negate:
+            return False
+    return True
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """R2 / GAS / Drive / PostgREST 대역 (경로로 서비스 구분)"""
+    protocol_version = "HTTP/1.1"  # keep-alive 연결 재사용 (운영 환경과 같은 연결 풀 동작)
+    state = None
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _send(self, status, payload=None, headers=None, raw=None):
+        body = raw if raw is not None else (json.dumps(payload).encode() if payload is not None else b"")
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if payload is not None:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _service(self):
+        path = urlsplit(self.path).path
+        if path.startswith("/rest/v1/"): return "db"
+        if path.startswith("/gas"): return "gas"
+        if path.startswith("/drive/"): return "drive"
+        return "r2"
+
+    def _handle(self):
+        service = self._service()
+        body = self._body()
+        self.state.delay(service)
+        if self.state.should_fail(service):
+            return self._send(503, {"message": f"injected {service} error"})
+        getattr(self, f"_{service}")(body)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_HEAD = _handle
+
+    def _r2(self, body):
+        name = urlsplit(self.path).path.rsplit("/", 1)[-1]
+        key = self.state.content_key(name)
+        data = self.state.content(key)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", f'"{self.state.etags[key]}"')
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        # 대역폭 제한이 있으면 블록 단위로 나누어 전송
+        step = BLOCK_SIZE if self.state.r2_mbps else len(data) or 1
+        for i in range(0, len(data), step):
+            self.wfile.write(data[i:i + step])
+            if self.state.r2_mbps:
+                time.sleep(len(data[i:i + step]) / (self.state.r2_mbps * 125000))
+
+    def _gas(self, body):
+        payload = json.loads(body or b"{}")
+        action = payload.get("action") or dict(parse_qsl(urlsplit(self.path).query)).get("action")
+        if action == "createUploadSession" and self.state.gas_session == "html":
+            # 배포되지 않은 액션에 GAS가 HTML 오류 페이지를 돌려주는 경우
+            return self._send(200, headers={"Content-Type": "text/html"}, raw=b"<html><body>Error</body></html>")
+        if action == "createUploadSession" and self.state.gas_session == "flaky" and self.state.flaky_session():
+            # 일시적인 실패 (예: 실행 한도 초과) → 이 파일만 base64, 이후 세션은 계속 사용해야 함
+            return self._send(200, {"success": False, "error": "Service invoked too many times for one day"})
+        if action == "createUploadSession" and self.state.gas_session in ("ok", "flaky"):
+            sid = hashlib.md5(f"{payload.get('fileName')}{time.monotonic_ns()}".encode()).hexdigest()
+            host = self.headers.get("Host")
+            return self._send(200, {"success": True, "uploadUrl": f"http://{host}/drive/{sid}"})
+        if action == "uploadToDrive":
+            base64.b64decode(payload.get("fileData", ""))
+            with self.state.lock:
+                self.state.drive_files += 1
+            return self._send(200, {"success": True, "fileId": f"drive-{payload.get('fileName')}"})
+        self._send(200, {"success": False, "error": f"unknown action {action}"})
+
+    def _drive(self, body):
+        sid = urlsplit(self.path).path.rsplit("/", 1)[-1]
+        done, received = self.state.drive_put(sid, self.headers.get("Content-Range", "bytes */*"), len(body))
+        if done:
+            return self._send(200, {"id": f"drive-{sid[:12]}"})
+        headers = {"Range": f"bytes=0-{received - 1}"} if received else {}
+        self._send(308, headers=headers)
+
+    def _db(self, body):
+        parts = urlsplit(self.path)
+        table = parts.path[len("/rest/v1/"):]
+        params = parse_qsl(parts.query, keep_blank_values=True)
+        reserved = {"select", "order", "limit", "on_conflict", "columns"}
+        options = {k: v for k, v in params if k in reserved}
+        filters = [(k, v) for k, v in params if k not in reserved]
+        if self.command == "GET":
+            limit = int(options["limit"]) if "limit" in options else None
+            return self._send(200, self.state.select(table, filters, options.get("select"), options.get("order"), limit))
+        payload = json.loads(body or b"null")
+        if self.command == "POST":
+            rows = payload if isinstance(payload, list) else [payload]
+            merge = "merge-duplicates" in (self.headers.get("Prefer") or "")
+            return self._send(201, self.state.upsert(table, rows, options.get("on_conflict") if merge else None))
+        if self.command == "PATCH":
+            return self._send(200, self.state.update(table, filters, payload))
+        self._send(405, {"message": "method not allowed"})
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 클라이언트가 응답을 끝까지 읽지 않고 끊는 경우(중복 연결로 다운로드 생략, 프로세스 종료)는 무시
+        if isinstance(sys.exc_info()[1], (ConnectionError, TimeoutError)):
+            return
+        super().handle_error(request, client_address)
+
+def start_stand_in(state):
+    handler = type("BoundStandInHandler", (StandInHandler,), {"state": state})
+    server = StandInServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def run_once(state, base_url, engine, concurrency, args, log_dir):
+    """대역 상태를 초기화하고 backup_to_drive.py를 하위 프로세스로 1회 실행하여 리포트 반환"""
+    state.reset()
+    state.seed_memos(args.memos, args.files_per_memo, base_url)
+    report_path = os.path.join(log_dir, f"report_{engine}_{concurrency}.json")
+    log_path = os.path.join(log_dir, f"log_{engine}_{concurrency}.txt")
+    env = dict(os.environ,
+               SUPABASE_URL=base_url, SUPABASE_KEY="bench", GAS_URL=f"{base_url}/gas",
+               R2_HOST_MARKER="r2.dev", BACKUP_ENGINE=engine, BACKUP_REPORT_PATH=report_path,
+               BACKUP_RECORD_RUNS="0", PYTHONUNBUFFERED="1")
+    if engine == "async":
+        env["BACKUP_CONCURRENCY"] = str(concurrency)
+    else:
+        env["BACKUP_WORKERS"] = str(concurrency)
+    if args.gas_rate is not None:
+        env["GAS_RATE_PER_SEC"] = str(args.gas_rate)
+    if args.transfer_mode:
+        env["BACKUP_TRANSFER_MODE"] = args.transfer_mode
+    if args.dup_ratio > 0:
+        env["BACKUP_CONTENT_DEDUP"] = "1"
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backup_to_drive.py")
+    started = time.monotonic()
+    with open(log_path, "w", encoding="utf-8") as log:
+        proc = subprocess.run([sys.executable, script], env=env, stdout=log, stderr=subprocess.STDOUT, timeout=args.timeout)
+    wall = time.monotonic() - started
+
+    report = {}
+    if os.path.exists(report_path):
+        with open(report_path, encoding="utf-8") as f:
+            report = json.load(f)
+    return {
+        "engine": engine,
+        "concurrency": concurrency,
+        "exit_code": proc.returncode,
+        "wall_sec": round(wall, 3),
+        "memo_status": state.memo_status_counts(),
+        "drive_files": state.drive_files,
+        "requests": dict(state.requests),
+        "injected_errors": dict(state.injected),
+        "report": report,
+        "log": log_path,
+    }
+
+def print_result(result):
+    report = result["report"]
+    status = result["memo_status"]
+    if not report:
+        print(f"❌ {result['engine']:<6} x{result['concurrency']:<4} 리포트 없음 (종료 코드 {result['exit_code']}, 로그: {result['log']})")
+        return
+    mb = report["download_bytes_per_sec"] / (1024 * 1024)
+    print(f"🏁 {result['engine']:<6} x{result['concurrency']:<4} {report['elapsed_sec']:>7.1f}s  "
+          f"{report['files_per_sec']:>7.2f} files/s  {mb:>7.2f}MB/s  "
+          f"완료 {report['files_completed']} / 실패 {report['files_failed']} / 중복 {report['files_deduped']}  "
+          f"메모 {status}  GAS 요청 {result['requests']['gas']}  주입 오류 {sum(result['injected_errors'].values())}")
+    stages = report.get("stages", {})
+    # 단계별 누적 시간이 큰 순서 = 병목 후보
+    for stage, h in sorted(stages.items(), key=lambda kv: -kv[1]["total_sec"]):
+        print(f"     ⏱️ {stage:<10} {h['count']:>6}회  합계 {h['total_sec']:>8.1f}s  p50 {h['p50_ms']:>7.1f}ms  "
+              f"p95 {h['p95_ms']:>7.1f}ms  p99 {h['p99_ms']:>7.1f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="backup_to_drive.py 로컬 부하 테스트 (R2/GAS/Drive/PostgREST 대역 서버)")
+    parser.add_argument("--workers", default="4,8,16", help="측정할 동시성 목록 (thread: BACKUP_WORKERS, async: BACKUP_CONCURRENCY)")
+    parser.add_argument("--engine", choices=["thread", "async", "both"], default="thread")
+    parser.add_argument("--memos", type=int, default=50)
+    parser.add_argument("--files-per-memo", type=int, default=3)
+    parser.add_argument("--file-kb", type=int, default=512, help="사진 1장 크기(KB)")
+    parser.add_argument("--dup-ratio", type=float, default=0.0, help="같은 내용 사진 비율 (콘텐츠 해시 중복 제거 측정)")
+    parser.add_argument("--latency", default="", help="서비스별 지연(ms), 예: r2=30,gas=400,drive=80,db=20")
+    parser.add_argument("--errors", default="", help="서비스별 503 오류율, 예: gas=0.02,db=0.01")
+    parser.add_argument("--jitter", type=float, default=0.2, help="지연 시간 변동 비율 (±)")
+    parser.add_argument("--r2-mbps", type=float, default=0.0, help="R2 다운로드 대역폭 제한(Mbps, 0이면 제한 없음)")
+    parser.add_argument("--gas-rate", type=float, default=None, help="GAS_RATE_PER_SEC 재정의 (미지정 시 운영 기본값)")
+    parser.add_argument("--transfer-mode", choices=["stream", "base64"], default=None)
+    parser.add_argument("--gas-session", choices=["ok", "missing", "html", "flaky"], default="ok",
+                        help="GAS createUploadSession 응답: ok(지원) / missing(unknown action JSON) / html(HTML 오류 페이지) / flaky(5회 중 1회 일시 실패)")
+    parser.add_argument("--timeout", type=float, default=1800, help="실행 1회 제한 시간(초)")
+    parser.add_argument("--out", default=None, help="전체 결과 JSON 저장 경로")
+    args = parser.parse_args()
+
+    latency = parse_service_map(args.latency, DEFAULT_LATENCY_MS)
+    errors = parse_service_map(args.errors)
+    state = StandInState(latency, errors, args.file_kb * 1024, args.dup_ratio, args.r2_mbps, args.jitter, gas_session=args.gas_session)
+    server, base_url = start_stand_in(state)
+    engines = ["thread", "async"] if args.engine == "both" else [args.engine]
+    levels = [int(x) for x in args.workers.split(",") if x.strip()]
+    log_dir = tempfile.mkdtemp(prefix="bench_backup_")
+
+    print(f"🧪 대역 서버 {base_url} | 메모 {args.memos}건 x 사진 {args.files_per_memo}장 ({args.file_kb}KB)")
+    print(f"   지연(ms) {latency} | 오류율 {errors} | 로그 {log_dir}")
+    results = []
+    try:
+        for engine in engines:
+            for level in levels:
+                result = run_once(state, base_url, engine, level, args, log_dir)
+                print_result(result)
+                results.append(result)
+    finally:
+        server.shutdown()
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"options": vars(args), "latency_ms": latency, "error_rates": errors, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"📝 결과 저장: {args.out}")
+
+if __name__ == "__main__":
+    main()
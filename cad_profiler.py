@@ -0,0 +1,336 @@
+import os
+import math
+import time
+import zipfile
+from collections import defaultdict
+
+# DXF/SHP 사전 분석 (Preflight)
+# 엔티티를 객체로 만들지 않고 그룹코드만 순차 스캔하여 변환 규모를 빠르게 추정합니다.
+# (추정치는 변환 전략 결정 및 용량 계획용이며 실제 변환 결과와 정확히 일치하지 않습니다)
+
+# dxf_to_geojson이 시각화하는 엔티티 타입
+RENDERED_TYPES = {'TEXT', 'MTEXT', 'POINT', 'CIRCLE', 'LWPOLYLINE', 'LINE', 'POLYLINE', 'ARC', 'SPLINE', 'ELLIPSE'}
+# 부모 엔티티에 종속되는 하위 레코드 (독립 엔티티로 세지 않음)
+SUB_RECORDS = {'VERTEX', 'SEQEND', 'ATTRIB'}
+
+# 대략적인 메모리 사용량 계수 (ezdxf 엔티티 / GeoJSON 피처 / 정점 1개당 바이트)
+BYTES_PER_ENTITY = 1500
+BYTES_PER_FEATURE = 1200
+BYTES_PER_VERTEX = 120
+
+# 타일링 프로필 (추정 피처 수 기준)
+TILE_PROFILES = [
+    # (최대 피처 수, 이름, 최대 줌, 추가 옵션)
+    (200_000, "standard", 22, []),
+    (2_000_000, "large", 20, []),
+    (None, "huge", 18, ["--coalesce-densest-as-needed"]),
+]
+
+def _detect_encoding(path):
+    """DXF 버전/코드페이지로 텍스트 인코딩 결정 (R2007 이상은 UTF-8)"""
+    try:
+        import ezdxf
+        return ezdxf.dxf_file_info(path).encoding
+    except Exception:
+        return "cp949"
+
+def _is_binary_dxf(path):
+    with open(path, "rb") as f:
+        return f.read(22).startswith(b"AutoCAD Binary DXF")
+
+def _iter_tags(path, encoding):
+    """ASCII DXF를 (그룹코드, 값) 쌍으로 순차 읽기"""
+    with open(path, "r", encoding=encoding, errors="replace") as f:
+        while True:
+            code = f.readline()
+            value = f.readline()
+            if not value:
+                break
+            try:
+                yield int(code), value.rstrip("\r\n")
+            except ValueError:
+                continue
+
+def _polyline_length(points):
+    return sum(math.hypot(points[i + 1][0] - points[i][0], points[i + 1][1] - points[i][1]) for i in range(len(points) - 1))
+
+def profile_dxf(path, target_layers=None, centerline_layer=None):
+    """DXF 사전 분석: 레이어/타입별 엔티티 수, INSERT 분해 규모, 정점/피처 추정치, 중심선 길이"""
+    started = time.monotonic()
+    if _is_binary_dxf(path):
+        return _profile_dxf_ezdxf(path, target_layers, centerline_layer, started)
+
+    targets = set(target_layers or [])
+    by_layer = defaultdict(int)
+    by_type = defaultdict(int)
+    # 블록 정의별 통계: 직접 포함 엔티티 수, 정점 수, 중첩 INSERT 목록
+    blocks = defaultdict(lambda: {"entities": 0, "vertices": 0, "inserts": []})
+    ms_inserts = []  # (블록 이름, 대상 레이어 여부)
+    ms_entities = 0
+    ms_vertices = 0
+    est_features = 0
+    est_vertices = 0
+    centerline_len = 0.0
+
+    section = None
+    block_name = None
+    expect_section_name = False
+    ent = None    # 현재 읽는 엔티티 {type, layer, vertices, block, points, paperspace}
+    owner = None  # VERTEX/ATTRIB/SEQEND가 종속되는 POLYLINE/INSERT
+
+    def finish(e):
+        nonlocal ms_entities, ms_vertices, est_features, est_vertices, centerline_len
+        etype = e["type"]
+        if section == "BLOCKS":
+            if block_name is None or etype in ("BLOCK", "ENDBLK"):
+                return
+            b = blocks[block_name]
+            if etype == "INSERT":
+                b["inserts"].append(e["block"])
+            else:
+                b["entities"] += 1
+                b["vertices"] += e["vertices"]
+            return
+        if section != "ENTITIES" or e["paperspace"]:
+            return
+        layer = e["layer"]
+        ms_entities += 1
+        ms_vertices += e["vertices"]
+        by_layer[layer] += 1
+        by_type[etype] += 1
+        in_target = not targets or layer in targets
+        if etype == "INSERT":
+            ms_inserts.append((e["block"], in_target))
+        elif in_target and etype in RENDERED_TYPES:
+            est_features += 1
+            est_vertices += max(e["vertices"], 1)
+        if centerline_layer and layer == centerline_layer and etype in ("LINE", "LWPOLYLINE", "POLYLINE"):
+            centerline_len += _polyline_length(e["points"])
+
+    for code, value in _iter_tags(path, _detect_encoding(path)):
+        if code == 0:
+            # 직전 엔티티 마무리 (POLYLINE/INSERT는 하위 레코드가 뒤따를 수 있어 보류)
+            if ent is not None and ent["type"] not in SUB_RECORDS:
+                if ent["type"] in ("POLYLINE", "INSERT"):
+                    owner = ent
+                else:
+                    finish(ent)
+            ent = None
+            if value in SUB_RECORDS and owner is not None:
+                if value == "SEQEND":
+                    finish(owner)
+                    owner = None
+                else:
+                    ent = {"type": value, "owner": owner}
+                continue
+            if owner is not None:
+                finish(owner)
+                owner = None
+            if value == "SECTION":
+                expect_section_name = True
+            elif value == "ENDSEC":
+                section = None
+            elif value == "ENDBLK":
+                block_name = None
+            elif section in ("BLOCKS", "ENTITIES") and value != "EOF":
+                ent = {"type": value, "points": [], "vertices": 0, "layer": "0", "block": None, "paperspace": False}
+            continue
+        if expect_section_name and code == 2:
+            section = value
+            expect_section_name = False
+            continue
+        if ent is None:
+            continue
+        etype = ent["type"]
+        if etype in SUB_RECORDS:
+            # VERTEX 좌표는 부모 POLYLINE의 정점으로 합산
+            if etype == "VERTEX" and code in (10, 20):
+                target = ent["owner"]
+                if code == 10:
+                    target["vertices"] += 1
+                    target["points"].append([float(value), 0.0])
+                elif target["points"]:
+                    target["points"][-1][1] = float(value)
+            continue
+        if code == 8:
+            ent["layer"] = value
+        elif code == 2:
+            if etype == "BLOCK":
+                block_name = value
+            elif etype == "INSERT":
+                ent["block"] = value
+        elif code == 67 and value.strip() == "1":
+            ent["paperspace"] = True
+        elif etype == "POLYLINE":
+            continue  # POLYLINE 헤더의 10/20은 더미 좌표
+        elif code in (10, 11):
+            ent["vertices"] += 1
+            ent["points"].append([float(value), 0.0])
+        elif code in (20, 21) and ent["points"]:
+            ent["points"][-1][1] = float(value)
+    if ent is not None and ent["type"] not in SUB_RECORDS:
+        finish(ent)
+    if owner is not None:
+        finish(owner)
+
+    # 블록 분해(fan-out) 규모: 중첩 INSERT까지 재귀적으로 펼친 엔티티/정점 수
+    expanded = {}
+    def expand(name, stack=()):
+        if name in expanded:
+            return expanded[name]
+        if name in stack or name not in blocks:
+            return (0, 0)
+        b = blocks[name]
+        n, v = b["entities"], b["vertices"]
+        for child in b["inserts"]:
+            cn, cv = expand(child, stack + (name,))
+            n += cn
+            v += cv
+        expanded[name] = (n, v)
+        return expanded[name]
+
+    insert_fanout = 0
+    for name, in_target in ms_inserts:
+        n, v = expand(name)
+        insert_fanout += n
+        if in_target:
+            est_features += n
+            est_vertices += v
+
+    return {
+        "format": "dxf",
+        "file_size": os.path.getsize(path),
+        "entities": ms_entities,
+        "vertices": ms_vertices,
+        "entities_by_layer": dict(by_layer),
+        "entities_by_type": dict(by_type),
+        "layer_count": len(by_layer),
+        "block_count": len(blocks),
+        "insert_count": len(ms_inserts),
+        "insert_fanout": insert_fanout,
+        "estimated_features": est_features,
+        "estimated_vertices": est_vertices,
+        "centerline_length": round(centerline_len, 3) if centerline_layer else None,
+        "elapsed": round(time.monotonic() - started, 3),
+    }
+
+def _profile_dxf_ezdxf(path, target_layers, centerline_layer, started):
+    """Binary DXF는 그룹코드 스캔이 불가하므로 ezdxf 로드 후 집계 (느림)"""
+    import ezdxf
+    doc = ezdxf.readfile(path)
+    msp = doc.modelspace()
+    targets = set(target_layers or [])
+    by_layer, by_type = defaultdict(int), defaultdict(int)
+    est_features = insert_count = insert_fanout = 0
+    centerline_len = 0.0
+    for e in msp:
+        layer, etype = e.dxf.layer, e.dxftype()
+        by_layer[layer] += 1
+        by_type[etype] += 1
+        in_target = not targets or layer in targets
+        if etype == "INSERT":
+            insert_count += 1
+            n = sum(1 for _ in e.virtual_entities())
+            insert_fanout += n
+            if in_target: est_features += n
+        elif in_target and etype in RENDERED_TYPES:
+            est_features += 1
+        if centerline_layer and layer == centerline_layer and etype in ("LINE", "LWPOLYLINE", "POLYLINE"):
+            pts = list(e.get_points('xy')) if etype == 'LWPOLYLINE' else ([e.dxf.start, e.dxf.end] if etype == 'LINE' else list(e.points()))
+            centerline_len += _polyline_length(pts)
+    return {
+        "format": "dxf-binary",
+        "file_size": os.path.getsize(path),
+        "entities": len(msp),
+        "vertices": None,
+        "entities_by_layer": dict(by_layer),
+        "entities_by_type": dict(by_type),
+        "layer_count": len(by_layer),
+        "block_count": len(doc.blocks),
+        "insert_count": insert_count,
+        "insert_fanout": insert_fanout,
+        "estimated_features": est_features,
+        "estimated_vertices": None,
+        "centerline_length": round(centerline_len, 3) if centerline_layer else None,
+        "elapsed": round(time.monotonic() - started, 3),
+    }
+
+def profile_shp_zip(zip_path):
+    """SHP ZIP 사전 분석: 압축 해제 없이 .shp/.shx 헤더와 크기로 레코드/정점 수 추정"""
+    started = time.monotonic()
+    by_layer = {}
+    by_type = defaultdict(int)
+    total_records = total_vertices = 0
+    shape_names = {1: "POINT", 3: "POLYLINE", 5: "POLYGON", 8: "MULTIPOINT", 11: "POINTZ", 13: "POLYLINEZ", 15: "POLYGONZ"}
+    with zipfile.ZipFile(zip_path) as z:
+        members = {info.filename.lower(): info for info in z.infolist()}
+        for name, info in members.items():
+            if not name.endswith(".shp"):
+                continue
+            shx = members.get(name[:-4] + ".shx")
+            with z.open(info) as f:
+                header = f.read(100)
+            shape_type = int.from_bytes(header[32:36], "little") if len(header) >= 36 else 0
+            # .shx는 레코드당 8바이트 고정
+            records = (shx.file_size - 100) // 8 if shx else 0
+            if shape_type in (1, 11):
+                vertices = records
+            else:
+                # 레코드 헤더(8) + 도형 헤더(44) + 파트 인덱스를 제외한 나머지를 XY(16바이트)로 환산
+                vertices = max(0, (info.file_size - 100 - records * 52)) // 16
+            layer = os.path.splitext(os.path.basename(info.filename))[0]
+            by_layer[layer] = records
+            by_type[shape_names.get(shape_type, str(shape_type))] += records
+            total_records += records
+            total_vertices += vertices
+    return {
+        "format": "shp-zip",
+        "file_size": os.path.getsize(zip_path),
+        "entities": total_records,
+        "vertices": total_vertices,
+        "entities_by_layer": by_layer,
+        "entities_by_type": dict(by_type),
+        "layer_count": len(by_layer),
+        "block_count": 0,
+        "insert_count": 0,
+        "insert_fanout": 0,
+        "estimated_features": total_records,
+        "estimated_vertices": total_vertices,
+        "centerline_length": None,
+        "elapsed": round(time.monotonic() - started, 3),
+    }
+
+def _total_memory_mb():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return 4096
+
+def plan_conversion(profile, workers=1):
+    """사전 분석 결과로 변환 전략 결정 (직렬/병렬, 타일링 프로필, 메모리 한도)"""
+    features = profile.get("estimated_features") or profile.get("entities") or 0
+    vertices = profile.get("estimated_vertices") or 0
+    entities = (profile.get("entities") or 0) + (profile.get("insert_fanout") or 0)
+    est_mem_mb = (entities * BYTES_PER_ENTITY + features * BYTES_PER_FEATURE + vertices * BYTES_PER_VERTEX) // (1024 * 1024)
+
+    for limit, name, max_zoom, extra in TILE_PROFILES:
+        if limit is None or features <= limit:
+            tile_profile, tile_max_zoom, tile_options = name, max_zoom, extra
+            break
+
+    # 워커 1개당 메모리 몫을 넘는 작업은 다른 작업과 겹치지 않게 단독(직렬) 실행
+    total_mb = _total_memory_mb()
+    share_mb = total_mb // max(1, workers)
+    mode = "serial" if est_mem_mb > share_mb * 0.7 or tile_profile == "huge" else "parallel"
+    cpu = os.cpu_count() or 1
+    return {
+        "mode": mode,
+        "tile_profile": tile_profile,
+        "max_zoom": tile_max_zoom,
+        "tile_options": tile_options,
+        "tile_threads": cpu if mode == "serial" else max(1, cpu // max(1, workers)),
+        "estimated_memory_mb": int(est_mem_mb),
+        # 작업 1개의 메모리 몫: DXF/tippecanoe 경로는 위의 직렬/병렬 레인 결정으로만 지켜지며,
+        # 변환 중 직접 제한하는 것은 SHP ZIP 구성 파일의 메모리 읽기 예산뿐 (convert_r2.convert_shp_to_dxf_server)
+        "memory_limit_mb": int(total_mb if mode == "serial" else share_mb),
+    }
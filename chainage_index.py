@@ -0,0 +1,175 @@
+import io
+import json
+import gzip
+import math
+from bisect import bisect_left, bisect_right
+try:
+    from shapely.geometry import LineString
+    from shapely.strtree import STRtree
+except ImportError:
+    LineString, STRtree = None, None
+
+# 체인리지 인덱스 (convert_r2.py가 변환 시 생성하여 R2에 저장)
+# - centerline: 병합된 도로중심선 (원본 TM 좌표, 파트 순서 유지)
+# - rows: 체인리지를 가진 객체 목록 (station 오름차순 정렬)
+INDEX_VERSION = 1
+INDEX_COLUMNS = ["station", "offset", "side", "handle", "layer", "dxftype", "tm_x", "tm_y", "text"]
+
+def format_station(dist):
+    """거리(m)를 체인리지 문자열로 변환 (예: 2300.5 -> 2+300.500)"""
+    km = int(dist / 1000)
+    m = dist % 1000
+    return f"{km}+{m:07.3f}"
+
+def parse_station(value):
+    """체인리지 문자열을 거리(m)로 변환 (예: '2+300' -> 2300.0, 숫자는 그대로)"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    s = str(value).strip().split('/')[0]  # '0+000.000/상행(좌)/1.234' 형태도 허용
+    if '+' in s:
+        km, m = s.split('+', 1)
+        return int(km or 0) * 1000 + float(m or 0)
+    return float(s)
+
+def _line_parts(geom):
+    """LineString / MultiLineString을 좌표 파트 리스트로 변환"""
+    if geom is None or geom.is_empty:
+        return []
+    if geom.geom_type == 'LineString':
+        return [[(c[0], c[1]) for c in geom.coords]]
+    return [[(c[0], c[1]) for c in g.coords] for g in geom.geoms]
+
+def build_index(centerline_geom, rows, total_length, reverse=False, project_id=None, source_crs=None):
+    """체인리지 인덱스 딕셔너리 생성 (rows: INDEX_COLUMNS 순서의 리스트)"""
+    rows = sorted(rows, key=lambda r: r[0])
+    return {
+        "version": INDEX_VERSION,
+        "project_id": project_id,
+        "source_crs": source_crs,
+        "reverse": bool(reverse),
+        "total_length": total_length,
+        "centerline": [[[round(x, 3), round(y, 3)] for x, y in part] for part in _line_parts(centerline_geom)],
+        "columns": INDEX_COLUMNS,
+        "rows": [[round(r[0], 3), round(r[1], 3)] + list(r[2:]) for r in rows],
+    }
+
+def save_index(index, path):
+    """인덱스를 gzip 압축 JSON으로 저장"""
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+
+def load_index(source):
+    """파일 경로, bytes, 파일 객체 또는 dict에서 ChainageIndex 로드 (gzip 자동 판별)"""
+    if isinstance(source, dict):
+        return ChainageIndex(source)
+    if isinstance(source, (bytes, bytearray)):
+        raw = bytes(source)
+    elif hasattr(source, 'read'):
+        raw = source.read()
+    else:
+        with open(source, "rb") as f:
+            raw = f.read()
+    if raw[:2] == b'\x1f\x8b':
+        raw = gzip.decompress(raw)
+    return ChainageIndex(json.load(io.BytesIO(raw)))
+
+def load_index_from_url(url, timeout=30):
+    """R2 공개 URL에서 인덱스 다운로드 후 로드"""
+    import requests
+    res = requests.get(url, timeout=timeout)
+    res.raise_for_status()
+    return load_index(res.content)
+
+class ChainageIndex:
+    """체인리지 조회 API (점 -> 측점, 측점 구간 -> 객체)"""
+
+    def __init__(self, data):
+        self.project_id = data.get("project_id")
+        self.source_crs = data.get("source_crs")
+        self.reverse = data.get("reverse", False)
+        self.total_length = data.get("total_length", 0.0)
+        self.columns = data.get("columns", INDEX_COLUMNS)
+        self.rows = data.get("rows", [])
+        self.stations = [r[0] for r in self.rows]
+        self._transformer = None
+
+        # 중심선을 세그먼트 단위로 분해하고 누적 거리(시점 기준)를 미리 계산
+        # (shapely의 MultiLineString.project와 동일하게 파트를 순서대로 이어 붙인 거리)
+        self.segments = []
+        acc = 0.0
+        for part in data.get("centerline", []):
+            for i in range(len(part) - 1):
+                (x1, y1), (x2, y2) = part[i], part[i + 1]
+                seg_len = math.hypot(x2 - x1, y2 - y1)
+                if seg_len == 0: continue
+                self.segments.append((x1, y1, x2, y2, acc, seg_len))
+                acc += seg_len
+        if not self.total_length:
+            self.total_length = acc
+
+        # 공간 인덱스 (Shapely 사용 가능 시 STRtree로 로그 시간 최근접 검색)
+        self._tree = None
+        if STRtree and self.segments:
+            self._tree = STRtree([LineString([(s[0], s[1]), (s[2], s[3])]) for s in self.segments])
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _nearest_segment(self, x, y):
+        if self._tree is not None:
+            from shapely.geometry import Point
+            return self.segments[int(self._tree.nearest(Point(x, y)))]
+        # Shapely가 없으면 선형 탐색으로 대체
+        return min(self.segments, key=lambda s: _segment_distance(s, x, y)[0])
+
+    def _to_source_crs(self, lon, lat):
+        if self._transformer is None:
+            from pyproj import Transformer
+            self._transformer = Transformer.from_crs("EPSG:4326", self.source_crs, always_xy=True)
+        return self._transformer.transform(lon, lat)
+
+    def station_for_point(self, x, y, lonlat=False):
+        """좌표의 측점 조회 (lonlat=True면 GPS 경위도를 원본 좌표계로 변환 후 계산)"""
+        if not self.segments:
+            return None
+        if lonlat:
+            x, y = self._to_source_crs(x, y)
+        seg = self._nearest_segment(x, y)
+        offset, t = _segment_distance(seg, x, y)
+        x1, y1, x2, y2, seg_start, seg_len = seg
+        dist = seg_start + t * seg_len
+
+        # 진행방향 기준 외적으로 좌/우 판별 (convert_r2.compute_chainage와 동일 규칙)
+        cross_prod = (x2 - x1) * (y - y1) - (y2 - y1) * (x - x1)
+        side = "중앙"
+        if cross_prod < 0: side = "우"
+        elif cross_prod > 0: side = "좌"
+
+        station = self.total_length - dist if self.reverse else dist
+        return {
+            "station": station,
+            "offset": offset,
+            "side": side,
+            "chainage": f"{format_station(station)}/상행({side})/{offset:.3f}",
+        }
+
+    def features_between(self, start, end, layers=None):
+        """측점 구간 [start, end]에 포함되는 객체 목록 (문자열 '2+300' 또는 m 단위 숫자)"""
+        lo, hi = parse_station(start), parse_station(end)
+        if lo > hi: lo, hi = hi, lo
+        i, j = bisect_left(self.stations, lo), bisect_right(self.stations, hi)
+        result = []
+        for row in self.rows[i:j]:
+            feat = dict(zip(self.columns, row))
+            if layers and feat.get("layer") not in layers: continue
+            feat["chainage"] = f"{format_station(feat['station'])}/상행({feat['side']})/{feat['offset']:.3f}"
+            result.append(feat)
+        return result
+
+def _segment_distance(seg, x, y):
+    """점과 세그먼트 사이의 거리 및 투영 위치 비율(0~1)"""
+    x1, y1, x2, y2, _, seg_len = seg
+    t = ((x - x1) * (x2 - x1) + (y - y1) * (y2 - y1)) / (seg_len * seg_len)
+    t = max(0.0, min(1.0, t))
+    px, py = x1 + t * (x2 - x1), y1 + t * (y2 - y1)
+    return math.hypot(x - px, y - py), t
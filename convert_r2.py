@@ -4,13 +4,19 @@ import json
 import re
 import math
 import subprocess
-import zipfile
+import shutil
+import tempfile
+import gzip
+import time
 import boto3
 import requests
 from datetime import datetime, timedelta, timezone
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from botocore.client import Config
 import ezdxf
 from pyproj import Transformer
+from chainage_index import build_index, save_index, format_station
+from cad_profiler import profile_dxf, profile_shp_zip, plan_conversion
 try:
     from shapely.geometry import Point, LineString, MultiLineString
     from shapely.ops import linemerge
@@ -47,7 +53,15 @@ if missing:
     print(f"Error: 다음 환경 변수들이 GitHub Secrets에 설정되지 않았습니다: {', '.join(missing)}")
     sys.exit(1)
 
+# [추가] 배치 모드에서 프로젝트 간 재사용할 클라이언트/좌표 변환기 캐시
+# (ProcessPool 워커는 fork로 생성되므로 PID가 바뀌면 새로 만든다)
+_client_cache = {}
+_transformer_cache = {}
+
 def get_supabase_client():
+    cached = _client_cache.get("supabase")
+    if cached and cached[0] == os.getpid():
+        return cached[1]
     if not create_client:
         print("⚠️ Supabase client creation skipped: Library not imported.")
         return None
@@ -59,19 +73,34 @@ def get_supabase_client():
     print(f"🔍 Supabase Config Check: URL={SUPABASE_URL[:15]}..., KEY={SUPABASE_KEY[:5]}...{SUPABASE_KEY[-5:]}")
     
     try:
-        return create_client(SUPABASE_URL, SUPABASE_KEY)
+        client = create_client(SUPABASE_URL, SUPABASE_KEY)
+        _client_cache["supabase"] = (os.getpid(), client)
+        return client
     except Exception as e:
         print(f"❌ Supabase client initialization failed: {e}")
     return None
 
 def get_r2_client():
-    return boto3.client(
+    cached = _client_cache.get("r2")
+    if cached and cached[0] == os.getpid():
+        return cached[1]
+    client = boto3.client(
         's3',
         endpoint_url=f"https://{R2_ACCOUNT_ID}.r2.cloudflarestorage.com",
         aws_access_key_id=R2_ACCESS_KEY_ID,
         aws_secret_access_key=R2_SECRET_ACCESS_KEY,
         config=Config(signature_version='s3v4')
     )
+    _client_cache["r2"] = (os.getpid(), client)
+    return client
+
+def get_transformer(source_crs):
+    """source_crs별 Transformer 재사용 (생성 비용이 커서 배치 모드에서 공유)"""
+    transformer = _transformer_cache.get(source_crs)
+    if transformer is None:
+        transformer = Transformer.from_crs(source_crs, "EPSG:4326", always_xy=True)
+        _transformer_cache[source_crs] = transformer
+    return transformer
 
 def download_from_r2(key, local_path):
     """R2에서 파일 다운로드 (공통)"""
@@ -86,50 +115,83 @@ def download_from_r2(key, local_path):
         print(f"Error downloading {key}: {e}")
         return False
 
-def get_chainage_details(line_geom, pt_geom, total_length, reverse=False):
-    """체인리지, 방향, 오프셋 계산"""
+def delete_from_r2(key):
+    """[추가] R2 객체 삭제 (실패해도 작업은 계속, 성공 여부 반환)"""
     try:
-        # 1. Station (시점으로부터의 거리)
-        dist = line_geom.project(pt_geom)
-        
-        # 2. Offset (중심선과의 수직 거리)
-        offset = line_geom.distance(pt_geom)
-        
-        # 3. 방향 (좌/우) 판별
-        # 투영점(중심선 상의 점) 구하기
-        proj_pt = line_geom.interpolate(dist)
-        
-        # 접선 벡터 구하기 (진행 방향)
-        delta = 0.1
-        if dist + delta <= total_length:
-            next_pt = line_geom.interpolate(dist + delta)
-            vec_line = (next_pt.x - proj_pt.x, next_pt.y - proj_pt.y)
-        else:
-            prev_pt = line_geom.interpolate(dist - delta)
-            vec_line = (proj_pt.x - prev_pt.x, proj_pt.y - prev_pt.y)
-            
-        # 투영점 -> 대상점 벡터
-        vec_pt = (pt_geom.x - proj_pt.x, pt_geom.y - proj_pt.y)
-        
-        # 외적 (Cross Product)으로 좌우 판별: x1*y2 - x2*y1
-        # 진행방향 기준: 양수=좌측, 음수=우측 (일반적인 좌표계)
-        cross_prod = vec_line[0] * vec_pt[1] - vec_line[1] * vec_pt[0]
-        direction_str = "중앙"
-        if cross_prod < 0: direction_str = "우"
-        elif cross_prod > 0: direction_str = "좌"
-        
-        # 역방향 처리 (거리는 반전하되, 상행 기준이므로 좌우/상행 표기는 유지)
-        final_dist = total_length - dist if reverse else dist
-        
-        km = int(final_dist / 1000)
-        m = final_dist % 1000
+        get_r2_client().delete_object(Bucket=R2_BUCKET_NAME, Key=key)
+        print(f"Deleted {key} from R2.")
+        return True
+    except Exception as e:
+        print(f"⚠️ Error deleting {key}: {e}")
+        return False
+
+def compute_chainage(line_geom, pt_geom, total_length, reverse=False):
+    """체인리지 수치 계산: (측점 거리, 방향, 오프셋)"""
+    # 1. Station (시점으로부터의 거리)
+    dist = line_geom.project(pt_geom)
+    
+    # 2. Offset (중심선과의 수직 거리)
+    offset = line_geom.distance(pt_geom)
+    
+    # 3. 방향 (좌/우) 판별
+    # 투영점(중심선 상의 점) 구하기
+    proj_pt = line_geom.interpolate(dist)
+    
+    # 접선 벡터 구하기 (진행 방향)
+    delta = 0.1
+    if dist + delta <= total_length:
+        next_pt = line_geom.interpolate(dist + delta)
+        vec_line = (next_pt.x - proj_pt.x, next_pt.y - proj_pt.y)
+    else:
+        prev_pt = line_geom.interpolate(dist - delta)
+        vec_line = (proj_pt.x - prev_pt.x, proj_pt.y - prev_pt.y)
         
-        # [설정] 정밀도 전략: 계산은 고정밀(Double)로 유지하고, 최종 출력 시 소수점 3자리(mm)로 반올림
-        # 포맷: 0+000.000 (전체 7자리, 소수점 3자리)
-        return f"{km}+{m:07.3f}/상행({direction_str})/{offset:.3f}"
-    except:
-        return None
-def dxf_to_geojson(project_id, source_crs, target_layers, centerline_layer=None, reverse_chainage=False):
+    # 투영점 -> 대상점 벡터
+    vec_pt = (pt_geom.x - proj_pt.x, pt_geom.y - proj_pt.y)
+    
+    # 외적 (Cross Product)으로 좌우 판별: x1*y2 - x2*y1
+    # 진행방향 기준: 양수=좌측, 음수=우측 (일반적인 좌표계)
+    cross_prod = vec_line[0] * vec_pt[1] - vec_line[1] * vec_pt[0]
+    direction_str = "중앙"
+    if cross_prod < 0: direction_str = "우"
+    elif cross_prod > 0: direction_str = "좌"
+    
+    # 역방향 처리 (거리는 반전하되, 상행 기준이므로 좌우/상행 표기는 유지)
+    final_dist = total_length - dist if reverse else dist
+    return final_dist, direction_str, offset
+
+# [추가] GeoJSON 변환 대상 엔티티 타입 (블록 분해 필요 여부 판단에도 사용)
+GEOJSON_TYPES = {'TEXT', 'MTEXT', 'POINT', 'CIRCLE', 'LWPOLYLINE', 'LINE', 'POLYLINE', 'ARC', 'SPLINE', 'ELLIPSE', 'INSERT'}
+
+def block_contribution_map(doc, target_layers):
+    """블록별로 분해 시 대상 레이어 객체가 나오는지 여부 (BLOCKS 섹션을 한 번만 훑어 계산)
+
+    virtual_entities()는 블록 내부 객체의 레이어를 그대로 유지하므로, 블록 안에 대상 레이어의 변환 대상 객체가 있거나
+    대상 레이어에 놓인 중첩 INSERT가 그런 블록을 참조할 때만 True입니다. (순환 참조는 고정점 반복으로 처리)
+    """
+    result = {}
+    nested = {}
+    for block in doc.blocks:
+        result[block.name] = False
+        refs = []
+        for be in block:
+            if be.dxf.layer not in target_layers: continue
+            dxftype = be.dxftype()
+            if dxftype == 'INSERT':
+                refs.append(be.dxf.name)
+            elif dxftype in GEOJSON_TYPES:
+                result[block.name] = True
+                break
+        nested[block.name] = refs
+    changed = True
+    while changed:
+        changed = False
+        for name, refs in nested.items():
+            if not result[name] and any(result.get(ref, False) for ref in refs):
+                result[name] = changed = True
+    return result
+
+def dxf_to_geojson(project_id, source_crs, target_layers, centerline_layer=None, reverse_chainage=False, work_dir="."):
     """DXF 파일을 GeoJSON으로 변환 (pyproj 좌표계 변환 및 레이어 필터링 적용)"""
     print(f"Converting DXF to GeoJSON (CRS: {source_crs})...")
     print(f"Target Layers: {target_layers}")    
@@ -138,8 +200,8 @@ def dxf_to_geojson(project_id, source_crs, target_layers, centerline_layer=None,
     srid = source_crs.split(':')[-1] if ':' in source_crs else '4326'
 
     try:
-        transformer = Transformer.from_crs(source_crs, "EPSG:4326", always_xy=True)
-        doc = ezdxf.readfile("input.dxf")
+        transformer = get_transformer(source_crs)
+        doc = ezdxf.readfile(os.path.join(work_dir, "input.dxf"))
         msp = doc.modelspace()
         print(f"DXF Loaded. Entities in Modelspace: {len(msp)}")
         
@@ -173,13 +235,18 @@ def dxf_to_geojson(project_id, source_crs, target_layers, centerline_layer=None,
             elif not LineString: 
                 print("⚠️ Centerline layer provided but Shapely library is missing. Chainage calculation skipped.")
         
+        # [추가] 레이어 필터는 집합으로 조회하고, 대상 레이어 객체가 나올 수 없는 블록 참조는 분해하지 않음
+        target_set = set(target_layers or [])
+        block_contributes = block_contribution_map(doc, target_set) if target_set else None
+
         features_map = {'Point': [], 'LineString': [], 'Polygon': []}
-        stats = {'Point': 0, 'LineString': 0, 'Polygon': 0}
+        stats = {'Point': 0, 'LineString': 0, 'Polygon': 0, 'skipped_inserts': 0}
+        chainage_rows = [] # [추가] 체인리지 인덱스용 (station, offset, side, handle, layer, dxftype, tm_x, tm_y, text)
 
         def process_entity(e, is_inside_block=False):
             try:
                 # [복구] 과거의 안정적인 레이어 필터링 방식
-                if target_layers and e.dxf.layer not in target_layers: return
+                if target_set and e.dxf.layer not in target_set: return
 
                 dxftype = e.dxftype()
 
@@ -249,10 +316,13 @@ def dxf_to_geojson(project_id, source_crs, target_layers, centerline_layer=None,
 
                 # [PMTiles] 블록(INSERT) 시각화: 분해하여 내부 객체 처리 (재귀)
                 if dxftype == 'INSERT':
-                    for sub_e in e.virtual_entities(): process_entity(sub_e, is_inside_block=True)
+                    if block_contributes is None or block_contributes.get(e.dxf.name, True):
+                        for sub_e in e.virtual_entities(): process_entity(sub_e, is_inside_block=True)
+                    else:
+                        stats['skipped_inserts'] += 1
 
                 # 블록 자체를 포함하여 허용된 타입만 처리
-                if dxftype not in ['TEXT', 'MTEXT', 'POINT', 'CIRCLE', 'LWPOLYLINE', 'LINE', 'POLYLINE', 'ARC', 'SPLINE', 'ELLIPSE', 'INSERT']: return
+                if dxftype not in GEOJSON_TYPES: return
 
                 geom_type = None
                 coords = []
@@ -271,6 +341,7 @@ def dxf_to_geojson(project_id, source_crs, target_layers, centerline_layer=None,
                     props['rotation'] = -float(e.dxf.rotation)
 
                 chainage_val = None
+                chainage_num = None
                 # 원본 TM 좌표 및 체인리지 계산
                 tm_pt = None
                 if dxftype in ['TEXT', 'MTEXT', 'INSERT']:
@@ -291,9 +362,11 @@ def dxf_to_geojson(project_id, source_crs, target_layers, centerline_layer=None,
                     if centerline_geom:
                         try:
                             pt = Point(tm_pt[0], tm_pt[1])
-                            c_info = get_chainage_details(centerline_geom, pt, centerline_len, reverse_chainage)
-                            if c_info:
-                                props['chainage'] = c_info
+                            chainage_num = compute_chainage(centerline_geom, pt, centerline_len, reverse_chainage)
+                            station, direction_str, offset = chainage_num
+                            # [설정] 정밀도 전략: 계산은 고정밀(Double)로 유지하고, 최종 출력 시 소수점 3자리(mm)로 반올림
+                            # 포맷: 0+000.000 (전체 7자리, 소수점 3자리)
+                            props['chainage'] = f"{format_station(station)}/상행({direction_str})/{offset:.3f}"
                             chainage_val = props['chainage']
                         except: pass
 
@@ -348,100 +421,102 @@ def dxf_to_geojson(project_id, source_crs, target_layers, centerline_layer=None,
                         feat = {"type": "Feature", "geometry": {"type": geom_type, "coordinates": coords}, "properties": props}
                         features_map[geom_type].append(feat)
                         stats[geom_type] += 1
+                        if chainage_val:
+                            station, direction_str, offset = chainage_num
+                            chainage_rows.append((station, offset, direction_str, props['handle'], props['layer'], dxftype, props['tm_x'], props['tm_y'], props.get('text')))
 
             except: pass
         
-        for e in msp: process_entity(e)
+        # ezdxf의 msp.query()도 내부적으로 전체 엔티티를 순회하므로, 집합 조회로 먼저 거른 뒤 처리
+        for e in msp:
+            if target_set and e.dxf.layer not in target_set: continue
+            process_entity(e)
+        if stats['skipped_inserts']:
+            print(f"Skipped {stats['skipped_inserts']} block references without target-layer content")
 
         # [추가] R2 보관용 통합 GeoJSON 생성 (모든 레이어 통합)
         combined_features = features_map['Point'] + features_map['LineString'] + features_map['Polygon']
         if combined_features:
-            with open("temp_combined.geojson", "w", encoding="utf-8") as f:
+            with open(os.path.join(work_dir, "temp_combined.geojson"), "w", encoding="utf-8") as f:
                 json.dump({"type": "FeatureCollection", "features": combined_features}, f, ensure_ascii=False)
 
         if features_map['Polygon']:
-            with open("temp_polygon.geojson", "w", encoding="utf-8") as f: json.dump({"type": "FeatureCollection", "features": features_map['Polygon']}, f, ensure_ascii=False)
+            with open(os.path.join(work_dir, "temp_polygon.geojson"), "w", encoding="utf-8") as f: json.dump({"type": "FeatureCollection", "features": features_map['Polygon']}, f, ensure_ascii=False)
         if features_map['Point']:
-            with open("temp_point.geojson", "w", encoding="utf-8") as f: json.dump({"type": "FeatureCollection", "features": features_map['Point']}, f, ensure_ascii=False)
+            with open(os.path.join(work_dir, "temp_point.geojson"), "w", encoding="utf-8") as f: json.dump({"type": "FeatureCollection", "features": features_map['Point']}, f, ensure_ascii=False)
         if features_map['LineString']:
-            with open("temp_line.geojson", "w", encoding="utf-8") as f: json.dump({"type": "FeatureCollection", "features": features_map['LineString']}, f, ensure_ascii=False)
+            with open(os.path.join(work_dir, "temp_line.geojson"), "w", encoding="utf-8") as f: json.dump({"type": "FeatureCollection", "features": features_map['LineString']}, f, ensure_ascii=False)
+
+        # [추가] 체인리지 인덱스 저장 (중심선 + 측점 정렬 객체 목록, 조회 API는 chainage_index.py)
+        if centerline_geom:
+            try:
+                index = build_index(centerline_geom, chainage_rows, centerline_len, reverse_chainage, project_id, source_crs)
+                save_index(index, os.path.join(work_dir, "temp_chainage_index.json.gz"))
+                print(f"Chainage index saved: {len(chainage_rows)} features")
+            except Exception as e:
+                print(f"⚠️ Chainage index build failed: {e}")
 
         return True
     except Exception as e:
         print(f"GeoJSON conversion error: {e}")
         return False
 
-def convert_shp_to_dxf_server(shp_paths, dxf_path, layer_field='LAYER'):
-    """여러 SHP 파일을 읽어 하나의 DXF로 병합 변환 (서버용)"""
+# [추가] ZIP 안의 SHP 구성 파일을 메모리로 읽는 변환 전체 예산 (작업자 수로 나누어 배분, 초과분은 추출 후 mmap)
+# SHP 읽기/요소 추출/청크 병합은 shp_to_dxf.py의 함수를 함께 사용 (기본 레이어 이름 규칙, 청크 크기 포함)
+SHP_MEMORY_LIMIT = int(os.environ.get("SHP_ZIP_MEMORY_LIMIT_MB", "256")) * 1024 * 1024
+
+# [추가] SHP 포인트의 텍스트 라벨로 사용할 필드 (범용적인 TEXTSTRING 및 STRING 우선 검색)
+SHP_TEXT_FIELDS = ('TEXTSTRING', 'STRING', 'TEXT', 'NAME', 'LABEL', 'CNAME')
+
+def convert_shp_to_dxf_server(shp_paths, dxf_path, layer_field='LAYER', workers=None, zip_path=None, memory_limit_mb=None):
+    """여러 SHP 파일을 읽어 하나의 DXF로 병합 변환 (서버용)
+
+    [수정] 파일별 읽기/변환은 프로세스 풀에서 병렬로 수행하고, DXF 작성은 메인 프로세스가 정렬된 경로 순서대로
+    병합하므로 작업자 수와 무관하게 항상 같은 DXF가 만들어집니다.
+    [추가] zip_path가 주어지면 shp_paths는 ZIP 멤버 이름이며 압축을 풀지 않고 직접 읽습니다.
+    [추가] memory_limit_mb(사전 분석 계획의 메모리 몫)가 주어지면 SHP_MEMORY_LIMIT 대신 그 안에서 작업자별 예산을 나눕니다.
+    """
     try:
-        import shapefile
-        print(f"Converting {len(shp_paths)} SHP files to a single DXF: {dxf_path}")
+        from shp_to_dxf import default_layers, extract_primitives, iter_chunks, add_primitives
+        shp_paths = sorted(shp_paths)
+        workers = max(1, min(workers or os.cpu_count() or 1, len(shp_paths)))
+        budget = SHP_MEMORY_LIMIT if not memory_limit_mb else min(SHP_MEMORY_LIMIT, int(memory_limit_mb) * 1024 * 1024)
+        memory_limit = budget // workers
+        print(f"Converting {len(shp_paths)} SHP files to a single DXF: {dxf_path} ({workers} workers, {memory_limit // (1024 * 1024)}MB in-memory per worker)")
         
         # [수정] R2007 이상 버전으로 설정하여 UTF-8 한글 처리 안정성 확보
         doc = ezdxf.new('R2007')
         doc.header['$DWGCODEPAGE'] = 'ANSI_949' # 한글 코드페이지 명시
         msp = doc.modelspace()
+        # [추가] 생성한 레이어 이름 캐시 (레코드마다 doc.layers 테이블 조회 방지)
+        known_layers = set()
 
-        for shp_path in shp_paths:
-            print(f"  -> Processing: {os.path.basename(shp_path)}")
-            try:
-                sf = shapefile.Reader(shp_path, encoding='cp949')
-            except Exception as e:
-                print(f"     ❌ Failed to read {shp_path}: {e}")
-                continue
-
-            # 필드 인덱스 찾기
-            fields = [f[0].upper() for f in sf.fields[1:]]
-            layer_idx = fields.index(layer_field.upper()) if layer_field.upper() in fields else -1
-            
-            # [추가] 텍스트 라벨로 사용할 필드 찾기 (범용적인 TEXTSTRING 및 STRING 우선 검색)
-            text_idx = -1
-            for tf in ['TEXTSTRING', 'STRING', 'TEXT', 'NAME', 'LABEL', 'CNAME']:
-                if tf in fields:
-                    text_idx = fields.index(tf)
-                    print(f"     ℹ️ Found text label field: {tf}")
-                    break
-            
-            # 기본 레이어 이름 (필드가 없을 경우 파일명 사용)
-            default_layer = os.path.splitext(os.path.basename(shp_path))[0]
-
-            for shape_rec in sf.shapeRecords():
-                shape = shape_rec.shape
-                record = shape_rec.record
-                
-                # 레이어 이름 결정: 필드값 우선, 없으면 파일명
-                layer_name = str(record[layer_idx]).strip().replace(" ", "_") if layer_idx != -1 else default_layer
-                if not layer_name or layer_name.lower() == 'none': layer_name = default_layer
-                
-                if layer_name not in doc.layers:
-                    doc.layers.new(name=layer_name)
-
-                # 기하 타입별 변환
-                if shape.shapeType == shapefile.POINT:
-                    pt = shape.points[0]
-                    # 1. 포인트 객체 추가
-                    msp.add_point(pt, dxfattribs={'layer': layer_name})
-                    
-                    # 2. [추가] 텍스트 라벨 필드가 있다면 TEXT 객체로 추가 (웹에서 텍스트 시각화용)
-                    if text_idx != -1:
-                        text_val = str(record[text_idx]).strip()
-                        if text_val:
-                            # 웹 지도 가독성을 위해 적절한 높이(height) 설정
-                            msp.add_text(text_val, dxfattribs={
-                                'insert': pt,
-                                'layer': layer_name,
-                                'height': 2.0
-                            })
-                elif shape.shapeType in [shapefile.POLYLINE, shapefile.POLYLINEZ]:
-                    parts = list(shape.parts) + [len(shape.points)]
-                    for i in range(len(parts)-1):
-                        pts = shape.points[parts[i]:parts[i+1]]
-                        if len(pts) >= 2: msp.add_lwpolyline(pts, dxfattribs={'layer': layer_name})
-                elif shape.shapeType in [shapefile.POLYGON, shapefile.POLYGONZ]:
-                    parts = list(shape.parts) + [len(shape.points)]
-                    for i in range(len(parts)-1):
-                        pts = shape.points[parts[i]:parts[i+1]]
-                        if len(pts) >= 3: msp.add_lwpolyline(pts, is_closed=True, dxfattribs={'layer': layer_name})
+        chunk_dir = tempfile.mkdtemp(prefix="shp_chunks_", dir=os.path.dirname(os.path.abspath(dxf_path)))
+        jobs = [(path, os.path.join(chunk_dir, f"{i}.pkl"), default)
+                for i, (path, default) in enumerate(zip(shp_paths, default_layers(shp_paths)))]
+        executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        try:
+            if executor:
+                pending = [executor.submit(extract_primitives, path, chunk_path, default, layer_field, zip_path, memory_limit, SHP_TEXT_FIELDS) for path, chunk_path, default in jobs]
+            # 앞 파일을 병합하는 동안 뒤 파일은 계속 변환됨
+            for i, (path, chunk_path, default) in enumerate(jobs):
+                result = pending[i].result() if executor else extract_primitives(path, chunk_path, default, layer_field, zip_path, memory_limit, SHP_TEXT_FIELDS)
+                if result is None:
+                    continue
+                layer_names, count = result
+                for layer_name in layer_names:
+                    if layer_name not in known_layers:
+                        if layer_name not in doc.layers:
+                            doc.layers.new(name=layer_name)
+                        known_layers.add(layer_name)
+                for chunk in iter_chunks(chunk_path):
+                    # 웹 지도 가독성을 위해 적절한 텍스트 높이(height) 설정
+                    add_primitives(msp, chunk, text_height=2.0)
+                os.remove(chunk_path)
+        finally:
+            if executor:
+                executor.shutdown(wait=True, cancel_futures=True)
+            shutil.rmtree(chunk_dir, ignore_errors=True)
 
         doc.saveas(dxf_path)
         print("SHP to DXF pre-processing complete.")
@@ -450,14 +525,16 @@ def convert_shp_to_dxf_server(shp_paths, dxf_path, layer_field='LAYER'):
         print(f"Error in SHP to DXF pre-processing: {e}")
         return False
 
-def convert_to_pmtiles():
+def convert_to_pmtiles(work_dir=".", plan=None):
     """Tippecanoe를 사용하여 GeoJSON을 PMTiles로 변환"""
-    print("Converting to PMTiles...")
+    # [추가] 사전 분석 결과(plan)에 따라 최대 줌/추가 옵션/스레드 수 조정
+    max_zoom = plan.get("max_zoom", 22) if plan else 22
+    print(f"Converting to PMTiles... (profile: {plan.get('tile_profile') if plan else 'standard'}, z{max_zoom})")
     
     cmd = [
         "tippecanoe",
-        "-o", "output.pmtiles",
-        "-z22",
+        "-o", os.path.join(work_dir, "output.pmtiles"),
+        f"-z{max_zoom}",
         "--drop-densest-as-needed",
         "--extend-zooms-if-still-dropping",
         "--force",
@@ -465,42 +542,39 @@ def convert_to_pmtiles():
         "--no-tiny-polygon-reduction",
         "-r1" # 포인트 누락 방지
     ]
+    if plan:
+        cmd.extend(plan.get("tile_options", []))
     
     has_input = False
-    if os.path.exists("temp_polygon.geojson"):
-        cmd.extend(["-L", "polygon:temp_polygon.geojson"])
-        has_input = True
-    if os.path.exists("temp_point.geojson"):
-        cmd.extend(["-L", "point:temp_point.geojson"])
-        has_input = True
-    if os.path.exists("temp_line.geojson"):
-        cmd.extend(["-L", "line:temp_line.geojson"])
-        has_input = True
+    for layer_name, file_name in [("polygon", "temp_polygon.geojson"), ("point", "temp_point.geojson"), ("line", "temp_line.geojson")]:
+        path = os.path.join(work_dir, file_name)
+        if os.path.exists(path):
+            cmd.extend(["-L", f"{layer_name}:{path}"])
+            has_input = True
     
-    if not has_input and os.path.exists("temp_combined.geojson"):
-        cmd.extend(["-L", "data:temp_combined.geojson"])
+    combined_path = os.path.join(work_dir, "temp_combined.geojson")
+    if not has_input and os.path.exists(combined_path):
+        cmd.extend(["-L", f"data:{combined_path}"])
         has_input = True
 
     if not has_input:
         print("No GeoJSON input files found.")
         return False
     
+    env = None
+    if plan and plan.get("tile_threads"):
+        env = dict(os.environ, TIPPECANOE_MAX_THREADS=str(plan["tile_threads"]))
+    
     try:
-        subprocess.run(cmd, check=True)
+        subprocess.run(cmd, check=True, env=env)
         print("Conversion complete.")
         return True
     except subprocess.CalledProcessError as e:
         print(f"Conversion failed: {e}")
         return False
 
-def upload_to_r2(project_id, cache_control, source_crs):
-    """Cloudflare R2에 PMTiles 업로드 및 메타데이터 갱신"""
-    print("Uploading to R2...")
-    
-    s3 = get_r2_client()
-    supabase = get_supabase_client() # [수정] Supabase 클라이언트 가져오기
-
-    # [추가] 캐시 만료 시간 계산 (DB 업데이트용)
+def cache_expiry_iso(cache_control):
+    """[추가] 캐시 만료 시간 계산 (DB 업데이트용, max-age가 없으면 None)"""
     expiry_iso = None
     if cache_control and "max-age=" in cache_control:
         try:
@@ -515,75 +589,111 @@ def upload_to_r2(project_id, cache_control, source_crs):
                     expiry_iso = expiry_dt.isoformat()
         except Exception as e:
             print(f"⚠️ Cache expiry calculation failed: {e}")
+    return expiry_iso
+
+def upload_to_r2(project_id, cache_control, source_crs, work_dir="."):
+    """Cloudflare R2에 PMTiles 업로드 (성공 시 cad_files 행 목록 반환, 기록은 commit_cad_job)"""
+    print("Uploading to R2...")
+    
+    s3 = get_r2_client()
+    expiry_iso = cache_expiry_iso(cache_control)
 
     # [수정] 업로드할 파일과 메타데이터를 리스트로 관리
     files_to_upload = []
     
-    if os.path.exists("output.pmtiles"):
+    pmtiles_path = os.path.join(work_dir, "output.pmtiles")
+    if os.path.exists(pmtiles_path):
         files_to_upload.append({
-            "local_path": "output.pmtiles",
+            "local_path": pmtiles_path,
             "r2_key": f"cad_data/cad_{project_id}_Data.pmtiles",
             "file_type": "pmtiles"
         })
 
     # [추가] 통합된 단일 GeoJSON 파일만 업로드 목록에 추가
-    if os.path.exists("temp_combined.geojson"):
+    combined_path = os.path.join(work_dir, "temp_combined.geojson")
+    if os.path.exists(combined_path):
         files_to_upload.append({
-            "local_path": "temp_combined.geojson",
+            "local_path": combined_path,
             "r2_key": f"cad_data/CAD_{project_id}.geojson",
             "file_type": "geojson"
         })
 
+    # [추가] 체인리지 인덱스 (중심선이 지정된 경우에만 생성됨)
+    index_path = os.path.join(work_dir, "temp_chainage_index.json.gz")
+    if os.path.exists(index_path):
+        files_to_upload.append({
+            "local_path": index_path,
+            "r2_key": f"cad_data/chainage_{project_id}.json.gz",
+            "file_type": "chainage_index"
+        })
+
     if not files_to_upload:
         print("No files to upload.")
         return False
 
     try:
-        for file_info in files_to_upload:
-            local_path = file_info["local_path"]
-            r2_key = file_info["r2_key"]
-            file_type = file_info["file_type"]
+        # [수정] 파일별 업로드를 동시에 실행 (하나라도 실패하면 전체 실패)
+        with ThreadPoolExecutor(max_workers=len(files_to_upload)) as executor:
+            futures = [executor.submit(_upload_file, s3, file_info, project_id, cache_control, source_crs, expiry_iso)
+                       for file_info in files_to_upload]
+            return [future.result() for future in futures]
+    except Exception as e:
+        print(f"Upload process failed: {e}")
+        return False
 
-            print(f"Uploading {local_path} to {r2_key}...")
+def upload_layer_summary(project_id, cache_control, source_crs, work_dir="."):
+    """[추가] 레이어 요약 업로드 (재계산 전용 경로 cad_data/summary_{id}.json.gz)"""
+    file_info = {
+        "local_path": os.path.join(work_dir, "temp_layer_summary.json.gz"),
+        "r2_key": f"cad_data/summary_{project_id}.json.gz",
+        "file_type": "layer_summary"
+    }
+    try:
+        return _upload_file(get_r2_client(), file_info, project_id, cache_control, source_crs, cache_expiry_iso(cache_control))
+    except Exception as e:
+        print(f"Layer summary upload failed: {e}")
+        return None
 
-            # 기존 파일 삭제 시도
-            try: s3.delete_object(Bucket=R2_BUCKET_NAME, Key=r2_key)
-            except: pass
+def create_layer_summary(project_id, dxf_path, work_dir="."):
+    """[추가] 레이어 요약 생성 후 작업 디렉토리에 저장 (실패 시 None)"""
+    try:
+        summary = build_layer_summary(dxf_path, project_id)
+        save_layer_summary(summary, os.path.join(work_dir, "temp_layer_summary.json.gz"))
+        return summary
+    except Exception as e:
+        print(f"  -> ❌ Layer summary failed: {e}")
+        return None
 
-            # 파일 업로드
-            with open(local_path, "rb") as f:
-                # [수정] 모든 파일에 캐시 설정 적용 (기존에는 PMTiles만 적용되었음)
-                s3.upload_fileobj(f, R2_BUCKET_NAME, r2_key, ExtraArgs={'CacheControl': cache_control})
-            print(f"  -> Upload success: {r2_key}")
+def _upload_file(s3, file_info, project_id, cache_control, source_crs, expiry_iso):
+    """파일 1개 R2 업로드 후 cad_files 행 반환 (업로드 실패 시 예외)"""
+    local_path = file_info["local_path"]
+    r2_key = file_info["r2_key"]
+    file_type = file_info["file_type"]
+    print(f"Uploading {local_path} to {r2_key}...")
 
-            # Supabase 메타데이터 업데이트
-            if supabase:
-                print(f"  -> Updating Supabase metadata for {file_type}...")
-                try:
-                    size = os.path.getsize(local_path)
-                    data = {
-                        "project_id": int(project_id), 
-                        "file_type": file_type, 
-                        "file_path": r2_key, 
-                        "file_size": size,
-                        "source_crs": source_crs,
-                        "updated_at": datetime.now(timezone.utc).isoformat()
-                    }
-                    # [추가] 캐시 만료 정보가 있으면 업데이트 데이터에 포함
-                    if expiry_iso:
-                        data["cache_expiry"] = expiry_iso
-                    
-                    # [수정] 파일 경로가 아닌 프로젝트ID와 타입 기준으로 기존 레코드 삭제 후 삽입 (중복 방지)
-                    supabase.table("cad_files").delete().eq("project_id", project_id).eq("file_type", file_type).execute()
-                    supabase.table("cad_files").insert(data).execute()
-                    
-                    print("  -> Supabase metadata updated.")
-                except Exception as e: print(f"  -> ❌ Supabase update failed: {e}")
-            else: print("  -> ⚠️ Supabase client not available. Metadata update skipped.")
-        return True
-    except Exception as e:
-        print(f"Upload process failed: {e}")
-        return False
+    # 기존 파일 삭제 시도
+    try: s3.delete_object(Bucket=R2_BUCKET_NAME, Key=r2_key)
+    except: pass
+
+    # 파일 업로드
+    with open(local_path, "rb") as f:
+        # [수정] 모든 파일에 캐시 설정 적용 (기존에는 PMTiles만 적용되었음)
+        s3.upload_fileobj(f, R2_BUCKET_NAME, r2_key, ExtraArgs={'CacheControl': cache_control})
+    print(f"  -> Upload success: {r2_key}")
+
+    # [수정] cad_files 메타데이터는 바로 기록하지 않고 작업 종료 시 commit_cad_job으로 일괄 기록
+    data = {
+        "project_id": int(project_id), 
+        "file_type": file_type, 
+        "file_path": r2_key, 
+        "file_size": os.path.getsize(local_path),
+        "source_crs": source_crs,
+        "updated_at": datetime.now(timezone.utc).isoformat()
+    }
+    # [추가] 캐시 만료 정보가 있으면 업데이트 데이터에 포함
+    if expiry_iso:
+        data["cache_expiry"] = expiry_iso
+    return data
 
 def sanitize_cad_text(s):
     if not s: return ""
@@ -595,282 +705,681 @@ def sanitize_cad_text(s):
 
 def run_recalculation(project_id, dxf_path):
     """도면 갱신 시 기존 계산 정보(연장, 수량 등)를 자동으로 재계산하여 Supabase 업데이트"""
+    update_payload = compute_recalculation(project_id, dxf_path)
+    if update_payload:
+        commit_recalculation(project_id, update_payload)
+
+def compute_recalculation(project_id, dxf_path):
+    """[수정] 재계산 결과(project_details 갱신 내용)만 계산하여 반환 (DB 기록은 commit_recalculation)
+
+    업로드와 동시에 실행할 수 있도록 계산과 기록을 분리했습니다. 계산할 대상이 없거나 실패하면 None을 반환합니다.
+    """
+    try:
+        summary = build_layer_summary(dxf_path, project_id)
+    except Exception as e:
+        print(f"  -> ❌ Recalculation failed: {e}")
+        return None
+    return recalculate_from_summary(project_id, summary)
+
+# [추가] 레이어별 집계 요약 (변환 시 생성하여 R2에 저장, 재계산은 DXF 대신 요약만 사용)
+# - layers: {레이어(대문자): {"length": 레이어 내 중복 제거 연장, "count": 객체 수}}
+# - shared_geometries: 여러 레이어에 동일하게 존재하는 도형 [연장 합계, [레이어...]] (레이어 조합 간 중복 보정용)
+# - texts: [정제된 텍스트, 레이어, 개수] (블록 내부 TEXT/MTEXT 포함)
+LAYER_SUMMARY_VERSION = 1
+LINEAR_TYPES = ('LINE', 'LWPOLYLINE', 'POLYLINE', 'ARC', 'SPLINE', 'CIRCLE', 'ELLIPSE')
+
+def _geometry_key(e, etype):
+    """기하학적 중복 판별 키 (좌표 소수점 3자리 기준, 판별 불가 시 None)"""
+    try:
+        if etype == 'LINE':
+            pts = sorted([(round(e.dxf.start.x, 3), round(e.dxf.start.y, 3)), (round(e.dxf.end.x, 3), round(e.dxf.end.y, 3))])
+            return ("LINE", tuple(pts))
+        elif etype == 'CIRCLE':
+            return ("CIRCLE", (round(e.dxf.center.x, 3), round(e.dxf.center.y, 3)), round(e.dxf.radius, 3))
+        elif etype == 'LWPOLYLINE':
+            return ("LWPOLYLINE", tuple((round(p[0], 3), round(p[1], 3)) for p in e.get_points()), e.closed)
+    except: pass
+    return None
+
+def _entity_length(e, etype):
+    """선형 객체의 연장 (기존 관로 재계산 규칙과 동일)"""
+    if etype == 'LINE': return e.dxf.start.distance(e.dxf.end)
+    if etype == 'CIRCLE': return 2 * math.pi * e.dxf.radius
+    if hasattr(e, 'length'): return e.length
+    length = 0.0
+    if etype in ('LWPOLYLINE', 'POLYLINE'):
+        pts = list(e.get_points()) if etype == 'LWPOLYLINE' else [v.dxf.location for v in e.vertices]
+        for idx_v in range(len(pts)-1):
+            p1, p2 = pts[idx_v], pts[idx_v+1]
+            length += ((p1[0]-p2[0])**2 + (p1[1]-p2[1])**2)**0.5
+    return length
+
+def build_layer_summary(dxf_path, project_id=None):
+    """DXF를 한 번 순회하여 레이어별 연장/수량과 텍스트 목록을 집계"""
+    doc = ezdxf.readfile(dxf_path)
+    msp = doc.modelspace()
+    print(f"  -> Layer summary: DXF Loaded ({len(msp)} entities in modelspace).")
+
+    layers = {}
+    layer_geometries = {}  # 레이어별 이미 집계한 도형 키
+    geometry_layers = {}   # 도형 키 -> [연장, 등장한 레이어 집합]
+    for e in msp:
+        layer = e.dxf.layer.upper()
+        stat = layers.setdefault(layer, {"length": 0.0, "count": 0})
+        stat["count"] += 1
+        if not e.is_alive or e.dxf.invisible: continue
+        etype = e.dxftype()
+        if etype not in LINEAR_TYPES: continue
+
+        geo_key = _geometry_key(e, etype)
+        if geo_key:
+            seen = layer_geometries.setdefault(layer, set())
+            if geo_key in seen: continue
+            seen.add(geo_key)
+        length = _entity_length(e, etype)
+        if geo_key:
+            info = geometry_layers.setdefault(geo_key, [length, set()])
+            info[1].add(layer)
+        stat["length"] += length
+
+    # 같은 레이어 조합에 걸친 도형은 연장을 합쳐 한 항목으로 저장
+    shared = {}
+    for length, owners in geometry_layers.values():
+        if len(owners) > 1:
+            owners = tuple(sorted(owners))
+            shared[owners] = shared.get(owners, 0.0) + length
+
+    # 블록 내부 텍스트까지 포함 (시설물 재계산과 동일한 대상)
+    text_counts = {}
+    text_entities = list(msp.query('TEXT MTEXT'))
+    for insert in msp.query('INSERT'):
+        text_entities.extend([e for e in insert.virtual_entities() if e.dxftype() in ('TEXT', 'MTEXT')])
+    for e in text_entities:
+        txt = e.dxf.text if e.dxftype() == 'TEXT' else (e.plain_text() if hasattr(e, 'plain_text') else e.text)
+        key = (sanitize_cad_text(txt), e.dxf.layer.upper())
+        text_counts[key] = text_counts.get(key, 0) + 1
+
+    print(f"  -> Layer summary built: {len(layers)} layers, {len(shared)} shared geometry groups, {len(text_counts)} distinct texts.")
+    return {
+        "version": LAYER_SUMMARY_VERSION,
+        "project_id": project_id,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "layers": {name: {"length": round(s["length"], 6), "count": s["count"]} for name, s in layers.items()},
+        "shared_geometries": [[round(length, 6), list(owners)] for owners, length in shared.items()],
+        "texts": [[t, layer, n] for (t, layer), n in text_counts.items()],
+    }
+
+def save_layer_summary(summary, path):
+    """레이어 요약을 gzip 압축 JSON으로 저장"""
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, separators=(',', ':'))
+
+def load_layer_summary(path):
+    """gzip 압축 JSON 레이어 요약 로드 (형식 버전이 LAYER_SUMMARY_VERSION과 다르면 None → DXF로 다시 생성)"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        summary = json.load(f)
+    if summary.get("version") != LAYER_SUMMARY_VERSION:
+        print(f"  -> ℹ️ Layer summary version {summary.get('version')} != {LAYER_SUMMARY_VERSION}, rebuilding from DXF.")
+        return None
+    return summary
+
+def summary_layers_length(summary, layers):
+    """레이어 목록의 합산 연장 (여러 레이어에 겹친 도형은 한 번만 집계)"""
+    layers = set(layers)
+    total = sum(summary["layers"][l]["length"] for l in layers if l in summary["layers"])
+    for length, owners in summary.get("shared_geometries", []):
+        overlap = len(layers.intersection(owners))
+        if overlap > 1:
+            total -= length * (overlap - 1)
+    return total
+
+def summary_layers_count(summary, layers):
+    """레이어 목록의 합산 객체 수"""
+    return sum(summary["layers"][l]["count"] for l in set(layers) if l in summary["layers"])
+
+def apply_layer_summary(details, summary):
+    """project_details의 관로/맨홀/시설물 표를 레이어 요약으로 재계산하여 갱신 내용 반환"""
+    # --- A. 관로 정보 재계산 ---
+    pipe_info = details.get('pipe_info', {})
+    p_headers = pipe_info.get('headers', [])
+    p_data = pipe_info.get('data', [])
+    idx_len = next((i for i, h in enumerate(p_headers) if h and "연장" in str(h)), -1) # '연장' 헤더 인덱스
+    idx_meta = next((i for i, h in enumerate(p_headers) if h == "_layers"), -1) # '_layers' 헤더 인덱스
+
+    print(f"  [Pipe Analysis] Headers found: {p_headers}")
+    print(f"  [Pipe Analysis] LenIdx: {idx_len}, MetaIdx: {idx_meta}")
+
+    if idx_len != -1 and idx_meta != -1:
+        total_m = 0.0
+        for i, row in enumerate(p_data):
+            row = list(row)  # 수정 가능하도록 리스트 변환
+            layers = []
+            if 0 <= idx_meta < len(row): # idx_meta가 row의 유효한 인덱스인지 확인
+                layers = [l.strip().upper() for l in str(row[idx_meta]).split(',') if l.strip()]
+
+            if not layers:
+                print(f"    - Row {i}: No specific layers to recalculate. Keeping value: {row[idx_len]}")
+                try: total_m += float(row[idx_len])
+                except: pass
+                p_data[i] = row
+                continue
+
+            row_len = summary_layers_length(summary, layers)
+            row[idx_len] = f"{row_len:.2f}"
+            total_m += row_len
+            p_data[i] = row
+            print(f"    - Row {i} Updated: {row_len:.2f}m (Layers: {layers})")
+        pipe_info['total'] = f"{total_m / 1000.0:.2f}" # km 단위 저장
+        print(f"  [Pipe] Recalculation finished. Total: {pipe_info['total']} km")
+    else:
+        print("  [Pipe] Recalculation skipped: Missing '연장' or '_layers' in headers.")
+
+    # --- B. 맨홀 정보 재계산 ---
+    man_info = details.get('manholes_info', {})
+    m_headers = man_info.get('headers', [])
+    m_data = man_info.get('data', [])
+    idx_qty = next((i for i, h in enumerate(m_headers) if h and "수량" in str(h)), -1) # '수량' 헤더 인덱스
+    idx_meta = next((i for i, h in enumerate(m_headers) if h == "_layers"), -1) # '_layers' 헤더 인덱스
+
+    print(f"  [Manhole Analysis] QtyIdx: {idx_qty}, MetaIdx: {idx_meta}")
+
+    if idx_qty != -1 and idx_meta != -1:
+        total_man = 0
+        for i, row in enumerate(m_data):
+            row = list(row)
+            layers = []
+            if 0 <= idx_meta < len(row): # idx_meta가 row의 유효한 인덱스인지 확인
+                layers = [l.strip().upper() for l in str(row[idx_meta]).split(',') if l.strip()]
+
+            if not layers:
+                print(f"    - Row {i}: No layers to recalculate. Skipping Manhole calc.")
+                try: total_man += int(float(row[idx_qty]))
+                except: pass
+                m_data[i] = row
+                continue
+            row_qty = summary_layers_count(summary, layers)
+            row[idx_qty] = str(row_qty)
+            total_man += row_qty
+            m_data[i] = row
+            print(f"    - Row {i} Updated: {row_qty} (Layers: {layers})")
+        man_info['total'] = str(total_man)
+        print(f"  [Manhole] Recalculation finished. Total: {man_info['total']}")
+
+    # --- C. 시설물 정보 재계산 ---
+    fac_info = details.get('facilities_info', {})
+    f_headers = fac_info.get('headers', [])
+    f_data = fac_info.get('data', [])
+    f_syns = fac_info.get('synonyms', [])
+    f_nd = fac_info.get('needs_diam', [])
+    f_excls_list = fac_info.get('exclusions', [])
+
+    idx_f_name, idx_f_qty = 0, next((i for i, h in enumerate(f_headers) if h and "수량" in str(h)), -1) # '수량' 헤더 인덱스
+    idx_f_diam = next((i for i, h in enumerate(f_headers) if h and "관경" in str(h)), -1) # '관경' 헤더 인덱스
+    idx_f_meta = next((i for i, h in enumerate(f_headers) if h == "_layers"), -1) # '_layers' 헤더 인덱스
+
+    if idx_f_qty != -1:
+        # 요약의 텍스트 목록: (정제된 텍스트, 레이어, 개수)
+        all_text_data = summary.get("texts", [])
+
+        for i, row in enumerate(f_data):
+            row = list(row)
+            name = str(row[idx_f_name]).strip()
+            diam = str(row[idx_f_diam]).strip() if idx_f_diam != -1 else ""
+
+            # 해당 행의 설정값 가져오기
+            syn_str = f_syns[i] if i < len(f_syns) else ""
+            # [수정] DB의 null(None) 값 대응 및 UI 로직(default=True)과 동기화
+            val_nd = f_nd[i] if i < len(f_nd) else True
+            needs_diam = True if val_nd is None else bool(val_nd)
+            excl_str = f_excls_list[i] if i < len(f_excls_list) else "하단"
+
+            # 검색어 및 제외어 리스트 구성
+            keywords = [name] + [s.strip() for s in syn_str.split(',') if s.strip()]
+            exclusions = [ex.strip() for ex in excl_str.split(',') if ex.strip()]
+            if "하단" not in exclusions: exclusions.append("하단")
+
+            # 레이어 필터 확인
+            layers = []
+            if idx_f_meta != -1 and idx_f_meta < len(row):
+                layers = [l.strip().upper() for l in str(row[idx_f_meta]).split(',') if l.strip()]
+
+            s_excls = [sanitize_cad_text(ex) for ex in exclusions]
+
+            # [수정] 검색 패턴 생성 로직을 UI와 완벽하게 동기화 (이름+관경 결합)
+            if needs_diam and diam:
+                search_patterns = [sanitize_cad_text(kw + diam) for kw in keywords]
+            else:
+                search_patterns = [sanitize_cad_text(kw) for kw in keywords]
+
+            if keywords[0]: # 기본 시설물명이 있는 경우만 진행
+                count = 0
+                for t_val, t_layer, t_count in all_text_data:
+                    # 레이어 필터가 있으면 레이어 체크, 없으면 전체 통과
+                    if layers and t_layer not in layers: continue
+
+                    # [검색 논리] 1. 제외어 체크 (하나라도 포함되면 제외)
+                    if any(ex in t_val for ex in s_excls): continue
+
+                    # [검색 논리] 2. 이름(+관경) 패턴 매칭
+                    if any(pat in t_val for pat in search_patterns):
+                        count += t_count
+                row[idx_f_qty] = str(count)
+            f_data[i] = row
+
+    return {
+        "pipe_info": pipe_info,
+        "manholes_info": man_info,
+        "facilities_info": fac_info
+    }
+
+def recalculate_from_summary(project_id, summary):
+    """저장된 project_details를 가져와 레이어 요약으로 재계산 (계산할 대상이 없거나 실패하면 None)"""
     supabase = get_supabase_client()
     if not supabase:
         print("⚠️ Supabase client not available for recalculation.")
-        return
+        return None
 
     print(f"Starting automatic recalculation for Project {project_id}...")
-    
+
     try:
         # 1. 현재 저장된 프로젝트 정보 가져오기
         res = supabase.table("project_details").select("*").eq("project_id", project_id).execute()
         if not res.data:
             print("  -> No project details found to update.")
-            return
-        
-        details = res.data[0]
-        doc = ezdxf.readfile(dxf_path)
-        msp = doc.modelspace()
-        print(f"  -> Recalculation: DXF Loaded ({len(msp)} entities in modelspace).")
+            return None
 
-        # --- A. 관로 정보 재계산 ---
-        pipe_info = details.get('pipe_info', {})
-        p_headers = pipe_info.get('headers', [])
-        p_data = pipe_info.get('data', [])
-        idx_len = next((i for i, h in enumerate(p_headers) if h and "연장" in str(h)), -1) # '연장' 헤더 인덱스
-        idx_meta = next((i for i, h in enumerate(p_headers) if h == "_layers"), -1) # '_layers' 헤더 인덱스
+        started = time.perf_counter()
+        update_payload = apply_layer_summary(res.data[0], summary)
+        print(f"  -> Recalculation computed ({(time.perf_counter() - started) * 1000:.1f}ms).")
+        return update_payload
+    except Exception as e:
+        print(f"  -> ❌ Recalculation failed: {e}")
+        return None
 
-        print(f"  [Pipe Analysis] Headers found: {p_headers}")
-        print(f"  [Pipe Analysis] LenIdx: {idx_len}, MetaIdx: {idx_meta}")
-        
-        if idx_len != -1 and idx_meta != -1:
-            total_m = 0.0
-            for i, row in enumerate(p_data):
-                row = list(row)  # 수정 가능하도록 리스트 변환
-                layers = []
-                if 0 <= idx_meta < len(row): # idx_meta가 row의 유효한 인덱스인지 확인
-                    layers = [l.strip().upper() for l in str(row[idx_meta]).split(',') if l.strip()]
-                
-                if not layers:
-                    print(f"    - Row {i}: No specific layers to recalculate. Keeping value: {row[idx_len]}")
-                    try: total_m += float(row[idx_len])
-                    except: pass
-                    p_data[i] = row
-                    continue
-                
-                row_len = 0.0
-                found_count = 0
-                processed_handles = set()
-                processed_geometries = set() # 중복 객체 제거(Overkill) 로직
-                linear_types = ('LINE', 'LWPOLYLINE', 'POLYLINE', 'ARC', 'SPLINE', 'CIRCLE', 'ELLIPSE')
-                
-                for e in msp:
-                    if not e.is_alive or e.dxf.layer.upper() not in layers or e.dxf.invisible: continue
-                    if e.dxf.handle in processed_handles: continue
-                    processed_handles.add(e.dxf.handle)
-                    
-                    etype = e.dxftype()
-                    if etype not in linear_types: continue
-                    
-                    # 기하학적 중복 체크
-                    geo_key = None
-                    try:
-                        if etype == 'LINE':
-                            pts = sorted([(round(e.dxf.start.x, 3), round(e.dxf.start.y, 3)), (round(e.dxf.end.x, 3), round(e.dxf.end.y, 3))])
-                            geo_key = ("LINE", tuple(pts))
-                        elif etype == 'CIRCLE':
-                            geo_key = ("CIRCLE", (round(e.dxf.center.x, 3), round(e.dxf.center.y, 3)), round(e.dxf.radius, 3))
-                        elif etype == 'LWPOLYLINE':
-                            geo_key = ("LWPOLYLINE", tuple((round(p[0], 3), round(p[1], 3)) for p in e.get_points()), e.closed)
-                    except: pass
-                    
-                    if geo_key:
-                        if geo_key in processed_geometries: continue
-                        processed_geometries.add(geo_key)
-
-                    if etype == 'LINE': row_len += e.dxf.start.distance(e.dxf.end)
-                    elif etype == 'CIRCLE': row_len += 2 * math.pi * e.dxf.radius
-                    elif hasattr(e, 'length'): row_len += e.length
-                    elif etype in ('LWPOLYLINE', 'POLYLINE'):
-                        # [수정] 인덱스 변수 i가 상위 반복문의 i(행 번호)를 덮어쓰지 않도록 idx_v로 변경
-                        pts = list(e.get_points()) if etype == 'LWPOLYLINE' else [v.dxf.location for v in e.vertices]
-                        for idx_v in range(len(pts)-1):
-                            p1, p2 = pts[idx_v], pts[idx_v+1]
-                            row_len += ((p1[0]-p2[0])**2 + (p1[1]-p2[1])**2)**0.5
-                        found_count += 1
-                
-                row[idx_len] = f"{row_len:.2f}"
-                total_m += row_len
-                p_data[i] = row
-                print(f"    - Row {i} Updated: {row_len:.2f}m (Found {found_count} items in {layers})")
-            pipe_info['total'] = f"{total_m / 1000.0:.2f}" # km 단위 저장
-            print(f"  [Pipe] Recalculation finished. Total: {pipe_info['total']} km")
-        else:
-            print("  [Pipe] Recalculation skipped: Missing '연장' or '_layers' in headers.")
-
-        # --- B. 맨홀 정보 재계산 ---
-        man_info = details.get('manholes_info', {})
-        m_headers = man_info.get('headers', [])
-        m_data = man_info.get('data', [])
-        idx_qty = next((i for i, h in enumerate(m_headers) if h and "수량" in str(h)), -1) # '수량' 헤더 인덱스
-        idx_meta = next((i for i, h in enumerate(m_headers) if h == "_layers"), -1) # '_layers' 헤더 인덱스
-        
-        print(f"  [Manhole Analysis] QtyIdx: {idx_qty}, MetaIdx: {idx_meta}")
-        
-        if idx_qty != -1 and idx_meta != -1:
-            total_man = 0
-            for i, row in enumerate(m_data):
-                row = list(row)
-                layers = []
-                if 0 <= idx_meta < len(row): # idx_meta가 row의 유효한 인덱스인지 확인
-                    layers = [l.strip().upper() for l in str(row[idx_meta]).split(',') if l.strip()]
-                
-                if not layers:
-                    print(f"    - Row {i}: No layers to recalculate. Skipping Manhole calc.")
-                    try: total_man += int(float(row[idx_qty]))
-                    except: pass
-                    m_data[i] = row
-                    continue
-                row_qty = 0
-                processed_handles = set()
-                for e in msp:
-                    if e.dxf.layer.upper() in layers and e.dxf.handle not in processed_handles:
-                        processed_handles.add(e.dxf.handle)
-                        row_qty += 1
-                row[idx_qty] = str(row_qty)
-                total_man += row_qty
-                m_data[i] = row
-                print(f"    - Row {i} Updated: {row_qty} (Layers: {layers})")
-            man_info['total'] = str(total_man)
-            print(f"  [Manhole] Recalculation finished. Total: {man_info['total']}")
-
-        # --- C. 시설물 정보 재계산 ---
-        fac_info = details.get('facilities_info', {})
-        f_headers = fac_info.get('headers', [])
-        f_data = fac_info.get('data', [])
-        f_syns = fac_info.get('synonyms', [])
-        f_nd = fac_info.get('needs_diam', [])
-        f_excls_list = fac_info.get('exclusions', [])
-
-        idx_f_name, idx_f_qty = 0, next((i for i, h in enumerate(f_headers) if h and "수량" in str(h)), -1) # '수량' 헤더 인덱스
-        idx_f_diam = next((i for i, h in enumerate(f_headers) if h and "관경" in str(h)), -1) # '관경' 헤더 인덱스
-        idx_f_meta = next((i for i, h in enumerate(f_headers) if h == "_layers"), -1) # '_layers' 헤더 인덱스
-        
-        if idx_f_qty != -1:
-            # [수정] 블록 내부 텍스트까지 포함하여 재계산 (동기화)
-            all_entities = list(msp.query('TEXT MTEXT'))
-            for insert in msp.query('INSERT'):
-                all_entities.extend([e for e in insert.virtual_entities() if e.dxftype() in ('TEXT', 'MTEXT')])
-            
-            # 텍스트와 레이어 정보를 쌍으로 저장
-            all_text_data = []
-            for e in all_entities:
-                txt = e.dxf.text if e.dxftype() == 'TEXT' else (e.plain_text() if hasattr(e, 'plain_text') else e.text)
-                all_text_data.append((sanitize_cad_text(txt), e.dxf.layer.upper()))
-            
-            for i, row in enumerate(f_data):
-                row = list(row)
-                name = str(row[idx_f_name]).strip()
-                diam = str(row[idx_f_diam]).strip() if idx_f_diam != -1 else ""
-                
-                # 해당 행의 설정값 가져오기
-                syn_str = f_syns[i] if i < len(f_syns) else ""
-                # [수정] DB의 null(None) 값 대응 및 UI 로직(default=True)과 동기화
-                val_nd = f_nd[i] if i < len(f_nd) else True
-                needs_diam = True if val_nd is None else bool(val_nd)
-                excl_str = f_excls_list[i] if i < len(f_excls_list) else "하단"
-
-                # 검색어 및 제외어 리스트 구성
-                keywords = [name] + [s.strip() for s in syn_str.split(',') if s.strip()]
-                exclusions = [ex.strip() for ex in excl_str.split(',') if ex.strip()]
-                if "하단" not in exclusions: exclusions.append("하단")
-                
-                # 레이어 필터 확인
-                layers = []
-                if idx_f_meta != -1 and idx_f_meta < len(row):
-                    layers = [l.strip().upper() for l in str(row[idx_f_meta]).split(',') if l.strip()]
-                
-                s_excls = [sanitize_cad_text(ex) for ex in exclusions]
-                
-                # [수정] 검색 패턴 생성 로직을 UI와 완벽하게 동기화 (이름+관경 결합)
-                if needs_diam and diam:
-                    search_patterns = [sanitize_cad_text(kw + diam) for kw in keywords]
+def run_summary_recalculation(project_id, work_dir=".", cache_control='no-cache', source_crs='EPSG:5187'):
+    """[추가] DXF 없이 R2의 레이어 요약만으로 재계산
+
+    [수정] 요약이 없거나 형식 버전이 다른 프로젝트는 DXF로 요약을 만들어 업로드(cad_files 행 포함)하므로
+    다음 재계산부터는 요약만 사용합니다.
+    """
+    summary_path = os.path.join(work_dir, "layer_summary.json.gz")
+    summary = None
+    files = []
+    if download_from_r2(f"cad_data/summary_{project_id}.json.gz", summary_path):
+        summary = load_layer_summary(summary_path)
+    if summary is None:
+        dxf_path = os.path.join(work_dir, "input.dxf")
+        if not download_from_r2(f"cad_data/CAD_{project_id}.dxf", dxf_path):
+            print(f"❌ No layer summary or DXF found for Project {project_id}.")
+            return False
+        summary = create_layer_summary(project_id, dxf_path, work_dir)
+        if summary is None:
+            return False
+        # 요약 업로드 실패는 재계산을 막지 않음 (다음 재계산에서 다시 생성)
+        row = upload_layer_summary(project_id, cache_control, source_crs, work_dir)
+        if row:
+            files.append(row)
+    update_payload = recalculate_from_summary(project_id, summary)
+    return bool(update_payload) and commit_cad_job(project_id, files, details=update_payload)
+
+def commit_recalculation(project_id, update_payload):
+    """3. 재계산 결과를 project_details에 기록 (성공 여부 반환)"""
+    return commit_cad_job(project_id, details=update_payload)
+
+# [추가] 작업 메타데이터 일괄 기록 RPC 사용 가능 여부 (함수가 없으면 프로세스 내에서 다시 시도하지 않음)
+_commit_rpc_available = True
+
+def commit_cad_job(project_id, files=None, details=None, status=None, removed=None):
+    """[추가] 작업의 메타데이터(cad_files 행, project_details 갱신, 상태)를 한 번에 기록 (기록 실패 시 False)
+
+    DB 함수 commit_cad_job(sql/commit_cad_job.sql)으로 한 트랜잭션에 기록하고,
+    함수가 아직 없으면 기존과 같은 순차 기록으로 대체합니다.
+    removed: 이번 변환에서 더 이상 만들어지지 않아 삭제할 cad_files 파일 종류 (예: 중심선이 빠진 재변환의 chainage_index)
+    """
+    global _commit_rpc_available
+    supabase = get_supabase_client()
+    if not supabase:
+        print("  -> ⚠️ Supabase client not available. Metadata update skipped.")
+        return False
+    files = files or []
+    removed = removed or []
+
+    if _commit_rpc_available:
+        try:
+            res = supabase.rpc("commit_cad_job", {
+                "p_project_id": int(project_id),
+                "p_files": files,
+                "p_details": details,
+                "p_status": status,
+                "p_removed": removed,
+            }).execute()
+            counts = res.data or {}
+            print(f"  -> Supabase metadata committed (files: {counts.get('files', 0)}, details: {counts.get('details', 0)}, status: {status})")
+            # 재계산 대상 행이 없어도 파일/상태는 기록되었으므로 경고만 출력 (작업은 실패 처리하지 않음)
+            if details is not None and not counts.get("details"):
+                print(f"  -> ⚠️ Supabase update failed: No rows matched project_id {project_id}")
+            return True
+        except Exception as e:
+            # PGRST202: 함수 없음 (스키마 캐시에 없음) → 순차 기록으로 대체
+            if "PGRST202" not in str(getattr(e, "code", "") or e):
+                print(f"  -> ❌ Supabase metadata commit failed: {e}")
+                return False
+            print("  -> ⚠️ commit_cad_job RPC not found. Falling back to sequential metadata writes.")
+            _commit_rpc_available = False
+
+    try:
+        for file_type in removed:
+            supabase.table("cad_files").delete().eq("project_id", project_id).eq("file_type", file_type).execute()
+        for data in files:
+            # [수정] 파일 경로가 아닌 프로젝트ID와 타입 기준으로 기존 레코드 삭제 후 삽입 (중복 방지)
+            supabase.table("cad_files").delete().eq("project_id", project_id).eq("file_type", data["file_type"]).execute()
+            supabase.table("cad_files").insert(data).execute()
+        if details is not None:
+            details = dict(details, updated_at=datetime.now(timezone.utc).isoformat())
+            res = supabase.table("project_details").update(details).eq("project_id", project_id).execute()
+            if not res.data:
+                print(f"  -> ⚠️ Supabase update failed: No rows matched project_id {project_id}")
+        if status is not None:
+            supabase.table("cad_projects").update({"status": status}).eq("id", project_id).execute()
+        print("  -> Supabase metadata updated.")
+        return True
+    except Exception as e:
+        print(f"  -> ❌ Supabase metadata update failed: {e}")
+        return False
+
+def run_stage_graph(stages):
+    """[추가] 의존 관계가 있는 변환 단계들을 스레드로 동시 실행 (선행 단계가 모두 성공한 단계만 실행)
+
+    stages: {이름: (선행 단계 이름 목록, fn(results))}
+    반환: {이름: 결과} (예외는 False, 선행 단계 실패로 건너뛴 단계는 None)
+    """
+    results = {}
+    pending = dict(stages)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(1, len(stages))) as executor:
+        while pending or running:
+            for name, (deps, fn) in list(pending.items()):
+                if any(d in pending or d in running.values() for d in deps): continue
+                del pending[name]
+                if all(results.get(d) for d in deps):
+                    running[executor.submit(_timed_stage, name, fn, results)] = name
                 else:
-                    search_patterns = [sanitize_cad_text(kw) for kw in keywords]
-                
-                if keywords[0]: # 기본 시설물명이 있는 경우만 진행
-                    count = 0
-                    for t_val, t_layer in all_text_data:
-                        # 레이어 필터가 있으면 레이어 체크, 없으면 전체 통과
-                        if layers and t_layer not in layers: continue
-                        
-                        # [검색 논리] 1. 제외어 체크 (하나라도 포함되면 제외)
-                        if any(ex in t_val for ex in s_excls): continue
-                        
-                        # [검색 논리] 2. 이름(+관경) 패턴 매칭
-                        if any(pat in t_val for pat in search_patterns):
-                            count += 1
-                    row[idx_f_qty] = str(count)
-                f_data[i] = row
-
-        # 3. Supabase 업데이트
-        update_payload = {
-            "pipe_info": pipe_info,
-            "manholes_info": man_info,
-            "facilities_info": fac_info,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }
-        res = supabase.table("project_details").update(update_payload).eq("project_id", project_id).execute()
-        if res.data:
-            print("  -> Recalculation and Supabase update complete.")
+                    results[name] = None
+                    print(f"⏭️ Stage {name} skipped (dependency failed)")
+            if not running:
+                if pending:
+                    raise ValueError(f"Stage graph has a cycle: {sorted(pending)}")
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    print(f"❌ Stage {name} failed: {e}")
+                    results[name] = False
+    return results
+
+def _timed_stage(name, fn, results):
+    started = time.monotonic()
+    try:
+        return fn(results)
+    finally:
+        print(f"⏱️ Stage {name}: {time.monotonic() - started:.1f}s")
+
+def run_preflight(project_id, input_type, input_path, layers, centerline_layer, workers=1):
+    """변환 전 입력 파일 사전 분석 → 변환 전략 결정 및 Supabase 기록 (용량 계획용)"""
+    try:
+        if input_type == 'zip':
+            profile = profile_shp_zip(input_path)
         else:
-            print(f"  -> ⚠️ Supabase update failed: No rows matched project_id {project_id}")
+            profile = profile_dxf(input_path, layers, centerline_layer)
     except Exception as e:
-        print(f"  -> ❌ Recalculation failed: {e}")
+        print(f"⚠️ Preflight profiling failed: {e}")
+        return None, None
+    plan = plan_conversion(profile, workers)
+
+    print(f"📊 Preflight ({profile['elapsed']}s): {profile['entities']} entities, {profile['layer_count']} layers, "
+          f"INSERT fan-out {profile['insert_fanout']}, ~{profile['estimated_features']} features / ~{profile['estimated_vertices']} vertices")
+    if profile.get('centerline_length') is not None:
+        print(f"   Centerline length: {profile['centerline_length']:.2f}")
+    print(f"   Plan: {plan['mode']} / tiles={plan['tile_profile']} (z{plan['max_zoom']}) / ~{plan['estimated_memory_mb']}MB of {plan['memory_limit_mb']}MB")
+
+    supabase = get_supabase_client()
+    if supabase and project_id:
+        try:
+            # [수정] 프로젝트당 최신 분석 결과 1행만 유지 (재변환마다 행이 쌓이지 않도록 project_id 기준 upsert)
+            supabase.table("cad_conversion_profiles").upsert({
+                "project_id": int(project_id),
+                "input_type": input_type,
+                "profile": profile,
+                "plan": plan,
+                "created_at": datetime.now(timezone.utc).isoformat()
+            }, on_conflict="project_id").execute()
+        except Exception as e:
+            print(f"⚠️ Preflight profile save failed: {e}")
+    return profile, plan
+
+def run_conversion_job(payload, work_dir=".", workers=1, defer_serial=False, preflight=None):
+    """단일 프로젝트 변환 작업 (준비 → 사전 분석 → GeoJSON → PMTiles → 업로드 → 재계산 → 상태 갱신)
+
+    defer_serial=True이면 사전 분석 결과 단독 실행이 필요한 작업은 변환하지 않고 None을 반환합니다.
+    preflight(사전 분석 결과)를 넘기면 work_dir에 이미 받아둔 입력 파일을 재사용합니다. (직렬 레인 전용)
+    """
+    project_id = payload.get('project_id')
+    source_crs = payload.get('source_crs', 'EPSG:5187')
+    layers = payload.get('layers', [])
+    cache_control = payload.get('cache_control', 'no-cache')
+    centerline_layer = payload.get('centerline_layer')
+    reverse_chainage = payload.get('reverse_chainage', False)
+    input_type = payload.get('input_type', 'dxf')
+    output_formats = payload.get('output_formats', ['pmtiles', 'json'])
+    
+    print(f"Starting conversion for Project {project_id} (Type: {input_type})")
+    
+    dxf_path = os.path.join(work_dir, "input.dxf")
+    conversion_ready = False
+    success = False
+
+    # 1. 입력 다운로드 (직렬 레인으로 연기된 작업만 사전 분석 때 받아둔 파일 재사용)
+    # [수정] 작업 디렉토리에 남아 있는 다른 프로젝트의 파일을 변환하지 않도록 그 외에는 항상 새로 다운로드
+    input_path = None
+    if input_type in ('dxf', 'zip'):
+        input_path = os.path.join(work_dir, f"input.{input_type}")
+        reuse = preflight is not None and os.path.exists(input_path)
+        if not reuse and not download_from_r2(f"cad_data/CAD_{project_id}.{input_type}", input_path):
+            input_path = None
+
+    # 2. [추가] 사전 분석 (Preflight) 및 변환 전략 결정
+    plan = None
+    if input_path:
+        if preflight is None:
+            preflight = run_preflight(project_id, input_type, input_path, layers, centerline_layer, workers)
+        plan = preflight[1]
+        if defer_serial and plan and plan['mode'] == 'serial':
+            # 직렬 레인에서 다시 분석하지 않도록 결과를 작업 디렉토리에 보관 (_run_batch_job이 읽어 전달)
+            with open(os.path.join(work_dir, "preflight.json"), "w", encoding="utf-8") as f:
+                json.dump(preflight, f, ensure_ascii=False)
+            print(f"⏸️ Project {project_id} deferred to serial lane (~{plan['estimated_memory_mb']}MB)")
+            return None
+    
+    # 3. 입력 타입에 따른 데이터 준비 (GeoJSON화)
+    if input_path and input_type == 'dxf':
+        if dxf_to_geojson(project_id, source_crs, layers, centerline_layer, reverse_chainage, work_dir):
+            conversion_ready = True
+    elif input_path and input_type == 'zip':
+        # [수정] 압축 전체를 풀지 않고 ZIP 안의 SHP 구성 파일(.shp/.shx/.dbf/.cpg)만 직접 읽기
+        from shp_to_dxf import list_zip_shapefiles
+        shp_files = list_zip_shapefiles(input_path)
+        
+        # 모든 SHP 파일을 하나의 DXF로 병합 변환
+        # [수정] SHP가 여러 개면 파일별 병렬 변환 (작업자 수는 사전 분석 계획의 CPU 몫)
+        if shp_files and convert_shp_to_dxf_server(shp_files, dxf_path, workers=plan['tile_threads'] if plan else None, zip_path=input_path,
+                                                   memory_limit_mb=plan['memory_limit_mb'] if plan else None):
+            if dxf_to_geojson(project_id, source_crs, layers, centerline_layer, reverse_chainage, work_dir):
+                conversion_ready = True
+    
+    # 4. PMTiles 변환 및 업로드
+    # [수정] 단계 그래프로 실행: 재계산은 DXF만 있으면 되므로 타일 변환/업로드와 동시에 계산하고,
+    # 기록(commit)은 업로드가 성공한 뒤에만 수행합니다. (성공 여부는 기존과 같이 PMTiles 변환 + 업로드 기준)
+    # [추가] DXF는 레이어 요약 생성 시 한 번만 읽고, 재계산은 요약으로 수행 (요약은 이후 재계산용으로 R2에 저장)
+    # [수정] 각 단계는 DB에 바로 쓰지 않고, cad_files/재계산/상태를 마지막에 commit_cad_job 한 번으로 기록
+    files, details = [], None
+    if conversion_ready:
+        results = run_stage_graph({
+            "pmtiles": ([], lambda r: convert_to_pmtiles(work_dir, plan)),
+            "summary": ([], lambda r: create_layer_summary(project_id, dxf_path, work_dir)),
+            "recalc": (["summary"], lambda r: recalculate_from_summary(project_id, r["summary"])),
+            "upload": (["pmtiles"], lambda r: upload_to_r2(project_id, cache_control, source_crs, work_dir)),
+            "summary_upload": (["upload", "summary"], lambda r: upload_layer_summary(project_id, cache_control, source_crs, work_dir)),
+        })
+        success = bool(results.get("upload"))
+        if success:
+            files = results["upload"] + ([results["summary_upload"]] if results.get("summary_upload") else [])
+            details = results.get("recalc") or None
+
+    if success:
+        # [추가] 중심선 없이 재변환되면 이전 체인리지 인덱스(다른 중심선 기준)를 행과 함께 삭제
+        stale_chainage = not os.path.exists(os.path.join(work_dir, "temp_chainage_index.json.gz"))
+        removed = ["chainage_index"] if stale_chainage else []
+        # Supabase가 없으면 기존과 같이 업로드 성공만으로 완료 처리
+        if not get_supabase_client() or commit_cad_job(project_id, files, details, "COMPLETED", removed):
+            if stale_chainage:
+                delete_from_r2(f"cad_data/chainage_{project_id}.json.gz")
+            print("All steps completed successfully.")
+            return True
+        success = False
+    print("Conversion process failed. Updating project status to FAILED...")
+    if project_id:
+        commit_cad_job(project_id, status="FAILED")
+    return success
+
+def _run_batch_job(payload, batch_root, workers=1, defer_serial=False, work_dir=None, preflight=None):
+    """배치 워커: 프로젝트별 독립 작업 디렉토리에서 변환 실행 후 정리"""
+    project_id = payload.get('project_id')
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix=f"cad_{project_id}_", dir=batch_root)
+    started = time.monotonic()
+    error = None
+    deferred = False
+    try:
+        success = run_conversion_job(payload, work_dir, workers, defer_serial, preflight)
+        if success is None:
+            # 단독 실행 대상: 작업 디렉토리(다운로드한 입력)와 사전 분석 결과를 직렬 레인으로 넘김
+            with open(os.path.join(work_dir, "preflight.json"), encoding="utf-8") as f:
+                preflight = tuple(json.load(f))
+            deferred = True
+    except Exception as e:
+        # 한 프로젝트의 예외가 배치 전체를 중단시키지 않도록 실패로 기록
+        print(f"❌ Project {project_id} crashed: {e}")
+        error = str(e)
+        success = False
+        try:
+            if project_id:
+                commit_cad_job(project_id, status="FAILED")
+        except Exception: pass
+    finally:
+        if not deferred:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return {"project_id": project_id, "success": bool(success), "deferred": deferred, "work_dir": work_dir,
+            "preflight": preflight, "elapsed": time.monotonic() - started, "error": error}
+
+def run_batch(payloads, max_workers=None):
+    """여러 프로젝트를 한 번의 실행으로 변환 (프로젝트별 작업 디렉토리 + 제한된 워커 풀)"""
+    if not max_workers:
+        max_workers = int(os.environ.get("CONVERT_MAX_WORKERS", "0") or 0) or min(4, os.cpu_count() or 1)
+    max_workers = max(1, min(int(max_workers), len(payloads)))
+    print(f"📦 Batch conversion: {len(payloads)} projects ({max_workers} workers)")
+
+    batch_root = tempfile.mkdtemp(prefix="cad_batch_")
+    results = []
+    deferred = []
+
+    # [수정] 같은 project_id가 두 번 오면 같은 R2 키/DB 행을 동시에 쓰게 되므로 처음 것만 실행하고 나머지는 실패 처리
+    jobs = []
+    seen = set()
+    for index, payload in enumerate(payloads):
+        project_id = payload.get('project_id')
+        if project_id in seen:
+            print(f"❌ Project {project_id} appears more than once in the batch (#{index + 1} skipped)")
+            results.append({"index": index, "project_id": project_id, "success": False, "deferred": False, "elapsed": 0.0,
+                            "error": "duplicate project_id in batch"})
+            continue
+        seen.add(project_id)
+        jobs.append((index, payload))
+
+    def collect(future, index):
+        # 결과는 project_id가 아닌 배치 내 위치로 구분
+        try:
+            result = future.result()
+        except Exception as e:
+            # 워커 프로세스 자체가 죽은 경우 (OOM 등)
+            result = {"project_id": payloads[index].get('project_id'), "success": False, "deferred": False, "elapsed": 0.0, "error": str(e)}
+        result["index"] = index
+        if result["deferred"]:
+            deferred.append(result)
+            return
+        results.append(result)
+        mark = "✅" if result["success"] else "❌"
+        print(f"{mark} Project {result['project_id']} finished in {result['elapsed']:.1f}s ({len(results)}/{len(payloads)})")
+
+    try:
+        # 1단계: 병렬 레인 (사전 분석 결과 메모리 몫을 넘는 작업은 직렬 레인으로 연기)
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(_run_batch_job, payload, batch_root, max_workers, max_workers > 1): index for index, payload in jobs}
+            for future in as_completed(futures):
+                collect(future, futures[future])
+
+        # 2단계: 직렬 레인 (대형 작업을 하나씩 단독 실행, 워커 프로세스로 메모리 격리)
+        if deferred:
+            print(f"🐢 Serial lane: {len(deferred)} large projects")
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                for item in list(deferred):
+                    deferred.remove(item)
+                    future = executor.submit(_run_batch_job, payloads[item['index']], batch_root, 1, False, item['work_dir'], item['preflight'])
+                    collect(future, item['index'])
+    finally:
+        shutil.rmtree(batch_root, ignore_errors=True)
+
+    # 프로젝트별 성공/실패 요약 (입력 순서)
+    results.sort(key=lambda r: r["index"])
+    succeeded = [r for r in results if r["success"]]
+    failed = [r for r in results if not r["success"]]
+    print(f"\n===== Batch Summary: {len(succeeded)} succeeded, {len(failed)} failed =====")
+    for r in results:
+        status = "COMPLETED" if r["success"] else "FAILED"
+        line = f"  - Project {r['project_id']}: {status} ({r['elapsed']:.1f}s)"
+        if r["error"]: line += f" - {r['error']}"
+        print(line)
+    return results
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
         print("Usage: python convert_r2.py <json_payload>")
+        print("       (recalculate) python convert_r2.py '{\"action\": \"recalculate\", \"project_id\": 1}'")
+        print("       (batch) python convert_r2.py '{\"projects\": [<payload>, ...], \"max_workers\": 4}'")
         sys.exit(1)
         
     try:
         payload = json.loads(sys.argv[1])
-        project_id = payload.get('project_id')
-        source_crs = payload.get('source_crs', 'EPSG:5187')
-        layers = payload.get('layers', [])
-        cache_control = payload.get('cache_control', 'no-cache')
-        centerline_layer = payload.get('centerline_layer')
-        reverse_chainage = payload.get('reverse_chainage', False)
-        input_type = payload.get('input_type', 'dxf')
-        output_formats = payload.get('output_formats', ['pmtiles', 'json'])
-        
-        print(f"Starting conversion for Project {project_id} (Type: {input_type})")
-        
-        conversion_ready = False
-        success = False
-        
-        # 1. 입력 타입에 따른 데이터 준비 (GeoJSON화)
-        if input_type == 'dxf':
-            if download_from_r2(f"cad_data/CAD_{project_id}.dxf", "input.dxf"):
-                if dxf_to_geojson(project_id, source_crs, layers, centerline_layer, reverse_chainage):
-                    conversion_ready = True
-        elif input_type == 'zip':
-            if download_from_r2(f"cad_data/CAD_{project_id}.zip", "input.zip"):
-                # 압축 해제 후 SHP 찾기
-                with zipfile.ZipFile("input.zip", 'r') as zip_ref:
-                    zip_ref.extractall("temp_shp")
-                
-                shp_files = []
-                for root, dirs, files in os.walk("temp_shp"):
-                    for f in files:
-                        if f.lower().endswith(".shp"):
-                            shp_files.append(os.path.join(root, f))
-                
-                # 모든 SHP 파일을 하나의 DXF로 병합 변환
-                if shp_files and convert_shp_to_dxf_server(shp_files, "input.dxf"):
-                    if dxf_to_geojson(project_id, source_crs, layers, centerline_layer, reverse_chainage):
-                        conversion_ready = True
-        
-        # 2. PMTiles 변환 및 업로드
-        if conversion_ready:
-            if convert_to_pmtiles():
-                if upload_to_r2(project_id, cache_control, source_crs):
-                    run_recalculation(project_id, "input.dxf")
-                    success = True
-
-        if success:
-            supabase = get_supabase_client()
-            if supabase:
-                supabase.table("cad_projects").update({"status": "COMPLETED"}).eq("id", project_id).execute()
-            print("All steps completed successfully.")
-        else:
-            print("Conversion process failed. Updating project status to FAILED...")
-            supabase = get_supabase_client()
-            if supabase and project_id:
-                supabase.table("cad_projects").update({"status": "FAILED"}).eq("id", project_id).execute()
-            sys.exit(1)
-            
     except json.JSONDecodeError:
         print("Invalid JSON payload")
         sys.exit(1)
+
+    # [추가] 배치 모드: payload 리스트 또는 {"projects": [...]} 형태
+    if isinstance(payload, list) or (isinstance(payload, dict) and 'projects' in payload):
+        projects = payload if isinstance(payload, list) else payload.get('projects', [])
+        max_workers = None if isinstance(payload, list) else payload.get('max_workers')
+        if not projects:
+            print("No projects in batch payload")
+            sys.exit(1)
+        results = run_batch(projects, max_workers)
+        if not all(r["success"] for r in results):
+            sys.exit(1)
+    elif payload.get('action') == 'recalculate':
+        # [추가] 표 설정만 바뀐 경우: 변환 없이 레이어 요약으로 재계산
+        if not run_summary_recalculation(payload.get('project_id'), cache_control=payload.get('cache_control', 'no-cache'),
+                                         source_crs=payload.get('source_crs', 'EPSG:5187')):
+            sys.exit(1)
+    elif not run_conversion_job(payload):
+        sys.exit(1)
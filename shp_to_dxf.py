@@ -4,96 +4,388 @@ import os
 import sys
 import zipfile
 import tempfile
+import io
+import mmap
+import codecs
 import shutil
-import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
+import pickle
+import queue
+import threading
+import time
+import glob
+import json
+import hashlib
+import argparse
+import multiprocessing
+from contextlib import ExitStack, redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, wait, as_completed
+try:
+    import tkinter as tk
+    from tkinter import ttk, filedialog, messagebox
+except ImportError:
+    # [수정] 서버(헤드리스) 환경에서는 tkinter 없이 CLI만 사용
+    tk = None
 
-def convert_shp_to_dxf(shp_path, output_dxf, layer_field='LAYER'):
+# SHP 변환 워커가 임시 파일에 한 번에 기록하는 DXF 요소 수 (워커 메모리 상한)
+CHUNK_SIZE = 20000
+# ZIP 안의 SHP 구성 파일을 메모리로 읽는 변환 전체 예산 (작업자 수로 나누어 배분, 초과분은 임시 폴더에 추출 후 mmap)
+MEMORY_LIMIT = 256 * 1024 * 1024
+# 진행률 보고 및 취소 확인 간격 (레코드 수)
+PROGRESS_INTERVAL = 5000
+
+# [추가] 진행률 보고 큐와 취소 이벤트 (프로세스 풀 워커는 initializer로, 단일 작업은 직접 설정)
+_progress_queue = None
+_cancel_event = None
+
+class ConversionCancelled(Exception):
+    """사용자가 변환을 취소함"""
+
+def _init_worker(progress_queue, cancel_event):
+    global _progress_queue, _cancel_event
+    _progress_queue, _cancel_event = progress_queue, cancel_event
+
+def _report(kind, n):
+    if _progress_queue is not None:
+        _progress_queue.put((kind, n))
+
+class _ProgressTracker:
+    """워커가 보낸 (종류, 레코드 수)를 누적하여 progress(단계, 처리 수, 전체 수) 콜백 호출"""
+    def __init__(self, progress):
+        self.progress = progress
+        self.total = 0
+        self.done = 0
+
+    def put(self, item):
+        kind, n = item
+        if kind == "total":
+            self.total += n
+        else:
+            self.done += n
+        if self.progress:
+            self.progress("read", self.done, self.total)
+
+    def drain(self, q):
+        while True:
+            try:
+                self.put(q.get_nowait())
+            except queue.Empty:
+                return
+
+def layer_name_for(value, default_layer):
+    """속성값을 DXF 레이어 이름으로 정제 (공백/슬래시는 _로, 빈 값이나 'None'은 기본 레이어)"""
+    name = str(value).strip().replace(" ", "_").replace("/", "_")
+    if not name or name.lower() == 'none':
+        return default_layer
+    return name
+
+def default_layers(shp_paths):
+    """경로 순서대로 파일명을 기본 레이어로 사용 (같은 파일명은 _2, _3 ... 접미사, convert_r2.py와 공용)"""
+    used = set()
+    names = []
+    for path in shp_paths:
+        stem = layer_name_for(os.path.splitext(os.path.basename(path))[0], "0")
+        name, n = stem, 1
+        while name in used:
+            n += 1
+            name = f"{stem}_{n}"
+        used.add(name)
+        names.append(name)
+    return names
+
+def _cpg_encoding(raw, default='cp949'):
+    """.cpg 내용을 파이썬 인코딩 이름으로 변환 (예: 'UTF-8', '949', 'ANSI 949' → cp949)"""
+    name = raw.decode('ascii', 'ignore').strip().lower()
+    if name.startswith('ansi'):
+        name = name[4:].strip(' _')
+    if name.isdigit():
+        name = f"cp{name}"
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return default
+
+def list_zip_shapefiles(zip_path):
+    """ZIP 안의 .shp 파일 이름 목록 (압축을 풀지 않고 목록만 조회)"""
+    with zipfile.ZipFile(zip_path) as zf:
+        return sorted(n for n in zf.namelist() if n.lower().endswith(".shp") and not n.startswith("__MACOSX/"))
+
+def open_shapefile(shp_path, stack, zip_path=None, spill_dir=None, memory_limit=MEMORY_LIMIT):
     """
-    SHP 파일을 읽어 지정된 필드값을 레이어 이름으로 매핑하여 DXF로 변환합니다.
+    SHP 파일을 엽니다. 한글 속성 깨짐 방지를 위해 .cpg가 없으면 cp949 인코딩을 사용합니다. (convert_r2.py와 공용)
+    zip_path가 주어지면 압축을 풀지 않고 .shx/.dbf/.shp 순서로 memory_limit(세 파일 합계)까지만 메모리로 읽고,
+    나머지는 spill_dir에 하나씩 추출하여 mmap(디스크에서 페이지 단위로 읽기)으로 엽니다. 열린 자원은 stack에 등록됩니다.
     """
-    if not os.path.exists(shp_path):
-        print(f"오류: 파일을 찾을 수 없습니다 -> {shp_path}")
-        return
+    if zip_path is None:
+        encoding = 'cp949'
+        cpg_path = os.path.splitext(shp_path)[0] + '.cpg'
+        if os.path.exists(cpg_path):
+            with open(cpg_path, 'rb') as f:
+                encoding = _cpg_encoding(f.read())
+        return stack.enter_context(shapefile.Reader(shp_path, encoding=encoding))
 
+    base = shp_path[:-4]
+    with zipfile.ZipFile(zip_path) as zf:
+        members = {n.lower(): n for n in zf.namelist()}
+        budget = memory_limit
+
+        def open_member(ext):
+            nonlocal budget
+            name = members.get((base + ext).lower())
+            if name is None:
+                return None
+            size = zf.getinfo(name).file_size
+            if size <= budget:
+                budget -= size
+                return io.BytesIO(zf.read(name))
+            f = stack.enter_context(open(zf.extract(name, spill_dir), 'rb'))
+            if size == 0:
+                return f  # 빈 파일은 mmap할 수 없음
+            return stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+        cpg = members.get((base + '.cpg').lower())
+        encoding = _cpg_encoding(zf.read(cpg)) if cpg else 'cp949'
+        # 작은 파일부터 메모리 예산에 담기 (.shx < .dbf/.shp)
+        shx, dbf, shp = open_member('.shx'), open_member('.dbf'), open_member('.shp')
+    return stack.enter_context(shapefile.Reader(shp=shp, shx=shx, dbf=dbf, encoding=encoding))
+
+def extract_primitives(shp_path, chunk_path, default_layer, layer_field='LAYER', zip_path=None, memory_limit=MEMORY_LIMIT, text_fields=()):
+    """
+    SHP 1개를 읽어 DXF 요소 목록을 pickle 청크 파일로 기록합니다. (프로세스 풀 워커, convert_r2.py와 공용)
+    요소: ("POINT", 레이어, 점) / ("TEXT", 레이어, 점, 문자열) / ("LWPOLYLINE", 레이어, 점 목록, 닫힘 여부)
+    text_fields가 주어지면 처음 찾은 필드 값을 포인트 위치의 TEXT 요소로도 기록합니다.
+    반환: (레이어 등장 순서 목록, 요소 수), 읽기 실패 시 None
+    """
     print(f"데이터 분석 중: {shp_path}")
-    
+
     # 1. SHP 파일 읽기
+    stack = ExitStack()
     try:
-        # 한글 속성 깨짐 방지를 위해 cp949 인코딩 사용
-        sf = shapefile.Reader(shp_path, encoding='cp949')
+        sf = open_shapefile(shp_path, stack, zip_path, os.path.dirname(chunk_path), memory_limit)
     except Exception as e:
+        stack.close()
         print(f"SHP 로드 실패: {e}")
-        return
+        return None
 
-    # 2. 필드 인덱스 찾기
-    # sf.fields[0]은 삭제 플래그이므로 실제 데이터 필드는 1번부터 시작합니다.
-    fields = [f[0].upper() for f in sf.fields[1:]]
-    try:
-        layer_idx = fields.index(layer_field.upper())
-    except ValueError:
-        print(f"경고: '{layer_field}' 필드를 찾을 수 없습니다. 필드 목록: {fields}")
-        print("기본 레이어 '0'을 사용합니다.")
-        layer_idx = -1
+    with stack:
+        # 2. 필드 인덱스 찾기
+        # sf.fields[0]은 삭제 플래그이므로 실제 데이터 필드는 1번부터 시작합니다.
+        fields = [f[0].upper() for f in sf.fields[1:]]
+        try:
+            layer_idx = fields.index(layer_field.upper())
+        except ValueError:
+            print(f"경고: '{layer_field}' 필드를 찾을 수 없습니다. 필드 목록: {fields}")
+            print(f"기본 레이어 '{default_layer}'을 사용합니다.")
+            layer_idx = -1
+
+        # 텍스트 라벨로 사용할 필드 (앞쪽 이름 우선)
+        text_idx = next((fields.index(tf) for tf in text_fields if tf in fields), -1)
+        if text_idx != -1:
+            print(f"텍스트 라벨 필드: {fields[text_idx]}")
+
+        print(f"변환 시작 (총 객체 수: {len(sf)})")
+        _report("total", len(sf))
+
+        layers = {}  # 등장 순서를 유지하는 레이어 이름 집합
+        count = 0
+        records = 0
+        chunk = []
+        with open(chunk_path, "wb") as f:
+            # 전체 레코드를 미리 리스트로 만들지 않고 한 건씩 읽기 (대용량 SHP 메모리 사용량 일정)
+            for shape_rec in sf.iterShapeRecords():
+                shape = shape_rec.shape
+                record = shape_rec.record
+
+                # 레이어 이름 결정 (DXF 레이어 이름에 사용할 수 없는 특수문자 정제)
+                layer_name = layer_name_for(record[layer_idx], default_layer) if layer_idx != -1 else default_layer
+                layers.setdefault(layer_name)
+
+                # 3. 기하 타입별 변환
+                # Point
+                if shape.shapeType == shapefile.POINT:
+                    pt = shape.points[0]
+                    chunk.append(("POINT", layer_name, pt))
+                    if text_idx != -1:
+                        text_val = str(record[text_idx]).strip()
+                        if text_val:
+                            chunk.append(("TEXT", layer_name, pt, text_val))
+
+                # LineString (Polyline)
+                elif shape.shapeType in [shapefile.POLYLINE, shapefile.POLYLINEZ]:
+                    # parts는 폴리라인이 끊겨있는 구간(Ring)의 시작 인덱스
+                    parts = list(shape.parts) + [len(shape.points)]
+                    for i in range(len(parts)-1):
+                        pts = shape.points[parts[i]:parts[i+1]]
+                        if len(pts) >= 2:
+                            chunk.append(("LWPOLYLINE", layer_name, pts, False))
+
+                # Polygon
+                elif shape.shapeType in [shapefile.POLYGON, shapefile.POLYGONZ]:
+                    parts = list(shape.parts) + [len(shape.points)]
+                    for i in range(len(parts)-1):
+                        pts = shape.points[parts[i]:parts[i+1]]
+                        if len(pts) >= 3:
+                            # 폴리곤은 닫힌 폴리라인으로 생성
+                            chunk.append(("LWPOLYLINE", layer_name, pts, True))
 
-    # 3. DXF 문서 생성 (AutoCAD Map 3D 2000 호환을 위해 R2000 설정)
+                if len(chunk) >= CHUNK_SIZE:
+                    pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+                    count += len(chunk)
+                    chunk = []
+
+                records += 1
+                if records % PROGRESS_INTERVAL == 0:
+                    _report("records", PROGRESS_INTERVAL)
+                    if _cancel_event is not None and _cancel_event.is_set():
+                        raise ConversionCancelled()
+            if chunk:
+                pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+                count += len(chunk)
+        _report("records", records % PROGRESS_INTERVAL)
+        return list(layers), count
+
+def iter_chunks(chunk_path):
+    """extract_primitives가 기록한 청크(요소 목록)를 순서대로 읽기"""
+    with open(chunk_path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+def add_primitives(msp, chunk, text_height=2.0):
+    """청크의 요소를 modelspace에 추가"""
+    for item in chunk:
+        kind, layer_name = item[0], item[1]
+        if kind == "POINT":
+            msp.add_point(item[2], dxfattribs={'layer': layer_name})
+        elif kind == "TEXT":
+            msp.add_text(item[3], dxfattribs={'insert': item[2], 'layer': layer_name, 'height': text_height})
+        else:
+            msp.add_lwpolyline(item[2], close=item[3], dxfattribs={'layer': layer_name})
+
+def convert_shps_to_dxf(shp_paths, output_dxf, layer_field='LAYER', workers=None, zip_path=None, progress=None, cancel=None):
+    """
+    여러 SHP 파일을 파일별로 병렬 변환(프로세스 풀)한 뒤 하나의 DXF로 병합합니다.
+    병합은 정렬된 경로 순서로 진행되므로 작업자 수와 무관하게 같은 결과가 만들어집니다.
+    zip_path가 주어지면 shp_paths는 ZIP 안의 파일 이름이며 압축을 풀지 않고 직접 읽습니다.
+    [추가] progress(단계, 처리 수, 전체 수)는 변환을 실행한 스레드에서 호출되며 단계는 read/merge/save 입니다.
+    cancel(threading.Event)이 설정되면 ConversionCancelled 예외로 중단합니다. (출력 파일은 만들지 않음)
+    """
+    shp_paths = sorted(shp_paths)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(shp_paths)))
+    # 동시에 열리는 SHP 수만큼 메모리 예산 분할 (작업자 수가 늘어도 전체 사용량은 MEMORY_LIMIT 이내)
+    memory_limit = MEMORY_LIMIT // workers
+
+    # DXF 문서 생성 (AutoCAD Map 3D 2000 호환을 위해 R2000 설정)
     doc = ezdxf.new('R2000')
     msp = doc.modelspace()
+    known_layers = set()
+    converted = 0
 
-    print(f"변환 시작 (총 객체 수: {len(sf)})")
+    chunk_dir = tempfile.mkdtemp(prefix="shp_chunks_")
+    jobs = [(path, os.path.join(chunk_dir, f"{i}.pkl"), default)
+            for i, (path, default) in enumerate(zip(shp_paths, default_layers(shp_paths)))]
 
-    for shape_rec in sf.shapeRecords():
-        shape = shape_rec.shape
-        record = shape_rec.record
-        
-        # 레이어 이름 결정
-        layer_name = "0"
-        if layer_idx != -1:
-            val = str(record[layer_idx]).strip()
-            if val:
-                # DXF 레이어 이름에 사용할 수 없는 특수문자 정제
-                layer_name = val.replace(" ", "_").replace("/", "_")
-        
-        # 레이어가 없으면 생성
-        if layer_name not in doc.layers:
-            doc.layers.new(name=layer_name)
-
-        # 4. 기하 타입별 변환
-        # Point
-        if shape.shapeType == shapefile.POINT:
-            msp.add_point(shape.points[0], dxfattribs={'layer': layer_name})
-        
-        # LineString (Polyline)
-        elif shape.shapeType in [shapefile.POLYLINE, shapefile.POLYLINEZ]:
-            # parts는 폴리라인이 끊겨있는 구간(Ring)의 시작 인덱스
-            parts = list(shape.parts) + [len(shape.points)]
-            for i in range(len(parts)-1):
-                pts = shape.points[parts[i]:parts[i+1]]
-                if len(pts) >= 2:
-                    msp.add_lwpolyline(pts, dxfattribs={'layer': layer_name})
-        
-        # Polygon
-        elif shape.shapeType in [shapefile.POLYGON, shapefile.POLYGONZ]:
-            parts = list(shape.parts) + [len(shape.points)]
-            for i in range(len(parts)-1):
-                pts = shape.points[parts[i]:parts[i+1]]
-                if len(pts) >= 3:
-                    # 폴리곤은 닫힌 폴리라인으로 생성
-                    msp.add_lwpolyline(pts, is_closed=True, dxfattribs={'layer': layer_name})
+    # 진행률/취소가 필요할 때만 워커와 통신 (프로세스 풀은 프로세스 간 큐/이벤트, 단일 작업은 직접 전달)
+    tracker = _ProgressTracker(progress)
+    watched = progress is not None or cancel is not None
+    executor = None
+    if workers > 1:
+        worker_queue = multiprocessing.Queue() if watched else None
+        worker_cancel = multiprocessing.Event() if watched else None
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(worker_queue, worker_cancel))
+    elif watched:
+        _init_worker(tracker, cancel)
 
+    def check_cancel():
+        if cancel is not None and cancel.is_set():
+            raise ConversionCancelled()
+
+    def wait_result(future):
+        # 결과를 기다리는 동안 워커 진행률을 전달하고 취소 요청을 워커에 알림
+        while not future.done():
+            wait([future], timeout=0.1)
+            if watched:
+                tracker.drain(worker_queue)
+                if cancel is not None and cancel.is_set():
+                    worker_cancel.set()
+        if watched:
+            tracker.drain(worker_queue)
+        check_cancel()
+        return future.result()
+
+    merged = expected = 0
+    try:
+        if executor:
+            pending = [executor.submit(extract_primitives, path, chunk_path, default, layer_field, zip_path, memory_limit) for path, chunk_path, default in jobs]
+        # 앞 파일을 병합하는 동안 뒤 파일은 계속 변환됨
+        for i, (path, chunk_path, default) in enumerate(jobs):
+            result = wait_result(pending[i]) if executor else extract_primitives(path, chunk_path, default, layer_field, zip_path, memory_limit)
+            if result is None:
+                continue
+            layer_names, count = result
+            expected += count
+            # 레이어가 없으면 생성 (이미 확인한 이름은 로컬 캐시로 판별)
+            for layer_name in layer_names:
+                if layer_name not in known_layers:
+                    if layer_name not in doc.layers:
+                        doc.layers.new(name=layer_name)
+                    known_layers.add(layer_name)
+            for chunk in iter_chunks(chunk_path):
+                add_primitives(msp, chunk)
+                merged += len(chunk)
+                if progress:
+                    progress("merge", merged, expected)
+                check_cancel()
+            os.remove(chunk_path)
+            converted += 1
+    finally:
+        if executor:
+            if watched and cancel is not None and cancel.is_set():
+                worker_cancel.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+        elif watched:
+            _init_worker(None, None)
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+
+    if not converted:
+        return None
+    if progress:
+        progress("save", merged, merged)
     doc.saveas(output_dxf)
     return True
 
+def convert_shp_to_dxf(shp_path, output_dxf, layer_field='LAYER'):
+    """
+    SHP 파일을 읽어 지정된 필드값을 레이어 이름으로 매핑하여 DXF로 변환합니다.
+    """
+    if not os.path.exists(shp_path):
+        print(f"오류: 파일을 찾을 수 없습니다 -> {shp_path}")
+        return
+
+    return convert_shps_to_dxf([shp_path], output_dxf, layer_field, workers=1)
+
+# 진행 상태 표시 이름
+PHASE_LABELS = {"read": "읽는 중", "merge": "병합 중", "save": "DXF 저장 중"}
+
 class ShpConverterUI:
     def __init__(self, root):
         self.root = root
         self.root.title("ASIN SHP to DXF Converter")
-        self.root.geometry("500x250")
+        self.root.geometry("500x330")
         
         self.zip_path = tk.StringVar()
         self.layer_field = tk.StringVar(value="LAYER")
+        self.status = tk.StringVar(value="대기 중")
+
+        # [추가] 변환은 작업 스레드에서 실행하고 결과/진행률은 큐로 받아 UI 스레드에서 표시
+        self.events = queue.Queue()
+        self.worker = None
+        self.cancel_event = None
+        self.started = None
         
         self.create_widgets()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def create_widgets(self):
         frame = ttk.Frame(self.root, padding="20")
@@ -108,8 +400,16 @@ class ShpConverterUI:
         ttk.Label(frame, text="레이어명으로 사용할 필드 (기본: LAYER):").grid(row=2, column=0, sticky=tk.W, pady=(15, 5))
         ttk.Entry(frame, textvariable=self.layer_field, width=20).grid(row=3, column=0, sticky=tk.W)
 
-        # 실행 버튼
-        ttk.Button(frame, text="DXF 변환 및 다운로드 저장", command=self.run_conversion).grid(row=4, column=0, columnspan=2, pady=20)
+        # 실행 / 취소 버튼
+        self.run_button = ttk.Button(frame, text="DXF 변환 및 다운로드 저장", command=self.run_conversion)
+        self.run_button.grid(row=4, column=0, pady=20)
+        self.cancel_button = ttk.Button(frame, text="취소", command=self.cancel_conversion, state=tk.DISABLED)
+        self.cancel_button.grid(row=4, column=1)
+
+        # [추가] 진행률 및 처리 속도 표시
+        self.progress_bar = ttk.Progressbar(frame, mode="determinate", maximum=1)
+        self.progress_bar.grid(row=5, column=0, columnspan=2, sticky=tk.EW)
+        ttk.Label(frame, textvariable=self.status).grid(row=6, column=0, columnspan=2, sticky=tk.W, pady=5)
 
     def browse_zip(self):
         path = filedialog.askopenfilename(filetypes=[("ZIP Files", "*.zip")])
@@ -123,46 +423,248 @@ class ShpConverterUI:
         if not zip_file or not os.path.exists(zip_file):
             messagebox.showerror("오류", "유효한 ZIP 파일을 선택해주세요.")
             return
+        if self.worker and self.worker.is_alive():
+            return
 
         # 다운로드 폴더 경로 설정
         download_dir = os.path.join(os.path.expanduser("~"), "Downloads")
         output_name = os.path.splitext(os.path.basename(zip_file))[0] + ".dxf"
         output_path = os.path.join(download_dir, output_name)
 
-        # 임시 디렉토리 생성
-        temp_dir = tempfile.mkdtemp()
-        
+        self.cancel_event = threading.Event()
+        self.started = time.monotonic()
+        self.run_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+        self.progress_bar.config(value=0, maximum=1)
+        self.status.set("SHP 파일 확인 중...")
+
+        self.worker = threading.Thread(target=self._convert_worker, args=(zip_file, field, output_path, download_dir), daemon=True)
+        self.worker.start()
+        self.root.after(100, self.poll_worker)
+
+    def _convert_worker(self, zip_file, field, output_path, download_dir):
+        """작업 스레드: 변환 실행 후 결과를 이벤트 큐로 전달 (Tk 위젯은 건드리지 않음)"""
         try:
-            # ZIP 압축 해제
-            with zipfile.ZipFile(zip_file, 'r') as z:
-                z.extractall(temp_dir)
-            
-            # .shp 파일 찾기
-            shp_files = []
-            for root, dirs, files in os.walk(temp_dir):
-                for f in files:
-                    if f.lower().endswith(".shp"):
-                        shp_files.append(os.path.join(root, f))
+            # ZIP 압축을 풀지 않고 .shp 파일 목록만 조회 (구성 파일은 변환 시 ZIP에서 직접 읽음)
+            shp_files = list_zip_shapefiles(zip_file)
             
             if not shp_files:
                 raise Exception("압축파일 내에 .shp 파일이 없습니다.")
 
-            # 첫 번째 발견된 SHP 파일 변환
-            # (여러 SHP가 있을 경우 루프를 돌려 하나로 합치거나 각각 생성하도록 확장 가능)
-            success = convert_shp_to_dxf(shp_files[0], output_path, field)
-            
+            # 모든 SHP 파일을 파일별로 병렬 변환하여 하나의 DXF로 병합
+            success = convert_shps_to_dxf(shp_files, output_path, field, zip_path=zip_file,
+                                          progress=lambda phase, done, total: self.events.put(("progress", phase, done, total)),
+                                          cancel=self.cancel_event)
+            self.events.put(("done", success, output_path, download_dir))
+        except ConversionCancelled:
+            self.events.put(("cancelled",))
+        except Exception as e:
+            self.events.put(("error", str(e)))
+
+    def poll_worker(self):
+        """UI 스레드: 이벤트 큐를 비우고 마지막 진행 상태만 화면에 반영"""
+        latest, finished = None, None
+        while True:
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if event[0] == "progress":
+                latest = event
+            else:
+                finished = event
+
+        if latest:
+            _, phase, done, total = latest
+            elapsed = max(time.monotonic() - self.started, 1e-6)
+            self.progress_bar.config(maximum=max(total, 1), value=done)
+            text = f"{PHASE_LABELS.get(phase, phase)}: {done:,} / {total:,}"
+            if phase == "read":
+                text += f" ({done / elapsed:,.0f} records/s)"
+            self.status.set(text)
+
+        if finished is None:
+            self.root.after(100, self.poll_worker)
+            return
+
+        self.run_button.config(state=tk.NORMAL)
+        self.cancel_button.config(state=tk.DISABLED)
+        elapsed = time.monotonic() - self.started
+        if finished[0] == "done":
+            _, success, output_path, download_dir = finished
             if success:
+                self.status.set(f"완료 ({elapsed:.1f}초)")
                 messagebox.showinfo("성공", f"변환이 완료되었습니다!\n\n저장위치: {output_path}")
                 # 폴더 열기 (윈도우 전용)
-                os.startfile(download_dir)
+                if hasattr(os, "startfile"):
+                    os.startfile(download_dir)
+            else:
+                self.status.set("변환할 데이터가 없습니다.")
+        elif finished[0] == "cancelled":
+            self.status.set("취소되었습니다.")
+        else:
+            self.status.set("실패")
+            messagebox.showerror("실패", f"변환 중 오류 발생:\n{finished[1]}")
 
-        except Exception as e:
-            messagebox.showerror("실패", f"변환 중 오류 발생:\n{str(e)}")
-        finally:
-            # 임시 파일 삭제
-            shutil.rmtree(temp_dir)
+    def cancel_conversion(self):
+        if self.cancel_event:
+            self.cancel_event.set()
+            self.cancel_button.config(state=tk.DISABLED)
+            self.status.set("취소하는 중...")
+
+    def on_close(self):
+        # 변환 중 창을 닫으면 워커를 취소하고 종료
+        if self.cancel_event:
+            self.cancel_event.set()
+        self.root.destroy()
+
+# [추가] 헤드리스 일괄 변환 (CLI)
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _sidecar_path(output_path):
+    """변환 원본 정보(sha256, 레이어 필드)를 기록하는 파일 (--skip hash 판별용)"""
+    return output_path + ".src.json"
+
+def collect_inputs(patterns):
+    """glob 패턴/폴더/파일 목록을 변환할 ZIP·SHP 경로 목록으로 정리 (정렬, 중복 제거)"""
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "*.zip")
+        for path in glob.glob(pattern, recursive=True):
+            if os.path.isfile(path) and path.lower().endswith((".zip", ".shp")):
+                paths.add(os.path.abspath(path))
+    return sorted(paths)
+
+def plan_outputs(input_paths, output_dir):
+    """입력별 출력 DXF 경로 (파일명이 겹치면 정렬 순서대로 _2, _3 ... 접미사)"""
+    used = set()
+    outputs = []
+    for path in input_paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        name, n = stem, 1
+        while name.lower() in used:
+            n += 1
+            name = f"{stem}_{n}"
+        used.add(name.lower())
+        outputs.append(os.path.join(output_dir, name + ".dxf"))
+    return outputs
+
+def is_up_to_date(input_path, output_path, layer_field, skip):
+    """skip 모드(mtime/hash/none)에 따라 기존 출력을 재사용할 수 있는지 판별"""
+    if skip == "none" or not os.path.exists(output_path):
+        return False
+    if skip == "mtime":
+        return os.path.getmtime(output_path) >= os.path.getmtime(input_path)
+    try:
+        with open(_sidecar_path(output_path), encoding="utf-8") as f:
+            source = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return source.get("layer_field") == layer_field and source.get("sha256") == _file_sha256(input_path)
+
+def convert_file(input_path, output_path, layer_field='LAYER', workers=1, skip="mtime", quiet=False):
+    """ZIP 또는 SHP 1개를 DXF로 변환 (일괄 변환 프로세스 풀 워커), 결과 요약 dict 반환"""
+    started = time.perf_counter()
+    result = {"input": input_path, "output": output_path, "status": "skipped", "seconds": 0.0}
+    try:
+        if is_up_to_date(input_path, output_path, layer_field, skip):
+            result["seconds"] = time.perf_counter() - started
+            return result
+        with ExitStack() as stack:
+            if quiet:
+                stack.enter_context(redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+            if input_path.lower().endswith(".zip"):
+                shp_files = list_zip_shapefiles(input_path)
+                success = convert_shps_to_dxf(shp_files, output_path, layer_field, workers, zip_path=input_path) if shp_files else None
+            else:
+                success = convert_shps_to_dxf([input_path], output_path, layer_field, workers)
+        if success:
+            result["status"] = "converted"
+            if skip == "hash":
+                with open(_sidecar_path(output_path), "w", encoding="utf-8") as f:
+                    json.dump({"sha256": _file_sha256(input_path), "layer_field": layer_field}, f)
+        else:
+            result["status"] = "empty"
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = str(e)
+    result["seconds"] = time.perf_counter() - started
+    return result
+
+def run_batch(patterns, output_dir, layer_field='LAYER', workers=None, skip="mtime", quiet=False):
+    """여러 ZIP/SHP를 프로세스 풀로 동시에 변환하고 시간 요약 출력 (실패가 없으면 True)"""
+    inputs = collect_inputs(patterns)
+    if not inputs:
+        print("변환할 ZIP/SHP 파일이 없습니다.")
+        return False
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = plan_outputs(inputs, output_dir)
+    workers = max(1, workers or os.cpu_count() or 1)
+
+    # 파일 수가 작업자 수보다 적으면 남는 몫을 파일 내부 SHP 병렬 변환에 배분
+    file_workers = min(workers, len(inputs))
+    inner_workers = max(1, workers // file_workers)
+    print(f"🚀 {len(inputs)}개 파일 변환 시작 (동시 {file_workers}개, 파일당 작업자 {inner_workers}, skip={skip})")
+
+    started = time.perf_counter()
+    results = []
+    if file_workers == 1:
+        for input_path, output_path in zip(inputs, outputs):
+            results.append(convert_file(input_path, output_path, layer_field, inner_workers, skip, quiet))
+            _print_result(results[-1], len(results), len(inputs))
+    else:
+        with ProcessPoolExecutor(max_workers=file_workers) as executor:
+            futures = [executor.submit(convert_file, input_path, output_path, layer_field, inner_workers, skip, quiet)
+                       for input_path, output_path in zip(inputs, outputs)]
+            for future in as_completed(futures):
+                results.append(future.result())
+                _print_result(results[-1], len(results), len(inputs))
+    elapsed = time.perf_counter() - started
+
+    # 시간 요약
+    counts = {}
+    for r in results:
+        counts[r["status"]] = counts.get(r["status"], 0) + 1
+    busy = sum(r["seconds"] for r in results)
+    print("\n📊 변환 요약")
+    print(f"  - 파일: {len(results)}개 (" + ", ".join(f"{k} {v}" for k, v in sorted(counts.items())) + ")")
+    print(f"  - 경과 시간: {elapsed:.1f}초 (파일별 합계 {busy:.1f}초, 병렬 효율 {busy / max(elapsed, 1e-6):.1f}배)")
+    slowest = sorted((r for r in results if r["status"] == "converted"), key=lambda r: r["seconds"], reverse=True)[:5]
+    for r in slowest:
+        print(f"    {r['seconds']:8.1f}초  {os.path.basename(r['input'])}")
+    for r in results:
+        if r["status"] == "failed":
+            print(f"  ❌ {r['input']}: {r.get('error')}")
+    return not counts.get("failed")
+
+def _print_result(result, done, total):
+    icons = {"converted": "✅", "skipped": "⏭️", "empty": "⚠️", "failed": "❌"}
+    print(f"[{done}/{total}] {icons.get(result['status'], '')} {result['status']:<9} {result['seconds']:6.1f}초  {os.path.basename(result['input'])}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SHP(ZIP) → DXF 일괄 변환 (인자 없이 실행하면 GUI)")
+    parser.add_argument("inputs", nargs="+", help="ZIP/SHP 파일, glob 패턴(따옴표로 감싸기, ** 지원) 또는 폴더(폴더 안의 *.zip)")
+    parser.add_argument("-o", "--output-dir", default=".", help="DXF 저장 폴더 (기본: 현재 폴더)")
+    parser.add_argument("-f", "--layer-field", default="LAYER", help="레이어명으로 사용할 필드 (기본: LAYER)")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="작업 프로세스 수 (기본: CPU 수)")
+    parser.add_argument("--skip", choices=["mtime", "hash", "none"], default="mtime",
+                        help="최신 출력 건너뛰기 기준: mtime(출력이 입력보다 새로우면), hash(원본 sha256 기록 비교), none(항상 변환)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="파일별 상세 로그 숨김")
+    args = parser.parse_args(argv)
+    return run_batch(args.inputs, args.output_dir, args.layer_field, args.workers, args.skip, args.quiet)
 
 if __name__ == "__main__":
+    # 실행 파일(exe)로 배포 시 프로세스 풀 워커가 UI를 다시 띄우지 않도록 처리
+    multiprocessing.freeze_support()
+    # [추가] 인자가 있거나 tkinter가 없으면 헤드리스 CLI로 실행
+    if len(sys.argv) > 1 or tk is None:
+        sys.exit(0 if main() else 1)
     root = tk.Tk()
     # 앱 아이콘이나 스타일을 asin_app.py와 유사하게 맞출 수 있습니다.
     app = ShpConverterUI(root)
@@ -0,0 +1,7 @@
+-- 사진 백업 콘텐츠 해시 중복 제거 (backup_to_drive.py, BACKUP_CONTENT_DEDUP=1로 켜기 전에 적용)
+-- content_hash: 원본 파일 MD5 (R2 ETag 또는 전송 중 계산), 같은 프로젝트에 같은 해시의 완료 행이 있으면 Drive 업로드를 생략
+alter table backup_logs add column if not exists content_hash text;
+
+create index if not exists backup_logs_project_content_hash_idx
+    on backup_logs (project_id, content_hash)
+    where status = 'completed';
@@ -0,0 +1,26 @@
+-- 사진 백업 실행 요약 (backup_to_drive.py, BACKUP_RECORD_RUNS=1)
+-- stages: 단계별(r2/r2_read/gas/drive/db_*/file) 지연 시간 히스토그램 및 p50/p95/p99
+create table if not exists backup_runs (
+    id bigint generated always as identity primary key,
+    started_at timestamptz not null,
+    finished_at timestamptz not null,
+    engine text,
+    workers int,
+    concurrency int,
+    transfer_mode text,
+    elapsed_sec double precision,
+    files_completed int,
+    files_failed int,
+    files_skipped int,
+    files_deduped int,
+    bytes_downloaded bigint,
+    bytes_uploaded bigint,
+    download_bytes_per_sec double precision,
+    upload_bytes_per_sec double precision,
+    files_per_sec double precision,
+    counters jsonb,
+    stages jsonb
+);
+
+create index if not exists backup_runs_started_idx
+    on backup_runs (started_at desc);
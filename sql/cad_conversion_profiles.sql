@@ -0,0 +1,20 @@
+-- 변환 사전 분석(Preflight) 결과 보관 (convert_r2.py run_preflight, 용량 계획용)
+-- 프로젝트당 최신 결과 1행 (run_preflight가 project_id 기준 upsert)
+create table if not exists cad_conversion_profiles (
+    id bigint generated always as identity primary key,
+    project_id bigint not null,
+    input_type text,
+    profile jsonb not null,
+    plan jsonb,
+    created_at timestamptz not null default now()
+);
+
+-- 기존 테이블: 프로젝트별 최신 행만 남기고 정리한 뒤 unique 인덱스로 교체
+delete from cad_conversion_profiles p
+using cad_conversion_profiles newer
+where newer.project_id = p.project_id
+  and (newer.created_at, newer.id) > (p.created_at, p.id);
+
+drop index if exists cad_conversion_profiles_project_idx;
+create unique index if not exists cad_conversion_profiles_project_key
+    on cad_conversion_profiles (project_id);
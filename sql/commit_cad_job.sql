@@ -0,0 +1,63 @@
+-- 변환 작업 메타데이터 일괄 기록 (convert_r2.py commit_cad_job, 한 번의 RPC 호출 = 한 트랜잭션)
+-- p_files: cad_files 행 목록 (같은 project_id + file_type의 기존 행은 교체)
+-- p_details: project_details 갱신 내용 (pipe_info / manholes_info / facilities_info, null이면 건너뜀)
+-- p_status: cad_projects.status (null이면 건너뜀)
+-- p_removed: 삭제할 cad_files 파일 종류 (예: 중심선 없이 재변환된 프로젝트의 chainage_index)
+-- 이전 4개 인자 버전이 있으면 먼저 삭제: drop function if exists commit_cad_job(bigint, jsonb, jsonb, text);
+create or replace function commit_cad_job(
+    p_project_id bigint,
+    p_files jsonb default '[]'::jsonb,
+    p_details jsonb default null,
+    p_status text default null,
+    p_removed text[] default '{}'
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_files int := 0;
+    v_details int := 0;
+    v_status int := 0;
+    v_removed int := 0;
+begin
+    if coalesce(array_length(p_removed, 1), 0) > 0 then
+        delete from cad_files
+        where project_id = p_project_id
+          and file_type = any(p_removed);
+        get diagnostics v_removed = row_count;
+    end if;
+
+    if jsonb_array_length(coalesce(p_files, '[]'::jsonb)) > 0 then
+        delete from cad_files
+        where project_id = p_project_id
+          and file_type in (select f->>'file_type' from jsonb_array_elements(p_files) f);
+
+        insert into cad_files (project_id, file_type, file_path, file_size, source_crs, cache_expiry, updated_at)
+        select p_project_id,
+               f->>'file_type',
+               f->>'file_path',
+               (f->>'file_size')::bigint,
+               f->>'source_crs',
+               (f->>'cache_expiry')::timestamptz,
+               coalesce((f->>'updated_at')::timestamptz, now())
+        from jsonb_array_elements(p_files) f;
+        get diagnostics v_files = row_count;
+    end if;
+
+    if p_details is not null then
+        update project_details
+        set pipe_info = coalesce(p_details->'pipe_info', pipe_info),
+            manholes_info = coalesce(p_details->'manholes_info', manholes_info),
+            facilities_info = coalesce(p_details->'facilities_info', facilities_info),
+            updated_at = now()
+        where project_id = p_project_id;
+        get diagnostics v_details = row_count;
+    end if;
+
+    if p_status is not null then
+        update cad_projects set status = p_status where id = p_project_id;
+        get diagnostics v_status = row_count;
+    end if;
+
+    return jsonb_build_object('files', v_files, 'details', v_details, 'status', v_status, 'removed', v_removed);
+end;
+$$;